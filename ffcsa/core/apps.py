@@ -15,6 +15,11 @@ class CoreConfig(AppConfig):
     label = 'ffcsa_core'
 
     def ready(self):
+        # connect the location count signal handlers
+        from ffcsa.core import dropsites  # noqa
+        from ffcsa.core import settings_cache
+        settings_cache.install()
+
         # We do this here b/c we only want this to be called when the server is started,
         # not when a management cmd is called
         if 'runserver' not in sys.argv:
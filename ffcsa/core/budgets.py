@@ -2,17 +2,20 @@ import logging
 from importlib import import_module
 
 from django.contrib.auth import get_user_model
-from django.db.models.signals import post_delete, post_save
+from django.db.models.signals import m2m_changed, post_delete, post_save
 from django.dispatch import receiver
 
-from ffcsa.shop.models import Order, Cart
+from ffcsa.shop.models import Order, Cart, DiscountCode
 from mezzanine.conf import settings
 
 from ffcsa.core.sessions import UserSession
-from .models import Payment
+from .models import Payment, Profile
 
 logger = logging.getLogger(__name__)
 
+# Profile fields the cart discount depends on
+_DISCOUNT_PROFILE_FIELDS = {'discount_code', 'paid_signup_fee'}
+
 engine = import_module(settings.SESSION_ENGINE)
 SessionStore = engine.SessionStore
 
@@ -55,3 +58,23 @@ def payment_handler(**kwargs):
 @receiver(post_delete, sender=Order)
 def order_handler(**kwargs):
     clear_cached_budget_for_user_id(kwargs['instance'].user_id)
+
+
+@receiver(post_save, sender=Profile)
+def profile_handler(instance, update_fields=None, **kwargs):
+    if update_fields is None or _DISCOUNT_PROFILE_FIELDS & set(update_fields):
+        clear_cached_budget(instance.user)
+
+
+@receiver(post_save, sender=DiscountCode)
+@receiver(post_delete, sender=DiscountCode)
+def discount_code_handler(instance, **kwargs):
+    for user in User.objects.filter(profile__discount_code_id=instance.id):
+        clear_cached_budget(user)
+
+
+@receiver(m2m_changed, sender=DiscountCode.products.through)
+@receiver(m2m_changed, sender=DiscountCode.categories.through)
+def discount_code_m2m_handler(instance, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear') and isinstance(instance, DiscountCode):
+        discount_code_handler(instance)
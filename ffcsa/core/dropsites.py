@@ -1,7 +1,14 @@
+import threading
+import time
+
+from dateutil.relativedelta import relativedelta
 from django.conf import settings
-from django.db import connection
+from django.db import connection, transaction
+from django.db.models.signals import post_delete, post_init, post_save
+from django.dispatch import receiver
 
 from ffcsa.core.utils import get_next_day
+from ffcsa.shop import order_calendar
 
 _DROPSITE_DICT = {}
 DROPSITE_CHOICES = []
@@ -20,29 +27,35 @@ def is_valid_dropsite(user):
 
 
 def get_pickup_date(user):
-    from ffcsa.shop.orders import get_order_period_for_user
-    week_start, week_end = get_order_period_for_user(user)
-
     if user.profile.home_delivery:
-        zip = user.profile.delivery_address.zip
-        day = settings.HOME_DELIVERY_DAY[zip] if zip in settings.HOME_DELIVERY_DAY else settings.HOME_DELIVERY_DAY[
-            'default']
+        drop_site, zip = None, user.profile.delivery_address.zip
     else:
-        day = _DROPSITE_DICT[user.profile.drop_site]['pickupDay']
+        drop_site, zip = user.profile.drop_site, None
 
-    return get_next_day(day, week_start)
+    week_start, week_end = order_calendar.get_order_period(drop_site, zip)
+    return get_next_day(order_calendar.get_pickup_day(drop_site, zip), week_start)
 
 
-def get_full_drop_locations():
+# the location counts are materialized in the LocationCount table & memoized in each process for this many seconds,
+# so checking if a location is full doesn't hit the db on every request
+LOCATION_COUNTS_TTL = 60
+# profile fields that affect the location counts
+_COUNTED_PROFILE_FIELDS = {'drop_site', 'home_delivery', 'delivery_address', 'stripe_subscription_id'}
+_COUNTED_PROFILE_ATTNAMES = ('drop_site', 'home_delivery', 'delivery_address_id', 'stripe_subscription_id')
+
+# (expires, counts, full locations)
+_location_counts = None
+# set while a recount is waiting for the current transaction to commit
+_refresh_pending = threading.local()
+
+
+def count_locations():
     """
-    get a list of full locations. A Location is considered to be full
-    if the limit has been reached for that specific location, or if
-    the limit has been reached for a group of locations that contain
-    the location.
+    Count the number of active members at each location
 
     A location is either a dropsite, or a zip code for home delivery
 
-    :return: list of locations that are full
+    :return: {location: count}
     """
     cursor = connection.cursor()
     cursor.execute('''
@@ -64,10 +77,37 @@ def get_full_drop_locations():
     group by a.zip
     ''')
 
-    location_counts = {}
+    return {l: count for l, count in cursor}
+
+
+def refresh_location_counts():
+    """
+    Recount the members at each location & store the counts in the LocationCount table
+
+    :return: {location: count}
+    """
+    from ffcsa.core.models import LocationCount
+    global _location_counts
+
+    counts = count_locations()
+    with transaction.atomic():
+        LocationCount.objects.exclude(location__in=list(counts)).delete()
+        existing = {lc.location: lc for lc in LocationCount.objects.select_for_update()}
+        for location, count in counts.items():
+            lc = existing.get(location)
+            if lc is None:
+                LocationCount.objects.create(location=location, count=count)
+            elif lc.count != count:
+                lc.count = count
+                lc.save()
+
+    _location_counts = None
+    return counts
+
+
+def _get_full_locations(location_counts):
     full_locations = set()
-    for l, count in cursor:
-        location_counts[l] = count
+    for l, count in location_counts.items():
         # check if a given dropsite is full
         if l in _DROPSITE_DICT:
             limit = _DROPSITE_DICT[l]['memberLimit']
@@ -88,7 +128,111 @@ def get_full_drop_locations():
                 full_locations.update(group['locations'])
                 break
 
-    return list(full_locations)
+    return frozenset(full_locations)
+
+
+def _get_location_counts():
+    from ffcsa.core.models import LocationCount
+    global _location_counts
+
+    if _location_counts is None or _location_counts[0] <= time.time():
+        counts = dict(LocationCount.objects.values_list('location', 'count'))
+        if not counts:
+            # first run, or there are no members
+            counts = refresh_location_counts()
+        _location_counts = (time.time() + LOCATION_COUNTS_TTL, counts, _get_full_locations(counts))
+
+    return _location_counts
+
+
+def get_location_counts():
+    """
+    :return: {location: count} of the number of active members at each location
+    """
+    return dict(_get_location_counts()[1])
+
+
+def get_full_drop_locations():
+    """
+    get a list of full locations. A Location is considered to be full
+    if the limit has been reached for that specific location, or if
+    the limit has been reached for a group of locations that contain
+    the location.
+
+    A location is either a dropsite, or a zip code for home delivery
+
+    :return: list of locations that are full
+    """
+    return list(_get_location_counts()[2])
+
+
+def is_location_full(location):
+    return location in _get_location_counts()[2]
+
+
+def _refresh_pending_location_counts():
+    _refresh_pending.scheduled = False
+    refresh_location_counts()
+
+
+def _schedule_refresh():
+    # coalesce to a single recount per transaction. Outside of a transaction on_commit runs immediately, so a flag
+    # that is still set there belongs to a transaction that was rolled back. A recount lost to a savepoint rollback
+    # is picked up by the hourly refresh_location_counts cron job
+    if transaction.get_autocommit():
+        _refresh_pending.scheduled = False
+    if getattr(_refresh_pending, 'scheduled', False):
+        return
+    _refresh_pending.scheduled = True
+    transaction.on_commit(_refresh_pending_location_counts)
+
+
+def _counted_values(profile):
+    # deferred fields are missing from __dict__
+    return tuple(profile.__dict__.get(attname) for attname in _COUNTED_PROFILE_ATTNAMES)
+
+
+@receiver(post_init, sender='ffcsa_core.Profile')
+def profile_init_handler(instance, **kwargs):
+    instance._counted_values = _counted_values(instance)
+
+
+@receiver(post_save, sender='ffcsa_core.Profile')
+def profile_handler(instance, created, update_fields=None, **kwargs):
+    if update_fields is not None and not _COUNTED_PROFILE_FIELDS & set(update_fields):
+        return
+
+    # most profile saves (admin, forms, etc) don't change the location
+    values = _counted_values(instance)
+    if created or values != instance._counted_values:
+        _schedule_refresh()
+    instance._counted_values = values
+
+
+@receiver(post_delete, sender='ffcsa_core.Profile')
+def profile_delete_handler(**kwargs):
+    _schedule_refresh()
+
+
+@receiver(post_save, sender='shop.Order')
+def order_handler(instance, created, **kwargs):
+    from ffcsa.core.models import Profile
+    from ffcsa.shop.models import Order
+
+    if not created or not instance.user_id:
+        return
+
+    # Order.user_id is a plain integer column, not a relation
+    subscription_ids = Profile.objects.filter(user_id=instance.user_id) \
+        .values_list('stripe_subscription_id', flat=True)[:1]
+    if not subscription_ids or subscription_ids[0]:
+        # subscribing members are already counted
+        return
+
+    # members who ordered in the last month are already counted
+    month_ago = instance.time - relativedelta(months=1)
+    if not Order.objects.filter(user_id=instance.user_id, time__gte=month_ago).exclude(id=instance.id).exists():
+        _schedule_refresh()
 
 
 def get_color(dropsite_name):
@@ -9,10 +9,9 @@ from mezzanine.conf import settings
 from mezzanine.core.request import current_request
 from mezzanine.utils.email import send_mail_template
 
-from ffcsa.core import sendinblue, dropsites
+from ffcsa.core import member_sync, sendinblue, dropsites
 from ffcsa.core.dropsites import get_full_drop_locations
-from ffcsa.core.google import update_contact as update_google_contact
-from ffcsa.core.models import DropSiteInfo, PHONE_REGEX
+from ffcsa.core.models import PHONE_REGEX
 from ffcsa.core.utils import give_emoji_free_text
 from ffcsa.shop.models import OrderItem
 from ffcsa.shop.orders import get_order_period_for_user
@@ -220,7 +219,8 @@ class ProfileForm(accounts_forms.ProfileForm):
 
                 sib_template_name = 'Home Delivery' if user.profile.home_delivery else drop_site
 
-                sendinblue.update_or_add_user(user, sendinblue.NEW_USER_LISTS, sendinblue.NEW_USER_LISTS_TO_REMOVE)
+                member_sync.enqueue(user, sendinblue_sync=True, lists_to_add=sendinblue.NEW_USER_LISTS,
+                                    lists_to_remove=sendinblue.NEW_USER_LISTS_TO_REMOVE)
 
             user.profile.save()
 
@@ -248,51 +248,19 @@ class ProfileForm(accounts_forms.ProfileForm):
             elif 'drop_site' in self.changed_data:
                 sib_template_name = drop_site
 
-            update_google_contact(user)
-
-            # The following NOPs if settings.SENDINBLUE_ENABLED == False
+            # The sendinblue sync NOPs if settings.SENDINBLUE_ENABLED == False
             weekly_email_lists = ['WEEKLY_NEWSLETTER']
             lists_to_add = weekly_email_lists if user.profile.weekly_emails else None
             lists_to_remove = weekly_email_lists if not user.profile.weekly_emails else None
-            sendinblue.update_or_add_user(user, lists_to_add, lists_to_remove)
+            member_sync.enqueue(user, sendinblue_sync=True, lists_to_add=lists_to_add, lists_to_remove=lists_to_remove,
+                                google=True)
 
         # Send drop site information (or home delivery instructions)
         if settings.SENDINBLUE_ENABLED and \
                 (self._signup or
                  'drop_site' in self.changed_data or
                  'home_delivery' in self.changed_data or 'delivery_address' in self.changed_data):
-
-            user_dropsite_info_set = user.profile.dropsiteinfo_set.all()
-            user_dropsite_info = list(user_dropsite_info_set.filter(drop_site_template_name=sib_template_name))
-            params = {'FIRSTNAME': user.first_name}
-
-            # User has not received the notification before
-            if len(user_dropsite_info) == 0:
-                date_last_modified = sendinblue.send_transactional_email(sib_template_name, self.cleaned_data['email'],
-                                                                         params)
-
-                # If the email is successfully sent add an appropriate DropSiteInfo to the user
-                if date_last_modified is not False:
-                    _dropsite_info_obj = DropSiteInfo.objects.create(profile=user.profile,
-                                                                     drop_site_template_name=sib_template_name,
-                                                                     last_version_received=date_last_modified)
-                    _dropsite_info_obj.save()
-
-            # Check if user has received the latest version of the notification message
-            else:
-                date_last_modified = sendinblue.get_template_last_modified_date(sib_template_name)
-
-                user_dropsite_entry = user_dropsite_info[0]
-                if user_dropsite_entry.last_version_received != date_last_modified:
-                    email_result = sendinblue.send_transactional_email(sib_template_name, self.cleaned_data['email'],
-                                                                       params)
-
-                    # Don't update entry if email fails to send
-                    if email_result is not False:
-                        user_dropsite_entry.last_version_received = email_result
-                        user_dropsite_entry.save()
-
-            user.profile.save()
+            member_sync.enqueue(user, drop_site_template_name=sib_template_name)
 
         return user
 
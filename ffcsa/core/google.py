@@ -11,6 +11,9 @@ from googleapiclient.discovery import build
 SCOPES = ['https://www.googleapis.com/auth/contacts']
 
 creds = False
+# building the service fetches the discovery document, so we only want to do this once. The credentials are
+# refreshed by the service's http client as needed
+_service = None
 
 logger = logging.getLogger(__name__)
 
@@ -38,10 +41,17 @@ def authenticate():
 
 
 def people_service():
+    global _service
     if not creds and not authenticate():
         raise Exception("Failed to authenticate against google api.")
 
-    return build('people', 'v1', credentials=creds)
+    if _service is None:
+        _service = build('people', 'v1', credentials=creds, cache_discovery=False)
+    return _service
+
+
+def get_managed_group_ids():
+    return set(settings.GOOGLE_GROUP_IDS.values()) | {'contactGroups/myContacts'}
 
 
 def build_people_obj(user):
@@ -77,81 +87,29 @@ def add_contact(user):
         logger.error('Failed to create google contact for user:', user, e)
 
 
-def find_user(user_obj):
-    familyName = user_obj['names'][0]['familyName']
-    givenName = user_obj['names'][0]['givenName']
-    try:
-        service = people_service()
-        res = service.people().connections().list(resourceName="people/me", pageSize=2000,
-                                                  personFields="metadata,names,memberships").execute()
-        while True:
-            for person in res['connections']:
-                if 'names' not in person:
-                    continue
-                for name in person['names']:
-                    try:
-                        if name['familyName'] == familyName and name['givenName'] == givenName:
-                            return person
-                    except KeyError:
-                        pass
-
-            if 'nextPageToken' not in res:
-                return False
-
-            res = service.connections().list(resourceName="people/me", pageSize=2000,
-                                             requestSyncToken=res['nextPageToken'],
-                                             personFields="metadata,names,memberships").execute()
-    except Exception as e:
-        pass
-
-
-def get_user(resourceName):
-    try:
-        return people_service().people().get(resourceName=resourceName, personFields="metadata,memberships").execute()
-    except Exception as e:
-        return False
+def update_contact(user):
+    """
+    Create or update the google contact for the user. See ffcsa.core.google_sync
 
+    @return: (True, '') on success, (False, '<some error message>') on failure
+    """
+    from ffcsa.core import google_sync
 
-def update_contact(user):
     try:
-        obj = build_people_obj(user)
-        u = None
-        if user.profile.google_person_id:
-            u = get_user(user.profile.google_person_id)
-
-        if not u:
-            u = find_user(obj)
-            # This can happen if the contact is deleted, modified outside of the member store
-            if user.profile.google_person_id:
-                user.profile.google_person_id = None
-
-        if not u:
-            logger.warning('Failed to update google contact, attempting to create contact for user:', user)
-            if not add_contact(user):
-                send_mail(
-                    "Failed Google Authentication %s" % settings.SITE_TITLE,
-                    "Failed to update google contact for user" + user.first_name + " " + user.last_name,
-                    settings.DEFAULT_FROM_EMAIL,
-                    [settings.ACCOUNTS_APPROVAL_EMAILS],
-                    fail_silently=True,
-                )
-            return
-
-        if not user.profile.google_person_id:
-            user.profile.google_person_id = u['resourceName']
-            user.profile.save()
-
-        # check if the user has any memberships that we don't manage. If se, keep those
-        managed_memberships = settings.GOOGLE_GROUP_IDS.values()
-        for membership in u.get('memberships', []):
-            if 'contactGroupMembership' in membership and membership['contactGroupMembership'][
-                'contactGroupResourceName'] not in managed_memberships:
-                obj['memberships'].append(membership)
-
-        update_fields = ",".join(obj.keys())
-        obj['metadata'] = u['metadata']
-
-        people_service().people().updateContact(resourceName=u['resourceName'], updatePersonFields=update_fields,
-                                                body=obj).execute()
+        result = google_sync.sync_contacts([user])
+        errors = [str(e) for u, e in result.failed]
     except Exception as e:
-        logger.error('Failed to update google contact for user:', user, e)
+        errors = [str(e)]
+
+    if errors:
+        logger.error('Failed to update google contact for user: %s %s', user, errors)
+        send_mail(
+            "Failed Google Authentication %s" % settings.SITE_TITLE,
+            "Failed to update google contact for user" + user.first_name + " " + user.last_name,
+            settings.DEFAULT_FROM_EMAIL,
+            [settings.ACCOUNTS_APPROVAL_EMAILS],
+            fail_silently=True,
+        )
+        return False, '; '.join(errors)
+
+    return True, ''
@@ -0,0 +1,280 @@
+"""
+Local mirror of the FFCSA Google contacts.
+
+Instead of scanning every connection whenever we need to find a member's contact, we keep a GoogleContact row for
+each connection. The mirror is refreshed incrementally using the People api sync tokens, so a refresh only returns the
+contacts that changed since the last one. Member contacts are created & updated in batches using the etags from the
+mirror, so no per-member lookups are needed.
+
+Every function takes an optional ``service`` so it can be run against a stubbed People service.
+"""
+import json
+import logging
+from collections import namedtuple
+
+from django.core.cache import cache
+from django.db import transaction
+from googleapiclient.errors import HttpError
+
+from ffcsa.core import google
+from ffcsa.core.models import GoogleContact
+
+logger = logging.getLogger(__name__)
+
+PERSON_FIELDS = 'metadata,names,emailAddresses,memberships'
+# max page size the connections endpoint allows
+PAGE_SIZE = 1000
+# max number of requests we send in a single batch
+BATCH_SIZE = 50
+
+# sync tokens expire after 7 days, after which a full sync is required
+_SYNC_TOKEN_KEY = 'ffcsa.core.google_sync.sync_token'
+_SYNC_TOKEN_TTL = 60 * 60 * 24 * 6
+
+RefreshResult = namedtuple('RefreshResult', ['full', 'updated', 'deleted', 'requests'])
+SyncResult = namedtuple('SyncResult', ['created', 'updated', 'failed'])
+
+
+def _service(service):
+    return service if service is not None else google.people_service()
+
+
+def _contact_fields(person):
+    names = person.get('names') or [{}]
+    emails = person.get('emailAddresses') or [{}]
+    return {
+        'etag': person.get('etag', ''),
+        'given_name': names[0].get('givenName', ''),
+        'family_name': names[0].get('familyName', ''),
+        'email': emails[0].get('value', '').lower(),
+        'memberships': json.dumps(person.get('memberships', [])),
+    }
+
+
+def _list_connections(service, sync_token=None):
+    """
+    Yields each page of connections. If sync_token is provided, only the connections changed since the token was
+    issued are returned
+    """
+    params = {
+        'resourceName': 'people/me',
+        'pageSize': PAGE_SIZE,
+        'personFields': PERSON_FIELDS,
+        'requestSyncToken': True,
+    }
+    if sync_token:
+        params['syncToken'] = sync_token
+
+    while True:
+        res = service.people().connections().list(**params).execute()
+        yield res
+
+        if 'nextPageToken' not in res:
+            return
+        params['pageToken'] = res['nextPageToken']
+
+
+def _is_expired_sync_token(error):
+    return error.resp.status in (400, 410) and b'EXPIRED_SYNC_TOKEN' in (error.content or b'')
+
+
+def refresh(service=None, full=False):
+    """
+    Refresh the local mirror of the google contacts. An incremental refresh is made if we have a valid sync token,
+    otherwise all connections are fetched & any contacts no longer on google are removed.
+
+    @return: RefreshResult
+    """
+    service = _service(service)
+    sync_token = None if full else cache.get(_SYNC_TOKEN_KEY)
+
+    try:
+        return _refresh(service, sync_token)
+    except HttpError as e:
+        if not sync_token or not _is_expired_sync_token(e):
+            raise
+        logger.info('Google contacts sync token expired. Performing a full sync')
+        return _refresh(service, None)
+
+
+def refresh_changes(service=None):
+    """
+    Refresh the local mirror with the contacts changed since the last refresh. Unlike refresh, this never falls back
+    to fetching every connection. Without a valid sync token nothing is fetched, and the mirror is brought up to date
+    by the scheduled sync_google_contacts command.
+
+    @return: RefreshResult, or None if there was no valid sync token
+    """
+    service = _service(service)
+    sync_token = cache.get(_SYNC_TOKEN_KEY)
+    if not sync_token:
+        logger.info('No google contacts sync token. Using the mirror as is')
+        return None
+
+    try:
+        return _refresh(service, sync_token)
+    except HttpError as e:
+        if not _is_expired_sync_token(e):
+            raise
+        cache.delete(_SYNC_TOKEN_KEY)
+        logger.info('Google contacts sync token expired. Using the mirror as is')
+        return None
+
+
+def _refresh(service, sync_token):
+    existing = dict(GoogleContact.objects.values_list('resource_name', 'etag'))
+    seen = set()
+    to_create = {}
+    updated = deleted = requests = 0
+    next_sync_token = None
+
+    for page in _list_connections(service, sync_token):
+        requests += 1
+        next_sync_token = page.get('nextSyncToken', next_sync_token)
+
+        for person in page.get('connections', []):
+            resource_name = person['resourceName']
+
+            if person.get('metadata', {}).get('deleted'):
+                if resource_name in existing:
+                    GoogleContact.objects.filter(resource_name=resource_name).delete()
+                    deleted += 1
+                to_create.pop(resource_name, None)
+                continue
+
+            seen.add(resource_name)
+            if resource_name not in existing:
+                to_create[resource_name] = GoogleContact(resource_name=resource_name, **_contact_fields(person))
+            elif existing[resource_name] != person.get('etag'):
+                GoogleContact.objects.filter(resource_name=resource_name).update(**_contact_fields(person))
+                updated += 1
+
+    with transaction.atomic():
+        GoogleContact.objects.bulk_create(to_create.values())
+
+        if sync_token is None:
+            # on a full sync, anything we didn't see was deleted on google
+            stale = list(set(existing) - seen)
+            for i in range(0, len(stale), 500):
+                deleted += GoogleContact.objects.filter(resource_name__in=stale[i:i + 500]).delete()[0]
+
+    if next_sync_token:
+        cache.set(_SYNC_TOKEN_KEY, next_sync_token, _SYNC_TOKEN_TTL)
+
+    return RefreshResult(sync_token is None, updated + len(to_create), deleted, requests)
+
+
+def find_contact(user):
+    """
+    Returns the mirrored GoogleContact for the user, or None.
+
+    Contacts are matched by the profile's google_person_id, then by email & then by name
+    """
+    profile = user.profile
+    contacts = GoogleContact.objects
+
+    contact = None
+    if profile.google_person_id:
+        contact = contacts.filter(resource_name=profile.google_person_id).first()
+    if contact is None and user.email:
+        contact = contacts.filter(email=user.email.lower()).first()
+    if contact is None and user.first_name and user.last_name:
+        contact = contacts.filter(given_name=user.first_name, family_name=user.last_name).first()
+
+    return contact
+
+
+def _link(user, contact):
+    if user.profile.google_person_id != contact.resource_name:
+        user.profile.google_person_id = contact.resource_name
+        user.profile.save(update_fields=['google_person_id'])
+    if contact.user_id != user.id:
+        GoogleContact.objects.filter(user=user).exclude(id=contact.id).update(user=None)
+        contact.user = user
+        contact.save(update_fields=['user'])
+
+
+def _update_body(user, contact):
+    body = google.build_people_obj(user)
+
+    # keep any memberships that we don't manage
+    managed_memberships = google.get_managed_group_ids()
+    for membership in json.loads(contact.memberships):
+        group = membership.get('contactGroupMembership', {}).get('contactGroupResourceName')
+        if group and group not in managed_memberships:
+            body['memberships'].append(membership)
+
+    update_fields = ','.join(body.keys())
+    body['etag'] = contact.etag
+    return body, update_fields
+
+
+def _execute_batch(service, requests, callback):
+    """
+    Execute (request_id, request) pairs in batches, calling callback(request_id, response, exception) for each
+    """
+    for i in range(0, len(requests), BATCH_SIZE):
+        batch = service.new_batch_http_request(callback=callback)
+        for request_id, request in requests[i:i + BATCH_SIZE]:
+            batch.add(request, request_id=request_id)
+        batch.execute()
+
+
+def sync_contacts(users, service=None):
+    """
+    Create or update the google contacts for the given users. The changes since the last refresh are fetched first,
+    and the contacts are then created & updated using batch requests.
+
+    @return: SyncResult where failed is a list of (user, error)
+    """
+    service = _service(service)
+    refresh_changes(service)
+
+    users = {str(u.id): u for u in users}
+    contacts = {}
+    to_create = []
+    to_update = []
+
+    for user_id, user in users.items():
+        contact = find_contact(user)
+        if contact is None:
+            to_create.append((user_id, service.people().createContact(body=google.build_people_obj(user),
+                                                                      personFields=PERSON_FIELDS)))
+            continue
+
+        contacts[user_id] = contact
+        body, update_fields = _update_body(user, contact)
+        to_update.append((user_id, service.people().updateContact(resourceName=contact.resource_name,
+                                                                  updatePersonFields=update_fields,
+                                                                  personFields=PERSON_FIELDS,
+                                                                  body=body)))
+
+    created = []
+    updated = []
+    failed = []
+
+    def on_created(request_id, response, exception):
+        user = users[request_id]
+        if exception is not None:
+            failed.append((user, exception))
+            return
+        contact = GoogleContact.objects.create(resource_name=response['resourceName'], **_contact_fields(response))
+        _link(user, contact)
+        created.append(user)
+
+    def on_updated(request_id, response, exception):
+        user = users[request_id]
+        if exception is not None:
+            failed.append((user, exception))
+            return
+        contact = contacts[request_id]
+        for field, value in _contact_fields(response).items():
+            setattr(contact, field, value)
+        contact.save()
+        _link(user, contact)
+        updated.append(user)
+
+    _execute_batch(service, to_create, on_created)
+    _execute_batch(service, to_update, on_updated)
+
+    return SyncResult(created, updated, failed)
@@ -0,0 +1,157 @@
+"""
+Opt-in per request query & latency instrumentation.
+
+When settings.REQUEST_INSTRUMENTATION is True, InstrumentationMiddleware records the number of queries, duplicate
+query fingerprints, db time & total time of every request. The records are kept in a ring buffer in the shared cache,
+so the records of every worker can be viewed from the admin, or summarized with the request_stats command.
+"""
+import math
+import re
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+
+_COUNTER_KEY = 'ffcsa.core.instrumentation.counter'
+_SLOT_KEY = 'ffcsa.core.instrumentation.slot.{}'
+
+# records are only needed for recent traffic
+RECORD_TTL = 60 * 60 * 24 * 7
+# number of duplicate fingerprints kept for each request
+MAX_DUPLICATES = 5
+
+_NUMBER_RE = re.compile(r'\b\d+(\.\d+)?\b')
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_IN_RE = re.compile(r'\bIN \((?:\s*\?\s*,)*\s*\?\s*\)', re.IGNORECASE)
+_WHITESPACE_RE = re.compile(r'\s+')
+
+
+def is_enabled():
+    return settings.REQUEST_INSTRUMENTATION
+
+
+def get_buffer_size():
+    return settings.REQUEST_INSTRUMENTATION_BUFFER_SIZE
+
+
+def fingerprint(sql):
+    """
+    Normalize the query so the same query with different parameters has the same fingerprint
+    """
+    sql = _STRING_RE.sub('?', sql)
+    sql = _NUMBER_RE.sub('?', sql)
+    sql = _IN_RE.sub('IN (...)', sql)
+    return _WHITESPACE_RE.sub(' ', sql).strip()
+
+
+def get_view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    name = match.view_name if match else 'unresolved'
+
+    # all mezzanine pages are served by the same view, so also include the type of page
+    page = getattr(request, 'page', None)
+    if page is not None:
+        name = '{}:{}'.format(name, page.content_model)
+    return name
+
+
+def start(request):
+    request._instrumentation = (time.time(), connection.force_debug_cursor)
+    connection.queries_log.clear()
+    connection.force_debug_cursor = True
+
+
+def finish(request, response):
+    """
+    Record the queries & timings of the request
+    """
+    if not hasattr(request, '_instrumentation'):
+        return
+
+    started, force_debug_cursor = request._instrumentation
+    del request._instrumentation
+
+    queries = list(connection.queries_log)
+    connection.force_debug_cursor = force_debug_cursor
+
+    fingerprints = Counter(fingerprint(q['sql']) for q in queries)
+    duplicates = [(sql, count) for sql, count in fingerprints.most_common(MAX_DUPLICATES) if count > 1]
+
+    record({
+        'view': get_view_name(request),
+        'method': request.method,
+        'status': response.status_code,
+        'time': (time.time() - started) * 1000,
+        'db_time': sum(float(q['time']) for q in queries) * 1000,
+        'queries': len(queries),
+        'duplicates': duplicates,
+        'timestamp': started,
+    })
+
+
+def record(entry):
+    cache.add(_COUNTER_KEY, 0, None)
+    try:
+        i = cache.incr(_COUNTER_KEY)
+    except ValueError:
+        # the counter was evicted
+        cache.set(_COUNTER_KEY, 1, None)
+        i = 1
+    cache.set(_SLOT_KEY.format(i % get_buffer_size()), entry, RECORD_TTL)
+
+
+def get_records():
+    """
+    :return: the recorded requests, oldest first
+    """
+    keys = [_SLOT_KEY.format(i) for i in range(get_buffer_size())]
+    return sorted(cache.get_many(keys).values(), key=lambda r: r['timestamp'])
+
+
+def clear():
+    cache.delete_many([_SLOT_KEY.format(i) for i in range(get_buffer_size())])
+    cache.delete(_COUNTER_KEY)
+
+
+def percentile(values, p):
+    """
+    Nearest rank percentile of the values
+    """
+    values = sorted(values)
+    if not values:
+        return None
+    rank = max(int(math.ceil(p / 100 * len(values))), 1)
+    return values[rank - 1]
+
+
+def summarize(records, percentiles=(50, 95, 99)):
+    """
+    Summarize the records by view
+
+    :return: list of dicts, sorted by total time spent in the view
+    """
+    by_view = {}
+    for r in records:
+        by_view.setdefault(r['view'], []).append(r)
+
+    summary = []
+    for view, view_records in by_view.items():
+        duplicates = Counter()
+        for r in view_records:
+            for sql, count in r['duplicates']:
+                duplicates[sql] = max(duplicates[sql], count)
+
+        summary.append({
+            'view': view,
+            'requests': len(view_records),
+            'total_time': sum(r['time'] for r in view_records),
+            'time': [(p, percentile([r['time'] for r in view_records], p)) for p in percentiles],
+            'db_time': [(p, percentile([r['db_time'] for r in view_records], p)) for p in percentiles],
+            'queries': [(p, percentile([r['queries'] for r in view_records], p)) for p in percentiles],
+            'max_queries': max(r['queries'] for r in view_records),
+            'duplicates': duplicates.most_common(MAX_DUPLICATES),
+        })
+
+    return sorted(summary, key=lambda s: s['total_time'], reverse=True)
@@ -0,0 +1,194 @@
+"""
+Background queue for syncing members to our third party services (Sendinblue & Google contacts).
+
+Profile changes call ``enqueue`` which records a MemberSyncJob once the current transaction commits. Multiple
+requests for the same member are coalesced into a single job. Jobs are processed by the
+``process_member_sync_jobs`` management command, and retried with backoff on failure.
+"""
+import logging
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import F
+from django.utils.timezone import now
+from mezzanine.conf import settings
+
+from ffcsa.core import sendinblue
+from ffcsa.core.google import update_contact as update_google_contact
+from ffcsa.core.models import DropSiteInfo, MemberSyncJob
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = 6
+# a job is leased for this long while it is being processed
+LEASE = timedelta(minutes=10)
+
+
+def _backoff(attempts):
+    return timedelta(minutes=2 ** attempts)
+
+
+def enqueue(user, sendinblue_sync=False, lists_to_add=None, lists_to_remove=None, google=False,
+            drop_site_template_name=None, remove_member=False):
+    """
+    Queue a sync of the user once the current transaction is committed
+
+    @param sendinblue_sync: Update (or add) the user on Sendinblue
+    @param lists_to_add: Sendinblue list names the user should be added to
+    @param lists_to_remove: Sendinblue list names the user should be removed from
+    @param google: Update the user's google contact
+    @param drop_site_template_name: Send the drop site info email for the template, if the user hasn't
+                                    received the latest version
+    @param remove_member: The user is being removed from active membership. Implies sendinblue_sync
+    """
+    lists_to_add = list(lists_to_add or [])
+    lists_to_remove = list(lists_to_remove or [])
+    if remove_member:
+        sendinblue_sync = True
+        lists_to_add += sendinblue.FORMER_MEMBER_LISTS
+        lists_to_remove += sendinblue.FORMER_MEMBER_LISTS_TO_REMOVE
+
+    transaction.on_commit(
+        lambda: _enqueue(user.id, sendinblue_sync, lists_to_add, lists_to_remove, google, drop_site_template_name,
+                         remove_member))
+
+
+def _enqueue(user_id, sendinblue_sync, lists_to_add, lists_to_remove, google, drop_site_template_name,
+             remove_member=False):
+    with transaction.atomic():
+        job, created = MemberSyncJob.objects.select_for_update().get_or_create(user_id=user_id,
+                                                                                defaults={'run_at': now()})
+
+        # the latest request wins if the lists conflict
+        job.lists_to_add = (set(job.lists_to_add) - set(lists_to_remove)) | set(lists_to_add)
+        job.lists_to_remove = (set(job.lists_to_remove) - set(lists_to_add)) | set(lists_to_remove)
+        if sendinblue_sync:
+            # a later update re-adds a removed member's drop site, as it would if synced right away
+            job.sendinblue_remove_member = remove_member
+        job.sendinblue = job.sendinblue or sendinblue_sync
+        job.google = job.google or google
+        if drop_site_template_name:
+            job.drop_site_template_name = drop_site_template_name
+
+        job.version += 1
+        job.attempts = 0
+        job.run_at = now()
+        job.last_error = None
+        job.save()
+
+
+def send_drop_site_info(user, template_name):
+    """
+    Send drop site information (or home delivery instructions) if the user has not received the latest version
+
+    @return: False if the email failed to send
+    """
+    user_dropsite_info = list(user.profile.dropsiteinfo_set.filter(drop_site_template_name=template_name))
+    params = {'FIRSTNAME': user.first_name}
+
+    # User has not received the notification before
+    if len(user_dropsite_info) == 0:
+        date_last_modified = sendinblue.send_transactional_email(template_name, user.email, params)
+
+        # If the email is successfully sent add an appropriate DropSiteInfo to the user
+        if date_last_modified is False:
+            return False
+        DropSiteInfo.objects.create(profile=user.profile, drop_site_template_name=template_name,
+                                    last_version_received=date_last_modified)
+        return True
+
+    # Check if user has received the latest version of the notification message
+    date_last_modified = sendinblue.get_template_last_modified_date(template_name)
+
+    user_dropsite_entry = user_dropsite_info[0]
+    if user_dropsite_entry.last_version_received != date_last_modified:
+        email_result = sendinblue.send_transactional_email(template_name, user.email, params)
+
+        # Don't update entry if email fails to send
+        if email_result is False:
+            return False
+        user_dropsite_entry.last_version_received = email_result
+        user_dropsite_entry.save()
+
+    return True
+
+
+def process_job(job):
+    """
+    Run each part of the job. Parts that succeed are cleared from the job, so only the failed parts are retried.
+
+    @return: a list of errors
+    """
+    user = job.user
+    errors = []
+
+    if job.sendinblue:
+        success, msg = sendinblue.update_or_add_user(user, job.lists_to_add or None, job.lists_to_remove or None,
+                                                     remove_member=job.sendinblue_remove_member)
+        if success:
+            job.sendinblue = False
+        else:
+            errors.append('Sendinblue: {}'.format(msg))
+
+    if job.google:
+        success, msg = update_google_contact(user)
+        if success:
+            job.google = False
+        else:
+            errors.append('Google: {}'.format(msg))
+
+    if job.drop_site_template_name and settings.SENDINBLUE_ENABLED:
+        if send_drop_site_info(user, job.drop_site_template_name):
+            job.drop_site_template_name = None
+        else:
+            errors.append('Failed to send drop site info: {}'.format(job.drop_site_template_name))
+
+    return errors
+
+
+def process_jobs(limit=None):
+    """
+    Process all jobs that are due. Returns (processed, failed)
+    """
+    processed = failed = 0
+
+    jobs = MemberSyncJob.objects \
+        .filter(run_at__lte=now(), attempts__lt=MAX_ATTEMPTS) \
+        .select_related('user__profile') \
+        .order_by('run_at')
+    if limit:
+        jobs = jobs[:limit]
+
+    for job in jobs:
+        # lease the job, so concurrent workers don't process it as well
+        if not MemberSyncJob.objects.filter(id=job.id, version=job.version, run_at=job.run_at) \
+                .update(run_at=now() + LEASE):
+            continue
+
+        try:
+            errors = process_job(job)
+        except Exception as e:
+            logger.exception(e)
+            errors = [str(e)]
+
+        processed += 1
+        if not errors:
+            # if the version changed, the member was re-queued while we were processing, so leave the job
+            MemberSyncJob.objects.filter(id=job.id, version=job.version).delete()
+            continue
+
+        failed += 1
+        attempts = job.attempts + 1
+        if attempts >= MAX_ATTEMPTS:
+            logger.error('Giving up syncing member {}: {}'.format(job.user, errors))
+
+        MemberSyncJob.objects.filter(id=job.id, version=job.version).update(
+            sendinblue=job.sendinblue,
+            google=job.google,
+            drop_site_template_name=job.drop_site_template_name,
+            attempts=F('attempts') + 1,
+            run_at=now() + _backoff(attempts),
+            last_error='\n'.join(errors),
+        )
+
+    return processed, failed
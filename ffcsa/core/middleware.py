@@ -1,4 +1,6 @@
-from ffcsa.core.budgets import clear_cached_budget
+from django.core.exceptions import MiddlewareNotUsed
+
+from ffcsa.core import instrumentation
 from ffcsa.shop.utils import recalculate_remaining_budget
 
 
@@ -16,27 +18,20 @@ class BudgetMiddleware(object):
         return response
 
 
-class DiscountMiddleware(object):
+class InstrumentationMiddleware(object):
     """
-    Verifies discount_code is in the current session if the user has a discount_code
+    Records the queries & timings of each request when settings.REQUEST_INSTRUMENTATION is enabled
 
-    This middleware should run before the BudgetMiddleware
+    This middleware should be first, so the rest of the middleware is included in the timings
     """
 
-    def process_response(self, request, response):
-        if request.session.get("discount_code", None):
-            if not hasattr(request, 'user') \
-                    or not request.user.is_authenticated() or not request.user.profile.discount_code:
-                request.session["discount_code"] = None
-                request.session["discount_total"] = None
-                if hasattr(request, 'user'):
-                    clear_cached_budget(request.user)
-
-        elif hasattr(request, 'user') and request.user.is_authenticated() and request.user.profile.discount_code:
-            request.session["discount_code"] = request.user.profile.discount_code.code
-            total = request.cart.calculate_discount(
-                request.user.profile.discount_code)
-            request.session["discount_total"] = str(total)
-            clear_cached_budget(request.user)
+    def __init__(self):
+        if not instrumentation.is_enabled():
+            raise MiddlewareNotUsed()
 
+    def process_request(self, request):
+        instrumentation.start(request)
+
+    def process_response(self, request, response):
+        instrumentation.finish(request, response)
         return response
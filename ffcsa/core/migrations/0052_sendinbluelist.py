@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ffcsa_core', '0051_auto_20200724_1155'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SendinblueList',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('dropsite', 'Drop Site'), ('packout', 'Packout Day')], max_length=20)),
+                ('name', models.CharField(max_length=255)),
+                ('list_id', models.IntegerField()),
+                ('updated', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='sendinbluelist',
+            unique_together=set([('kind', 'name')]),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('ffcsa_core', '0052_sendinbluelist'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MemberSyncJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sendinblue', models.BooleanField(default=False)),
+                ('sendinblue_lists_to_add', models.TextField(default='[]')),
+                ('sendinblue_lists_to_remove', models.TextField(default='[]')),
+                ('google', models.BooleanField(default=False)),
+                ('drop_site_template_name', models.CharField(blank=True, max_length=255, null=True)),
+                ('version', models.IntegerField(default=0)),
+                ('attempts', models.IntegerField(default=0)),
+                ('run_at', models.DateTimeField(db_index=True)),
+                ('last_error', models.TextField(blank=True, null=True)),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
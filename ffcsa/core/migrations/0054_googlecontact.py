@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('ffcsa_core', '0053_membersyncjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GoogleContact',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('resource_name', models.CharField(max_length=255, unique=True)),
+                ('etag', models.CharField(blank=True, max_length=255)),
+                ('given_name', models.CharField(blank=True, max_length=255)),
+                ('family_name', models.CharField(blank=True, max_length=255)),
+                ('email', models.CharField(blank=True, db_index=True, max_length=255)),
+                ('memberships', models.TextField(default='[]')),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='googlecontact',
+            index=models.Index(fields=['family_name', 'given_name'], name='ffcsa_core__family__500a39_idx'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ffcsa_core', '0055_locationcount'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='membersyncjob',
+            name='sendinblue_remove_member',
+            field=models.BooleanField(default=False),
+        ),
+    ]
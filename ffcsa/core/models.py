@@ -218,6 +218,111 @@ class DropSiteInfo(models.Model):
         return self.drop_site_template_name
 
 
+class LocationCount(models.Model):
+    """
+    Materialized count of the active members at a location (drop site or home delivery zip). See
+    ffcsa.core.dropsites.get_full_drop_locations
+    """
+    location = models.CharField(max_length=255, unique=True)
+    count = models.IntegerField(default=0)
+    updated = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return "%s: %s" % (self.location, self.count)
+
+
+###################
+#  Sendinblue
+###################
+
+class SendinblueList(models.Model):
+    """
+    Locally persisted ids of the Sendinblue drop site & packout day lists. See ffcsa.core.sendinblue
+    """
+    DROP_SITE = 'dropsite'
+    PACKOUT_DAY = 'packout'
+    KIND_CHOICES = (
+        (DROP_SITE, 'Drop Site'),
+        (PACKOUT_DAY, 'Packout Day'),
+    )
+
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    name = models.CharField(max_length=255)
+    list_id = models.IntegerField()
+    updated = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('kind', 'name')
+
+    def __str__(self):
+        return "%s: %s" % (self.name, self.list_id)
+
+
+class MemberSyncJob(models.Model):
+    """
+    A pending sync of a member to our third party services (Sendinblue & Google contacts). Jobs are coalesced
+    per member and processed in the background. See ffcsa.core.member_sync
+    """
+    user = models.OneToOneField("auth.User", on_delete=models.CASCADE)
+    sendinblue = models.BooleanField(default=False)
+    sendinblue_lists_to_add = models.TextField(default='[]')
+    sendinblue_lists_to_remove = models.TextField(default='[]')
+    # the member cancelled their subscription, see sendinblue.update_or_add_user
+    sendinblue_remove_member = models.BooleanField(default=False)
+    google = models.BooleanField(default=False)
+    drop_site_template_name = models.CharField(max_length=255, blank=True, null=True)
+    # incremented every time the job is coalesced, so we don't lose requests made while processing
+    version = models.IntegerField(default=0)
+    attempts = models.IntegerField(default=0)
+    run_at = models.DateTimeField(db_index=True)
+    last_error = models.TextField(blank=True, null=True)
+
+    def __str__(self):
+        return "%s (attempts: %s)" % (self.user, self.attempts)
+
+    @property
+    def lists_to_add(self):
+        return json.loads(self.sendinblue_lists_to_add)
+
+    @lists_to_add.setter
+    def lists_to_add(self, value):
+        self.sendinblue_lists_to_add = json.dumps(sorted(set(value)))
+
+    @property
+    def lists_to_remove(self):
+        return json.loads(self.sendinblue_lists_to_remove)
+
+    @lists_to_remove.setter
+    def lists_to_remove(self, value):
+        self.sendinblue_lists_to_remove = json.dumps(sorted(set(value)))
+
+
+###################
+#  Google
+###################
+
+class GoogleContact(models.Model):
+    """
+    Local mirror of a Google contact, refreshed incrementally using People api sync tokens. See
+    ffcsa.core.google_sync
+    """
+    resource_name = models.CharField(max_length=255, unique=True)
+    etag = models.CharField(max_length=255, blank=True)
+    given_name = models.CharField(max_length=255, blank=True)
+    family_name = models.CharField(max_length=255, blank=True)
+    email = models.CharField(max_length=255, blank=True, db_index=True)
+    memberships = models.TextField(default='[]')
+    user = models.ForeignKey("auth.User", blank=True, null=True, on_delete=models.SET_NULL)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['family_name', 'given_name']),
+        ]
+
+    def __str__(self):
+        return "%s, %s (%s)" % (self.family_name, self.given_name, self.resource_name)
+
+
 ###################
 #  Payment
 ###################
@@ -1,7 +1,10 @@
+from ffcsa.shop import catalog
 from ffcsa.shop.orders import user_can_order
-from ffcsa.shop.models import Product
+from ffcsa.shop.models import Cart, Product, ProductVariation
 from ffcsa.shop.utils import recalculate_cart
 from django.contrib.messages import info, error
+from django.core.cache import cache
+from django.db.models import Case, Count, IntegerField, Sum, When
 from django.shortcuts import redirect
 from mezzanine.conf import settings
 from mezzanine.pages.page_processors import processor_for
@@ -11,15 +14,36 @@ from mezzanine.utils.views import paginate
 from ffcsa.core.models import Recipe
 
 
+# recipes are only listed if more than this ratio of their products are available
+RECIPE_AVAILABILITY_RATIO = .75
+
+
+def get_recipe_availability():
+    """
+    Returns {recipe_id: (available products, total products)} for all recipes, cached against the catalog version
+    """
+    key = catalog.cache_key('recipe_availability')
+    availability = cache.get(key)
+    if availability is None:
+        recipes = Recipe.objects \
+            .annotate(total_products=Count('recipeproduct'),
+                      available_products=Sum(Case(When(recipeproduct__product__available=True, then=1),
+                                                  default=0, output_field=IntegerField()))) \
+            .values_list('id', 'available_products', 'total_products')
+        availability = {id: (available or 0, total) for id, available, total in recipes}
+        cache.set(key, availability, catalog.CACHE_TTL)
+    return availability
+
+
 @processor_for('recipes', exact_page=True)
 def recipies_processor(request, page):
+    availability = get_recipe_availability()
     recipes = []
 
     for recipe in Recipe.objects.published(for_user=request.user).exclude(slug='recipes'):
-        total_products = recipe.products.count()
-        available_products = recipe.products.filter(available=True).count()
+        available_products, total_products = availability.get(recipe.id, (0, 0))
 
-        if available_products / total_products > .75:
+        if total_products and available_products / total_products > RECIPE_AVAILABILITY_RATIO:
             recipes.append(recipe)
 
     return {
@@ -37,9 +61,8 @@ def recipe_processor(request, page):
     if page.slug == 'recipes':
         return {}
 
-    settings.clear_cache()
     products = page.recipe.recipeproduct_set.filter(
-        product__in=page.recipe.products.published())
+        product__in=page.recipe.products.published()).select_related('product')
 
     if request.method == "POST":
         can_order, err = user_can_order(request.user)
@@ -87,7 +110,7 @@ def weekly_box(request, page):
             return
 
         box_contents = Product.objects.published(for_user=request.user
-                                                 ).filter(page.category.filters())
+                                                 ).filter(id__in=catalog.get_category_product_ids(page.category))
         if not request.user.profile.can_order_dairy:
             box_contents.filter(product__is_dairy=False)
 
@@ -99,23 +122,32 @@ def weekly_box(request, page):
 
 
 def add_box_items(box_contents, request):
-    remaining_budget = request.cart.remaining_budget()
+    box_contents = list(box_contents)
+    products = {product.id: product for product, quantity in box_contents}
+
+    # the default variation of each product
+    variations = {}
+    for variation in ProductVariation.objects \
+            .filter(product__in=list(products)) \
+            .prefetch_related('vendorproductvariation_set') \
+            .order_by('-default', 'id'):
+        if variation.product_id not in variations:
+            variation.product = products[variation.product_id]
+            variations[variation.product_id] = variation
+
+    lines = [(variations[product.id], quantity) for product, quantity in box_contents if product.id in variations]
     info(request, "Box items added to order")
 
-    for item, quantity in box_contents:
-        variation = item.variations.first()
-        if not item.available:
-            info(request, "{} is no longer available".format(item.title))
+    for result in request.cart.add_items(lines):
+        title = result.variation.product.title
+        if result.status == Cart.UNAVAILABLE:
+            info(request, "{} is no longer available".format(title))
 
-        elif remaining_budget < variation.price():
+        elif result.status == Cart.OVER_BUDGET:
             error(request, "You are over you budgeted amount")
             break
 
-        elif not variation.has_stock(1):
-            info(request, "{} is out of stock".format(item.title))
-
-        else:
-            request.cart.add_item(variation, quantity)
-            remaining_budget -= variation.price() * quantity
+        elif result.status == Cart.OUT_OF_STOCK:
+            info(request, "{} is out of stock".format(title))
 
     recalculate_cart(request)
@@ -1,11 +1,17 @@
 import calendar
 import json
 import logging
+import random
+import threading
+import time
+from collections import namedtuple
 
 from urllib.parse import quote as make_url_safe
 
 import requests
 import requests.exceptions
+from django.core.cache import cache
+from requests.adapters import HTTPAdapter
 
 from ffcsa.core import dropsites
 from ffcsa.shop.orders import get_order_window_for_user
@@ -35,6 +41,10 @@ NEW_USER_LISTS = ['WEEKLY_NEWSLETTER', 'WEEKLY_REMINDER', 'MEMBERS']
 
 NEW_USER_LISTS_TO_REMOVE = ['PROSPECTIVE_MEMBERS']
 
+FORMER_MEMBER_LISTS = ['FORMER_MEMBERS']
+
+FORMER_MEMBER_LISTS_TO_REMOVE = ['MEMBERS', 'WEEKLY_REMINDER']
+
 _HOME_DELIVERY_LIST = 'Home Delivery - {}'
 _PACKOUT_DAY_LIST = 'Packout - {}'
 
@@ -42,6 +52,114 @@ _PACKOUT_DAY_LIST = 'Packout - {}'
 # --------
 # General helper functions
 
+
+class SendinblueError(requests.exceptions.RequestException):
+    """
+    An HTTP 4xx or 5xx response from Sendinblue, raised by send_request
+    """
+
+    def __init__(self, message, status_code, *args, **kwargs):
+        super(SendinblueError, self).__init__(message, *args, **kwargs)
+        self.status_code = status_code
+
+
+# A single pooled session so connections (and TLS sessions) are re-used across requests
+_SESSION = requests.Session()
+_SESSION.mount('https://', HTTPAdapter(pool_maxsize=10))
+
+_TIMEOUT = getattr(settings, 'SENDINBLUE_TIMEOUT', (3.05, 10))  # (connect, read) in seconds
+_MAX_RETRIES = getattr(settings, 'SENDINBLUE_MAX_RETRIES', 2)
+_RETRY_BACKOFF = 0.5  # seconds
+# longest Retry-After we will sleep for. Requests are made from member facing requests, so give up instead
+_MAX_RETRY_AFTER = getattr(settings, 'SENDINBLUE_MAX_RETRY_AFTER', 5)  # seconds
+_IDEMPOTENT_METHODS = ('GET', 'PUT', 'DELETE')
+
+EndpointMetrics = namedtuple('EndpointMetrics', ['count', 'errors', 'retries', 'total_time', 'max_time'])
+
+_metrics = {}
+_metrics_lock = threading.Lock()
+
+
+def _endpoint_key(method, endpoint):
+    # group requests for individual contacts, templates, etc. under a single endpoint
+    path = '/'.join('{id}' if '@' in part or '%40' in part or part.isdigit() else part
+                    for part in endpoint.split('?')[0].strip('/').split('/'))
+    return '{} {}'.format(method.upper(), path)
+
+
+def _record_metrics(key, elapsed, retries, error):
+    with _metrics_lock:
+        m = _metrics.get(key, EndpointMetrics(0, 0, 0, 0.0, 0.0))
+        _metrics[key] = EndpointMetrics(m.count + 1, m.errors + (1 if error else 0), m.retries + retries,
+                                        m.total_time + elapsed, max(m.max_time, elapsed))
+
+
+def get_metrics():
+    """
+    Returns {'<METHOD> <endpoint>': EndpointMetrics} of the requests made by this process
+    """
+    with _metrics_lock:
+        return dict(_metrics)
+
+
+def reset_metrics():
+    with _metrics_lock:
+        _metrics.clear()
+
+
+def _should_retry(method, response=None, exception=None):
+    if exception is not None:
+        # the request was never sent if we timed out connecting, so it is always safe to retry
+        if isinstance(exception, requests.exceptions.ConnectTimeout):
+            return True
+        return isinstance(exception, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)) and \
+               method in _IDEMPOTENT_METHODS
+
+    if response.status_code == 429:
+        return True
+    return response.status_code >= 500 and method in _IDEMPOTENT_METHODS
+
+
+def _retry_delay(attempt, response=None):
+    """
+    @return: seconds to wait before retrying, or None if Sendinblue asked us to wait longer than _MAX_RETRY_AFTER
+    """
+    retry_after = response.headers.get('Retry-After') if response is not None else None
+    if retry_after and retry_after.isdigit():
+        retry_after = int(retry_after)
+        return retry_after if retry_after <= _MAX_RETRY_AFTER else None
+    # exponential backoff w/ full jitter
+    return random.uniform(0, _RETRY_BACKOFF * 2 ** attempt)
+
+
+def _request(method, url, headers, data, query):
+    """
+    Send the request, retrying on 5xx & 429 responses & connection errors
+    """
+    method = method.upper()
+    attempt = 0
+    while True:
+        response = None
+        try:
+            response = _SESSION.request(method, url, headers=headers, data=data, params=query, timeout=_TIMEOUT)
+            if attempt >= _MAX_RETRIES or not _should_retry(method, response=response):
+                return response, attempt
+        except requests.exceptions.RequestException as ex:
+            if attempt >= _MAX_RETRIES or not _should_retry(method, exception=ex):
+                raise
+
+        delay = _retry_delay(attempt, response)
+        if delay is None:
+            logger.warning('Sendinblue request {} {} failed ({}); not retrying after {}s'.format(
+                method, url, response.status_code, response.headers.get('Retry-After')))
+            return response, attempt
+
+        logger.warning('Sendinblue request {} {} failed ({}); retrying'.format(
+            method, url, response.status_code if response is not None else 'connection error'))
+        time.sleep(delay)
+        attempt += 1
+
+
 def send_request(endpoint, method='GET', query=None, data=None, headers=None):
     """
     Wrapper to simplify Sendinblue request handling
@@ -52,27 +170,36 @@ def send_request(endpoint, method='GET', query=None, data=None, headers=None):
     @param data: Dictionary of request payload for POST requests
     @param headers: Dictionary of request headers - 'content-type' and 'api-key' will be overwritten if provided
 
-    @return: Dictionary containing the JSON response; raises descriptive exceptions upon failure
+    @return: Dictionary containing the JSON response; raises SendinblueError for HTTP error responses
     """
 
+    key = _endpoint_key(method, endpoint)
     endpoint = _BASE_ENDPOINT + endpoint.lstrip('/')
     data = json.dumps(data) if data is not None else None
     headers = {} if headers is None else headers
     headers.update(_DEFAULT_HEADERS)
 
-    response = requests.request(method, endpoint, headers=headers, data=data, params=query)
+    start = time.monotonic()
+    retries = 0
+    response = None
+    try:
+        response, retries = _request(method, endpoint, headers, data, query)
+    finally:
+        _record_metrics(key, time.monotonic() - start, retries, response is None or response.status_code >= 400)
 
     if response.status_code >= 400:
         if response.status_code < 500:
             response_json = response.json()
             response_error = response_json.get('error', response_json)['message']  # SIB error format is not consistent
-            raise Exception('Sendinblue error: HTTP {}: {}'.format(response.status_code, response_error))
+            raise SendinblueError('Sendinblue error: HTTP {}: {}'.format(response.status_code, response_error),
+                                  response.status_code, response=response)
 
         else:
             response_json = response.json()
             response_error = response_json.get('error', response_json)['message']  # SIB error format is not consistent
-            raise Exception(
-                'Sendinblue internal server error: HTTP {}: {}'.format(response.status_code, response_error))
+            raise SendinblueError(
+                'Sendinblue internal server error: HTTP {}: {}'.format(response.status_code, response_error),
+                response.status_code, response=response)
 
     try:
         return response.json()
@@ -84,21 +211,9 @@ def _initialize_drop_site_lists():
     # Create a dictionary of {drop_site_name: id} of the SIB drop site mailing lists
     # If drop sites in settings.py do not have corresponding lists on SIB, this will create them
 
-    try:
-        # 50 is the max results the api will return. If we every have more then 50 dropsites, we will need to fix this
-        existing_lists = send_request('contacts/folders/{}/lists'.format(settings.SENDINBLUE_DROP_SITE_FOLDER_ID),
-                                      query={'limit': 50})
-
-    except requests.exceptions.ConnectionError as ex:
-        if settings.DEBUG:
-            logger.critical('The connection to Sendinblue failed while trying to initialize the drop site list. '
-                            'Using placeholder IDs.')
-
-            stub_ids = (_ for _ in range(len(dropsites.DROPSITE_CHOICES)))
-            return {ds[0]: ds_id for ds, ds_id in zip(dropsites.DROPSITE_CHOICES, stub_ids)}
-
-        else:
-            raise ex
+    # 50 is the max results the api will return. If we every have more then 50 dropsites, we will need to fix this
+    existing_lists = send_request('contacts/folders/{}/lists'.format(settings.SENDINBLUE_DROP_SITE_FOLDER_ID),
+                                  query={'limit': 50})
 
     drop_site_ids = {_list['name'].replace('Dropsite - ', ''): int(_list['id'])
                      for _list in existing_lists['lists']
@@ -150,9 +265,101 @@ def _initialize_packout_day_lists():
     return day_ids
 
 
-if settings.SENDINBLUE_ENABLED:
-    _DROP_SITE_IDS = _initialize_drop_site_lists()
-    _PACKOUT_DAY_IDS = _initialize_packout_day_lists()
+def _stub_list_ids(kind):
+    from ffcsa.core.models import SendinblueList
+
+    if kind == SendinblueList.DROP_SITE:
+        names = [ds[0] for ds in dropsites.DROPSITE_CHOICES]
+    else:
+        names = [_PACKOUT_DAY_LIST.format(calendar.day_name[w['packDay'] - 1]) for w in settings.ORDER_WINDOWS]
+    return {name: i for i, name in enumerate(names)}
+
+
+# List ids rarely change, so they are resolved lazily and persisted in the SendinblueList table. This keeps
+# importing this module (and therefore worker boot) from making any network calls.
+_LIST_ID_TTL = getattr(settings, 'SENDINBLUE_LIST_ID_TTL', 60 * 60 * 24)  # seconds
+_LIST_ID_RETRY = 5 * 60  # seconds to wait before re-trying to refresh stale list ids
+_list_ids = {}  # kind -> (expires, {name: id})
+
+
+def refresh_list_ids(kind=None):
+    """
+    Fetch the list ids from Sendinblue (creating any missing lists) and persist them
+
+    @param kind: SendinblueList.DROP_SITE or SendinblueList.PACKOUT_DAY. If None, all lists are refreshed
+    @return: {kind: {name: id}}
+    """
+    from django.db import transaction
+    from ffcsa.core.models import SendinblueList
+
+    initializers = {
+        SendinblueList.DROP_SITE: _initialize_drop_site_lists,
+        SendinblueList.PACKOUT_DAY: _initialize_packout_day_lists,
+    }
+
+    refreshed = {}
+    for k in ([kind] if kind else initializers.keys()):
+        ids = initializers[k]()
+
+        with transaction.atomic():
+            SendinblueList.objects.filter(kind=k).delete()
+            SendinblueList.objects.bulk_create(
+                [SendinblueList(kind=k, name=name, list_id=id) for name, id in ids.items()])
+
+        _list_ids[k] = (time.time() + _LIST_ID_TTL, ids)
+        refreshed[k] = ids
+
+    return refreshed
+
+
+def _get_list_ids(kind):
+    from django.utils.timezone import now
+    from ffcsa.core.models import SendinblueList
+
+    cached = _list_ids.get(kind)
+    if cached and cached[0] > time.time():
+        return cached[1]
+
+    rows = list(SendinblueList.objects.filter(kind=kind))
+    age = (now() - min(r.updated for r in rows)).total_seconds() if rows else None
+
+    if rows and age < _LIST_ID_TTL:
+        ids = {r.name: r.list_id for r in rows}
+        _list_ids[kind] = (time.time() + _LIST_ID_TTL - age, ids)
+        return ids
+
+    try:
+        return refresh_list_ids(kind)[kind]
+    except requests.exceptions.RequestException as ex:
+        # includes SendinblueError, raised for error responses
+        if rows:
+            logger.error('Failed to refresh the Sendinblue {} lists, using stale ids: {}'.format(kind, ex))
+            ids = {r.name: r.list_id for r in rows}
+        elif settings.DEBUG:
+            logger.critical('The connection to Sendinblue failed while trying to initialize the {} lists. '
+                            'Using placeholder IDs.'.format(kind))
+            ids = _stub_list_ids(kind)
+        else:
+            raise ex
+
+        _list_ids[kind] = (time.time() + _LIST_ID_RETRY, ids)
+        return ids
+
+
+def get_drop_site_ids():
+    """
+    @return: {drop_site_name: list_id} of the SIB drop site mailing lists
+    """
+    from ffcsa.core.models import SendinblueList
+    return _get_list_ids(SendinblueList.DROP_SITE)
+
+
+def get_packout_day_ids():
+    """
+    @return: {packout_list_name: list_id} of the SIB packout day mailing lists
+    """
+    from ffcsa.core.models import SendinblueList
+    return _get_list_ids(SendinblueList.PACKOUT_DAY)
 
 
 def get_packout_list_for_user(user):
@@ -232,10 +439,10 @@ def get_user(email=None, phone_number=None):
 
     attributes = user['attributes']
     list_ids = user['listIds']
-    drop_site = [name for name, site_list_id in _DROP_SITE_IDS.items() if site_list_id in list_ids]
+    drop_site = [name for name, site_list_id in get_drop_site_ids().items() if site_list_id in list_ids]
     drop_site = drop_site[0] if len(drop_site) != 0 else None
     packout_list = None
-    for list_name, id in _PACKOUT_DAY_IDS.items():
+    for list_name, id in get_packout_day_ids().items():
         if id in list_ids:
             packout_list = list_name
             break
@@ -268,12 +475,13 @@ def add_user(email, first_name, last_name, drop_site, phone_number=None):
     if not settings.SENDINBLUE_ENABLED:
         return True, ''
 
-    if drop_site not in _DROP_SITE_IDS.keys():
+    drop_site_ids = get_drop_site_ids()
+    if drop_site not in drop_site_ids.keys():
         msg = 'Drop site {} does not exist in settings.DROPSITES'.format(drop_site)
         logger.error(msg)
         return False, msg
 
-    drop_site_list_id = int(_DROP_SITE_IDS[drop_site])
+    drop_site_list_id = int(drop_site_ids[drop_site])
 
     phone_number = _format_phone_number(phone_number) if phone_number is not None else None
     if phone_number is False:
@@ -332,8 +540,8 @@ def update_or_add_user(user, lists_to_add=None, lists_to_remove=None, remove_mem
         else user.profile.drop_site
 
     if remove_member:
-        lists_to_add.extend(['FORMER_MEMBERS'])
-        lists_to_remove.extend(['MEMBERS', 'WEEKLY_REMINDER'])
+        lists_to_add.extend([l for l in FORMER_MEMBER_LISTS if l not in lists_to_add])
+        lists_to_remove.extend([l for l in FORMER_MEMBER_LISTS_TO_REMOVE if l not in lists_to_remove])
         drop_site = None
 
     if not remove_member and not user.profile.home_delivery and drop_site not in dropsites._DROPSITE_DICT:
@@ -413,17 +621,17 @@ def update_or_add_user(user, lists_to_add=None, lists_to_remove=None, remove_mem
     old_user_drop_site = old_user_info['drop_site']
     if old_user_drop_site != drop_site:
         if drop_site is not None:
-            body['listIds'].append(int(_DROP_SITE_IDS[drop_site]))
+            body['listIds'].append(int(get_drop_site_ids()[drop_site]))
         if old_user_drop_site is not None:
-            body['unlinkListIds'].append(int(_DROP_SITE_IDS[old_user_drop_site]))
+            body['unlinkListIds'].append(int(get_drop_site_ids()[old_user_drop_site]))
 
     # Swap packout day or remove
     old_user_packout_list = old_user_info['packout_list']
     if old_user_packout_list != packout_list:
         if not remove_member and packout_list is not None:
-            body['listIds'].append(int(_PACKOUT_DAY_IDS[packout_list]))
+            body['listIds'].append(int(get_packout_day_ids()[packout_list]))
         if old_user_packout_list is not None:
-            body['unlinkListIds'].append(int(_PACKOUT_DAY_IDS[old_user_packout_list]))
+            body['unlinkListIds'].append(int(get_packout_day_ids()[old_user_packout_list]))
 
     # Add/remove lists
     body['listIds'].extend([int(settings.SENDINBLUE_LISTS[desired]) for desired in lists_to_add])
@@ -451,28 +659,48 @@ def update_or_add_user(user, lists_to_add=None, lists_to_remove=None, remove_mem
     return True, ''
 
 
-def on_user_cancel_subscription(user):
-    return update_or_add_user(user, remove_member=True)
-
-
-def on_user_resubscribe(user):
-    return update_or_add_user(user, lists_to_add=['MEMBERS'], lists_to_remove=['FORMER_MEMBERS'])
-
-
 # --------
 # Email management
 
-def _get_transactional_email_templates(pprint=True):
-    # Gets and pretty-prints the names and IDs of all transactional templates,
-    # mostly for easy reference while working in the back-end
+# Template metadata is cached so checking if a member has received the latest version of a template is a
+# local comparison, instead of an api call for every profile change
+_TEMPLATES_CACHE_KEY = 'sendinblue.transactional_templates'
+_TEMPLATES_TTL = getattr(settings, 'SENDINBLUE_TEMPLATES_TTL', 60 * 60)  # seconds
+_MISSING_TEMPLATE_CACHE_KEY = 'sendinblue.missing_transactional_template.{}'
 
-    templates = send_request('smtp/templates', query={"templateStatus": True})
+
+def refresh_transactional_templates():
+    """
+    Fetch the transactional template metadata from SIB & cache it
+
+    @return: Dictionary of {template_id: {'name': name, 'modifiedAt': timestamp}}
+    """
+    templates = send_request('smtp/templates', query={"templateStatus": True, "limit": 1000})
 
     templates = templates.get('templates', None)
     if templates is None:
         raise Exception('Sendinblue error: Could not get transactional email templates')
 
-    templates = {t['name']: t['id'] for t in templates}
+    templates = {int(t['id']): {'name': t['name'], 'modifiedAt': t.get('modifiedAt', None)} for t in templates}
+    cache.set(_TEMPLATES_CACHE_KEY, templates, _TEMPLATES_TTL)
+    return templates
+
+
+def get_transactional_templates():
+    """
+    @return: The cached transactional template metadata. See refresh_transactional_templates
+    """
+    templates = cache.get(_TEMPLATES_CACHE_KEY)
+    if templates is None:
+        templates = refresh_transactional_templates()
+    return templates
+
+
+def _get_transactional_email_templates(pprint=True):
+    # Gets and pretty-prints the names and IDs of all transactional templates,
+    # mostly for easy reference while working in the back-end
+
+    templates = {t['name']: id for id, t in refresh_transactional_templates().items()}
 
     if pprint:
         print('Sendinblue Templates: <name>: <id>')
@@ -496,8 +724,21 @@ def get_template_last_modified_date(template_name):
         return False
 
     try:
-        response = send_request('smtp/templates/{}'.format(template_id), 'GET')
-        return response.get('modifiedAt', None)  # Date template was last modified
+        template_id = int(template_id)
+        template = get_transactional_templates().get(template_id, None)
+        missing_key = _MISSING_TEMPLATE_CACHE_KEY.format(template_id)
+        if template is None and not cache.get(missing_key):
+            # may be a new template
+            template = refresh_transactional_templates().get(template_id, None)
+            if template is None:
+                # don't refresh the template list on every lookup of a missing template
+                cache.set(missing_key, True, _TEMPLATES_TTL)
+
+        if template is None:
+            logger.critical('Sendinblue error: Transactional template "{}" does not exist'.format(template_name))
+            return False
+
+        return template['modifiedAt']  # Date template was last modified
 
     except Exception as ex:
         logger.error(str(ex))
@@ -0,0 +1,233 @@
+"""
+Bulk synchronization of members to Sendinblue contacts.
+
+Instead of fetching & updating each contact individually, we compute the desired state of every member locally,
+diff it against a single paginated export of the SIB contacts and push the changes using the batch endpoints.
+"""
+import logging
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+
+from ffcsa.core import sendinblue
+from ffcsa.shop.models import Order
+
+logger = logging.getLogger(__name__)
+
+# page size used when exporting contacts. 1000 is the max the api allows
+EXPORT_PAGE_SIZE = 500
+# max number of contacts the contacts/batch endpoint accepts
+UPDATE_BATCH_SIZE = 100
+IMPORT_BATCH_SIZE = 1000
+
+# (email, attributes, list_ids, unlink_list_ids)
+Contact = namedtuple('Contact', ['email', 'attributes', 'list_ids', 'unlink_list_ids'])
+
+SyncResult = namedtuple('SyncResult', ['created', 'updated', 'unchanged', 'skipped', 'requests'])
+
+
+def _list_ids(names):
+    return {int(settings.SENDINBLUE_LISTS[name]) for name in names}
+
+
+def get_active_user_ids(users):
+    """
+    Returns the ids of the users who are active members.
+
+    Members are active if they have a subscription, or have signed up in the last 30 days, or have made an order
+    in the last 60 days (pay-in-advance members don't have a subscription)
+    """
+    two_months_date = (datetime.now() - timedelta(days=60)).date()
+    thirty_days = (datetime.now() - timedelta(days=30)).date()
+
+    recent_orders = set(Order.objects.filter(time__gte=two_months_date).values_list('user_id', flat=True))
+
+    return {u.id for u in users if
+            bool(u.profile.stripe_subscription_id) or u.date_joined.date() >= thirty_days or u.id in recent_orders}
+
+
+def get_desired_contact(user, is_active):
+    """
+    Returns the Contact we want on SIB for the given user, or None if the user can not be synced.
+
+    This mirrors the logic of sendinblue.update_or_add_user
+    """
+    profile = user.profile
+
+    if is_active:
+        lists_to_add = ['MEMBERS', 'WEEKLY_REMINDER']
+        lists_to_remove = ['PROSPECTIVE_MEMBERS', 'FORMER_MEMBERS']
+        if profile.weekly_emails:
+            lists_to_add.append('WEEKLY_NEWSLETTER')
+        drop_site = sendinblue._HOME_DELIVERY_LIST.format(profile.delivery_address.city) if profile.home_delivery \
+            else profile.drop_site
+        packout_list = sendinblue.get_packout_list_for_user(user)
+    else:
+        lists_to_add = ['FORMER_MEMBERS']
+        lists_to_remove = ['MEMBERS', 'WEEKLY_REMINDER']
+        drop_site = None
+        packout_list = None
+
+    drop_site_ids = sendinblue.get_drop_site_ids()
+    packout_day_ids = sendinblue.get_packout_day_ids()
+
+    if drop_site is not None and drop_site not in drop_site_ids:
+        logger.error('Drop site {} does not exist in settings.DROPSITES'.format(drop_site))
+        return None
+
+    list_ids = _list_ids(lists_to_add)
+    # we are only ever on a single drop site & packout day list, so unlink all others
+    unlink_list_ids = _list_ids(lists_to_remove) | set(drop_site_ids.values()) | set(packout_day_ids.values())
+
+    if drop_site is not None:
+        list_ids.add(int(drop_site_ids[drop_site]))
+    if packout_list is not None:
+        list_ids.add(int(packout_day_ids[packout_list]))
+
+    attributes = {'FIRSTNAME': user.first_name, 'LASTNAME': user.last_name}
+    if profile.phone_number:
+        phone_number = sendinblue._format_phone_number(profile.phone_number)
+        if phone_number:
+            attributes['SMS'] = phone_number
+
+    return Contact(user.email.lower(), attributes, list_ids, unlink_list_ids - list_ids)
+
+
+def get_desired_contacts(users=None):
+    """
+    Returns {email: Contact} for all active users
+    """
+    if users is None:
+        users = get_user_model().objects.filter(is_active=True)
+    users = list(users.select_related('profile', 'profile__delivery_address'))
+
+    active_ids = get_active_user_ids(users)
+
+    contacts = {}
+    for user in users:
+        contact = get_desired_contact(user, user.id in active_ids)
+        if contact:
+            contacts[contact.email] = contact
+
+    return contacts
+
+
+def export_contacts():
+    """
+    Returns {email: Contact} for every contact on SIB, along with the number of requests made
+    """
+    contacts = {}
+    offset = 0
+    requests = 0
+
+    while True:
+        response = sendinblue.send_request('contacts', query={'limit': EXPORT_PAGE_SIZE, 'offset': offset})
+        requests += 1
+        page = response.get('contacts', [])
+
+        for c in page:
+            attributes = {k: v for k, v in c.get('attributes', {}).items() if k in ('FIRSTNAME', 'LASTNAME', 'SMS')}
+            if 'SMS' in attributes:
+                # SIB may return the number w/ a leading +
+                attributes['SMS'] = str(attributes['SMS']).lstrip('+')
+            contacts[c['email'].lower()] = Contact(c['email'].lower(), attributes, set(c.get('listIds', [])), set())
+
+        offset += len(page)
+        if len(page) < EXPORT_PAGE_SIZE or offset >= response.get('count', 0):
+            break
+
+    return contacts, requests
+
+
+def diff_contacts(desired, existing):
+    """
+    Compare the desired contacts against the existing SIB contacts
+
+    @return: (contacts to create, contacts to update) where each update only contains the changed attributes & lists
+    """
+    to_create = []
+    to_update = []
+
+    for email, contact in desired.items():
+        current = existing.get(email)
+
+        if current is None:
+            # don't create contacts for former members that were never on SIB
+            if contact.list_ids & _list_ids(['MEMBERS']):
+                to_create.append(contact)
+            continue
+
+        attributes = {k: v for k, v in contact.attributes.items() if v != '' and current.attributes.get(k) != v}
+        list_ids = contact.list_ids - current.list_ids
+        unlink_list_ids = contact.unlink_list_ids & current.list_ids
+
+        if attributes or list_ids or unlink_list_ids:
+            to_update.append(Contact(email, attributes, list_ids, unlink_list_ids))
+
+    return to_create, to_update
+
+
+def _chunks(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def push_changes(to_create, to_update):
+    """
+    Push the changes to SIB using the batch endpoints. Returns the number of requests made
+    """
+    requests = 0
+
+    # contacts/import adds every imported contact to the same lists, so group new contacts by their lists
+    by_lists = {}
+    for contact in to_create:
+        by_lists.setdefault(tuple(sorted(contact.list_ids)), []).append(contact)
+
+    for list_ids, contacts in by_lists.items():
+        for chunk in _chunks(contacts, IMPORT_BATCH_SIZE):
+            sendinblue.send_request('contacts/import', 'POST', data={
+                'jsonBody': [{'email': c.email, 'attributes': c.attributes} for c in chunk],
+                'listIds': list(list_ids),
+                'updateExistingContacts': True,
+                'emptyContactsAttributes': False,
+            })
+            requests += 1
+
+    for chunk in _chunks(to_update, UPDATE_BATCH_SIZE):
+        contacts = []
+        for c in chunk:
+            body = {'email': c.email}
+            if c.attributes:
+                body['attributes'] = c.attributes
+            if c.list_ids:
+                body['listIds'] = sorted(c.list_ids)
+            if c.unlink_list_ids:
+                body['unlinkListIds'] = sorted(c.unlink_list_ids)
+            contacts.append(body)
+
+        sendinblue.send_request('contacts/batch', 'POST', data={'contacts': contacts})
+        requests += 1
+
+    return requests
+
+
+def sync_contacts(users=None, dry_run=False):
+    """
+    Add/Update all contacts in SIB. Returns a SyncResult
+    """
+    if not settings.SENDINBLUE_ENABLED:
+        return SyncResult(0, 0, 0, 0, 0)
+
+    desired = get_desired_contacts(users)
+    existing, requests = export_contacts()
+
+    to_create, to_update = diff_contacts(desired, existing)
+
+    if not dry_run:
+        requests += push_changes(to_create, to_update)
+
+    skipped = len([e for e in desired if e not in existing]) - len(to_create)
+    unchanged = len(desired) - len(to_create) - len(to_update) - skipped
+    return SyncResult(len(to_create), len(to_update), unchanged, skipped, requests)
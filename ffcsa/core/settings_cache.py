@@ -0,0 +1,61 @@
+"""
+Cross request cache of Mezzanine's editable settings.
+
+Mezzanine loads the editable settings from the db once per request. Instead, we keep the loaded settings in each
+process along with the version they were loaded at. The version is stored in the shared cache & is changed whenever a
+setting is saved, so every worker reloads the settings on its next request after an edit in the admin.
+"""
+import uuid
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from mezzanine.conf import Settings
+from mezzanine.conf.models import Setting
+from mezzanine.utils.sites import current_site_id
+
+_VERSION_KEY = 'ffcsa.core.settings_cache.version'
+
+# {site_id: (version, settings)}
+_loaded = {}
+_original_load = Settings._load
+
+
+def get_version():
+    version = cache.get(_VERSION_KEY)
+    if version is None:
+        # the cache was flushed. A new version is used, so no worker keeps using stale settings
+        cache.add(_VERSION_KEY, uuid.uuid4().hex, None)
+        version = cache.get(_VERSION_KEY)
+    return version
+
+
+def bump_version():
+    cache.set(_VERSION_KEY, uuid.uuid4().hex, None)
+
+
+def _load(self):
+    version = get_version()
+    site_id = current_site_id()
+
+    loaded = _loaded.get(site_id)
+    if loaded is None or version is None or loaded[0] != version:
+        loaded = (version, _original_load(self))
+        _loaded[site_id] = loaded
+
+    return dict(loaded[1])
+
+
+def install():
+    """
+    Use the versioned cache when Mezzanine loads the editable settings
+    """
+    Settings._load = _load
+
+
+@receiver(post_save, sender=Setting)
+@receiver(post_delete, sender=Setting)
+def setting_handler(**kwargs):
+    # bump after commit, otherwise another worker could load the old settings under the new version
+    transaction.on_commit(bump_version)
@@ -1,26 +1,51 @@
-from ffcsa.shop.models import Cart, ProductVariation, Order, CartItem
-from django.test import TestCase
+import json
+import threading
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from unittest import mock
+from urllib.parse import urlparse, parse_qs
+
+from ffcsa.shop.models import Cart, Category, Product, Order, CartItem, Vendor
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import transaction
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
 from django.test import tag
 from django.utils.timezone import now
+from googleapiclient.errors import HttpError
+from mezzanine.conf import settings
+from mezzanine.conf.models import Setting
 
-from ffcsa.core import cron
+from ffcsa.core import (dropsites, google_sync, instrumentation, member_sync, sendinblue, sendinblue_sync,
+                        settings_cache)
+from ffcsa.core.page_processors import get_recipe_availability
+from ffcsa.core.models import (GoogleContact, LocationCount, MemberSyncJob, Profile, Recipe, RecipeProduct,
+                               SendinblueList)
 
 
 @tag('integration')
 class CloseOrderJobTests(TestCase):
-    fixtures = ["users", "product"]
+    fixtures = ["users"]
 
     def setUp(self):
+        # orders are dated by the member's pickup date
+        Profile.objects.filter(user_id__in=(1, 2)).update(drop_site='Farm - Friday')
         cart_1 = Cart.objects.create(last_updated=now(), user_id=1)
         cart_2 = Cart.objects.create(last_updated=now(), user_id=2)
 
-        product = ProductVariation.objects.get(id=1)
+        vendor = Vendor.objects.create(title="vendor", email="vendor@example.com")
+        product = Product.objects.create(title="Ground Beef", unit_price="10.00", available=True)
+        # order items are grouped by category
+        product.categories.add(Category.objects.create(title="Meat"))
+        variation = product.variations.create(sku="1", unit_price="10.00", default=True)
+        variation.vendorproductvariation_set.create(vendor=vendor, num_in_stock=100)
 
-        cart_1.add_item(product, 1)
-        cart_2.add_item(product, 5)
+        cart_1.add_item(variation, 1)
+        cart_2.add_item(variation, 5)
 
     def test_orders_created_from_carts_and_carts_cleared(self):
-        cron.close_order_job()
+        call_command('cart')
 
         orders = Order.objects.all()
 
@@ -38,3 +63,625 @@ class CloseOrderJobTests(TestCase):
             self.assertEqual(0, cart.items.count())
 
         self.assertEqual(0, CartItem.objects.count())
+
+
+class FakeSendinblueServer(object):
+    """
+    Local HTTP stand-in for the Sendinblue api. Serves the contacts export from ``contacts`` and records
+    every request made as (method, path, query, body). respond returns (status, body) or (status, body, headers)
+    """
+
+    def __init__(self, contacts=None):
+        self.contacts = contacts or []
+        self.requests = []
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _handle(self):
+                url = urlparse(self.path)
+                length = int(self.headers.get('content-length') or 0)
+                body = json.loads(self.rfile.read(length).decode()) if length else None
+                server.requests.append((self.command, url.path, parse_qs(url.query), body))
+                result = server.respond(self.command, url.path, parse_qs(url.query), body)
+                status, response = result[:2]
+                headers = result[2] if len(result) > 2 else {}
+
+                self.send_response(status)
+                self.send_header('content-type', 'application/json')
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(json.dumps(response).encode())
+
+            do_GET = do_POST = do_PUT = _handle
+
+        self.httpd = HTTPServer(('127.0.0.1', 0), Handler)
+        self.base_endpoint = 'http://127.0.0.1:{}/v3/'.format(self.httpd.server_port)
+
+    def respond(self, method, path, query, body):
+        if method == 'GET' and path == '/v3/contacts':
+            limit = int(query['limit'][0])
+            offset = int(query['offset'][0])
+            return 200, {'contacts': self.contacts[offset:offset + limit], 'count': len(self.contacts)}
+        return 201, {}
+
+    def __enter__(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class SendinblueSyncTests(SimpleTestCase):
+    def test_export_contacts_is_paginated(self):
+        contacts = [{'email': 'User{}@example.com'.format(i), 'attributes': {'SMS': '+15035550000'}, 'listIds': [7]}
+                    for i in range(5)]
+
+        with FakeSendinblueServer(contacts) as server, \
+                mock.patch.object(sendinblue, '_BASE_ENDPOINT', server.base_endpoint), \
+                mock.patch.object(sendinblue_sync, 'EXPORT_PAGE_SIZE', 2):
+            existing, requests = sendinblue_sync.export_contacts()
+
+        self.assertEqual(3, requests)
+        self.assertEqual(5, len(existing))
+        self.assertEqual('15035550000', existing['user0@example.com'].attributes['SMS'])
+
+    def test_diff_only_includes_changes(self):
+        Contact = sendinblue_sync.Contact
+        desired = {
+            'same@example.com': Contact('same@example.com', {'FIRSTNAME': 'A'}, {7}, {11}),
+            'changed@example.com': Contact('changed@example.com', {'FIRSTNAME': 'B'}, {7, 10}, {11}),
+            'new@example.com': Contact('new@example.com', {'FIRSTNAME': 'C'}, {7}, set()),
+        }
+        existing = {
+            'same@example.com': Contact('same@example.com', {'FIRSTNAME': 'A'}, {7}, set()),
+            'changed@example.com': Contact('changed@example.com', {'FIRSTNAME': 'Old'}, {7, 11}, set()),
+        }
+
+        with self.settings(SENDINBLUE_LISTS={'MEMBERS': 7}):
+            to_create, to_update = sendinblue_sync.diff_contacts(desired, existing)
+
+        self.assertEqual(['new@example.com'], [c.email for c in to_create])
+        self.assertEqual([Contact('changed@example.com', {'FIRSTNAME': 'B'}, {10}, {11})], to_update)
+
+    def test_push_changes_batches_requests(self):
+        Contact = sendinblue_sync.Contact
+        to_create = [Contact('new{}@example.com'.format(i), {}, {7}, set()) for i in range(3)]
+        to_update = [Contact('old{}@example.com'.format(i), {}, {10}, {11}) for i in range(5)]
+
+        with FakeSendinblueServer() as server, \
+                mock.patch.object(sendinblue, '_BASE_ENDPOINT', server.base_endpoint), \
+                mock.patch.object(sendinblue_sync, 'UPDATE_BATCH_SIZE', 2):
+            requests = sendinblue_sync.push_changes(to_create, to_update)
+
+        self.assertEqual(4, requests)
+        self.assertEqual(['/v3/contacts/import'] + ['/v3/contacts/batch'] * 3, [r[1] for r in server.requests])
+        self.assertEqual(3, len(server.requests[0][3]['jsonBody']))
+        self.assertEqual({'email': 'old0@example.com', 'listIds': [10], 'unlinkListIds': [11]},
+                         server.requests[1][3]['contacts'][0])
+
+
+class SendinblueRequestTests(SimpleTestCase):
+    def setUp(self):
+        sendinblue.reset_metrics()
+
+    def _responses(self, server, *responses):
+        responses = list(responses)
+        server.respond = lambda *args: responses.pop(0)
+
+    def test_retries_server_errors(self):
+        with FakeSendinblueServer() as server, \
+                mock.patch.object(sendinblue, '_BASE_ENDPOINT', server.base_endpoint), \
+                mock.patch.object(sendinblue, '_RETRY_BACKOFF', 0):
+            self._responses(server, (503, {'message': 'unavailable'}), (429, {'message': 'slow down'}),
+                            (200, {'email': 'user@example.com'}))
+            response = sendinblue.send_request('contacts/user%40example.com')
+
+        self.assertEqual({'email': 'user@example.com'}, response)
+        self.assertEqual(3, len(server.requests))
+
+        metrics = sendinblue.get_metrics()['GET contacts/{id}']
+        self.assertEqual(1, metrics.count)
+        self.assertEqual(2, metrics.retries)
+        self.assertEqual(0, metrics.errors)
+
+    def test_does_not_retry_non_idempotent_server_errors(self):
+        with FakeSendinblueServer() as server, \
+                mock.patch.object(sendinblue, '_BASE_ENDPOINT', server.base_endpoint), \
+                mock.patch.object(sendinblue, '_RETRY_BACKOFF', 0):
+            self._responses(server, (500, {'message': 'error'}), (201, {}))
+            with self.assertRaisesRegex(Exception, 'HTTP 500'):
+                sendinblue.send_request('smtp/email', 'POST', data={})
+
+        self.assertEqual(1, len(server.requests))
+        self.assertEqual(1, sendinblue.get_metrics()['POST smtp/email'].errors)
+
+    def test_does_not_wait_for_long_retry_after(self):
+        with FakeSendinblueServer() as server, \
+                mock.patch.object(sendinblue, '_BASE_ENDPOINT', server.base_endpoint), \
+                mock.patch.object(sendinblue.time, 'sleep') as sleep:
+            self._responses(server, (429, {'message': 'slow down'}, {'Retry-After': '600'}), (200, {}))
+            with self.assertRaisesRegex(sendinblue.SendinblueError, 'HTTP 429'):
+                sendinblue.send_request('contacts')
+
+        sleep.assert_not_called()
+        self.assertEqual(1, len(server.requests))
+
+    def test_waits_for_short_retry_after(self):
+        with FakeSendinblueServer() as server, \
+                mock.patch.object(sendinblue, '_BASE_ENDPOINT', server.base_endpoint), \
+                mock.patch.object(sendinblue.time, 'sleep') as sleep:
+            self._responses(server, (429, {'message': 'slow down'}, {'Retry-After': '2'}), (200, {}))
+            sendinblue.send_request('contacts')
+
+        sleep.assert_called_once_with(2)
+        self.assertEqual(2, len(server.requests))
+
+    def test_gives_up_after_max_retries(self):
+        with FakeSendinblueServer() as server, \
+                mock.patch.object(sendinblue, '_BASE_ENDPOINT', server.base_endpoint), \
+                mock.patch.object(sendinblue, '_RETRY_BACKOFF', 0), \
+                mock.patch.object(sendinblue, '_MAX_RETRIES', 1):
+            self._responses(server, (502, {'message': 'error'}), (502, {'message': 'error'}))
+            with self.assertRaisesRegex(Exception, 'HTTP 502'):
+                sendinblue.send_request('contacts')
+
+        self.assertEqual(2, len(server.requests))
+
+
+class SendinblueListTests(TestCase):
+    def setUp(self):
+        sendinblue._list_ids.clear()
+        self.addCleanup(sendinblue._list_ids.clear)
+
+    def test_stale_ids_are_used_when_sendinblue_errors(self):
+        SendinblueList.objects.create(kind=SendinblueList.DROP_SITE, name='Farm', list_id=7)
+        SendinblueList.objects.update(updated=now() - timedelta(days=30))
+
+        with FakeSendinblueServer() as server, \
+                mock.patch.object(sendinblue, '_BASE_ENDPOINT', server.base_endpoint), \
+                mock.patch.object(sendinblue, '_MAX_RETRIES', 0):
+            server.respond = lambda *args: (500, {'message': 'error'})
+            self.assertEqual({'Farm': 7}, sendinblue.get_drop_site_ids())
+
+        self.assertEqual(1, len(server.requests))
+
+    @override_settings(DEBUG=False)
+    def test_error_is_raised_without_stale_ids(self):
+        with FakeSendinblueServer() as server, \
+                mock.patch.object(sendinblue, '_BASE_ENDPOINT', server.base_endpoint), \
+                mock.patch.object(sendinblue, '_MAX_RETRIES', 0):
+            server.respond = lambda *args: (500, {'message': 'error'})
+            with self.assertRaises(sendinblue.SendinblueError):
+                sendinblue.get_drop_site_ids()
+
+
+class SendinblueTemplateTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+
+    @override_settings(SENDINBLUE_TRANSACTIONAL_TEMPLATES={'Known': 1, 'Missing': 2})
+    def test_missing_templates_are_cached(self):
+        templates = {'templates': [{'id': 1, 'name': 'Known', 'modifiedAt': '2020-01-01T00:00:00.000+00:00'}]}
+        with mock.patch.object(sendinblue, 'send_request', return_value=templates) as send_request:
+            self.assertEqual('2020-01-01T00:00:00.000+00:00', sendinblue.get_template_last_modified_date('Known'))
+            self.assertFalse(sendinblue.get_template_last_modified_date('Missing'))
+            self.assertFalse(sendinblue.get_template_last_modified_date('Missing'))
+            self.assertEqual('2020-01-01T00:00:00.000+00:00', sendinblue.get_template_last_modified_date('Known'))
+
+        # the initial fetch & a single refresh for the missing template
+        self.assertEqual(2, send_request.call_count)
+
+
+class MemberSyncTests(TransactionTestCase):
+    """
+    Jobs are only queued once the transaction commits, so these run outside of a test transaction
+    """
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user('member', 'member@example.com', 'password')
+        patcher = mock.patch.object(sendinblue, 'update_or_add_user', return_value=(True, ''))
+        self.update_sendinblue = patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(member_sync, 'update_google_contact', return_value=(True, ''))
+        self.update_google = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_job_is_queued_after_commit(self):
+        with transaction.atomic():
+            member_sync.enqueue(self.user, sendinblue_sync=True, lists_to_add=['MEMBERS'])
+            self.assertFalse(MemberSyncJob.objects.exists())
+
+        job = MemberSyncJob.objects.get(user=self.user)
+        self.assertTrue(job.sendinblue)
+        self.assertEqual(['MEMBERS'], job.lists_to_add)
+
+    def test_jobs_are_coalesced_per_member(self):
+        member_sync.enqueue(self.user, sendinblue_sync=True, lists_to_add=['MEMBERS'],
+                            lists_to_remove=['FORMER_MEMBERS'])
+        member_sync.enqueue(self.user, google=True)
+        member_sync.enqueue(self.user, remove_member=True)
+
+        job = MemberSyncJob.objects.get()
+        self.assertEqual(3, job.version)
+        self.assertTrue(job.sendinblue and job.google and job.sendinblue_remove_member)
+        # the latest request wins
+        self.assertEqual(['FORMER_MEMBERS'], job.lists_to_add)
+        self.assertEqual(['MEMBERS', 'WEEKLY_REMINDER'], job.lists_to_remove)
+
+        self.assertEqual((1, 0), member_sync.process_jobs())
+        self.update_sendinblue.assert_called_once_with(self.user, ['FORMER_MEMBERS'], ['MEMBERS', 'WEEKLY_REMINDER'],
+                                                       remove_member=True)
+        self.update_google.assert_called_once_with(self.user)
+        self.assertFalse(MemberSyncJob.objects.exists())
+
+    def test_job_is_leased_and_kept_when_requeued(self):
+        member_sync.enqueue(self.user, google=True)
+
+        def update_google_contact(user):
+            # the job is leased, so another worker skips it
+            self.assertEqual((0, 0), member_sync.process_jobs())
+            # the member changes while the job is being processed
+            member_sync.enqueue(user, sendinblue_sync=True)
+            return True, ''
+
+        self.update_google.side_effect = update_google_contact
+        self.assertEqual((1, 0), member_sync.process_jobs())
+
+        job = MemberSyncJob.objects.get()
+        self.assertEqual(2, job.version)
+        self.assertTrue(job.sendinblue)
+        self.assertLessEqual(job.run_at, now())
+
+    def test_failed_parts_are_retried_with_backoff(self):
+        member_sync.enqueue(self.user, sendinblue_sync=True, google=True)
+        self.update_google.return_value = (False, 'quota exceeded')
+
+        self.assertEqual((1, 1), member_sync.process_jobs())
+        job = MemberSyncJob.objects.get()
+        self.assertFalse(job.sendinblue)
+        self.assertTrue(job.google)
+        self.assertEqual(1, job.attempts)
+        self.assertEqual('Google: quota exceeded', job.last_error)
+        self.assertGreater(job.run_at, now() + member_sync._backoff(1) - timedelta(minutes=1))
+
+        # not due yet
+        self.assertEqual((0, 0), member_sync.process_jobs())
+
+        MemberSyncJob.objects.update(run_at=now())
+        self.update_google.return_value = (True, '')
+        self.assertEqual((1, 0), member_sync.process_jobs())
+        self.assertEqual(1, self.update_sendinblue.call_count)
+        self.assertEqual(2, self.update_google.call_count)
+        self.assertFalse(MemberSyncJob.objects.exists())
+
+    def test_gives_up_after_max_attempts(self):
+        member_sync.enqueue(self.user, google=True)
+        self.update_google.return_value = (False, 'error')
+        MemberSyncJob.objects.update(attempts=member_sync.MAX_ATTEMPTS - 1)
+
+        self.assertEqual((1, 1), member_sync.process_jobs())
+        MemberSyncJob.objects.update(run_at=now())
+        self.assertEqual((0, 0), member_sync.process_jobs())
+        self.assertEqual(member_sync.MAX_ATTEMPTS, MemberSyncJob.objects.get().attempts)
+
+
+class FakePeopleService(object):
+    """
+    Stand-in for the google People service. connections().list returns (or raises) each of ``pages`` in order.
+    Every request executed is recorded in ``calls`` as (method, kwargs)
+    """
+
+    class Request(object):
+        def __init__(self, service, method, kwargs, response):
+            self.service = service
+            self.method = method
+            self.kwargs = kwargs
+            self.response = response
+
+        def execute(self):
+            self.service.calls.append((self.method, self.kwargs))
+            response = self.response()
+            if isinstance(response, Exception):
+                raise response
+            return response
+
+    class Batch(object):
+        def __init__(self, service, callback):
+            self.service = service
+            self.callback = callback
+            self.requests = []
+
+        def add(self, request, request_id):
+            self.requests.append((request_id, request))
+
+        def execute(self):
+            self.service.batches.append([r.method for _, r in self.requests])
+            for request_id, request in self.requests:
+                try:
+                    self.callback(request_id, request.execute(), None)
+                except Exception as e:
+                    self.callback(request_id, None, e)
+
+    def __init__(self, pages=None):
+        self.pages = list(pages or [])
+        self.calls = []
+        self.batches = []
+
+    def people(self):
+        return self
+
+    def connections(self):
+        return self
+
+    def list(self, **kwargs):
+        return self.Request(self, 'list', kwargs, lambda: self.pages.pop(0))
+
+    def createContact(self, **kwargs):
+        return self.Request(self, 'createContact', kwargs, lambda: dict(
+            kwargs['body'], resourceName='people/new{}'.format(len(self.calls)), etag='created'))
+
+    def updateContact(self, **kwargs):
+        return self.Request(self, 'updateContact', kwargs, lambda: dict(
+            kwargs['body'], resourceName=kwargs['resourceName'], etag='updated'))
+
+    def new_batch_http_request(self, callback):
+        return self.Batch(self, callback)
+
+
+def _person(resource_name, etag, first_name, last_name, email, **kwargs):
+    return dict(resourceName=resource_name, etag=etag, names=[{'givenName': first_name, 'familyName': last_name}],
+                emailAddresses=[{'value': email}], **kwargs)
+
+
+class GoogleSyncTests(TestCase):
+    fixtures = ["users"]
+
+    def setUp(self):
+        cache.delete(google_sync._SYNC_TOKEN_KEY)
+
+    def test_refresh_is_incremental(self):
+        service = FakePeopleService([
+            {'connections': [_person('people/1', 'a', 'RJ', 'Ewing', 'Test2@example.com')], 'nextPageToken': 'p2'},
+            {'connections': [_person('people/2', 'a', 'Jane', 'Doe', 'jane@example.com'),
+                             _person('people/3', 'a', 'John', 'Doe', 'john@example.com')],
+             'nextSyncToken': 's1'},
+            {'connections': [_person('people/1', 'b', 'RJ', 'Ewing', 'rj@example.com'),
+                             {'resourceName': 'people/2', 'metadata': {'deleted': True}}],
+             'nextSyncToken': 's2'},
+        ])
+
+        result = google_sync.refresh(service)
+        self.assertEqual(google_sync.RefreshResult(True, 3, 0, 2), result)
+        self.assertEqual('p2', service.calls[1][1]['pageToken'])
+        self.assertEqual('test2@example.com', GoogleContact.objects.get(resource_name='people/1').email)
+
+        result = google_sync.refresh(service)
+        self.assertEqual(google_sync.RefreshResult(False, 1, 1, 1), result)
+        self.assertEqual('s1', service.calls[2][1]['syncToken'])
+        self.assertEqual(['people/1', 'people/3'],
+                         sorted(GoogleContact.objects.values_list('resource_name', flat=True)))
+        self.assertEqual('rj@example.com', GoogleContact.objects.get(resource_name='people/1').email)
+        self.assertEqual('s2', cache.get(google_sync._SYNC_TOKEN_KEY))
+
+    def test_expired_sync_token_falls_back_to_full_sync(self):
+        GoogleContact.objects.create(resource_name='people/removed', etag='a')
+        cache.set(google_sync._SYNC_TOKEN_KEY, 'expired')
+        expired = HttpError(mock.Mock(status=400, reason='Bad Request'),
+                            b'{"error": {"status": "FAILED_PRECONDITION", "message": "EXPIRED_SYNC_TOKEN"}}')
+        service = FakePeopleService([
+            expired,
+            {'connections': [_person('people/1', 'a', 'RJ', 'Ewing', 'test2@example.com')], 'nextSyncToken': 's1'},
+        ])
+
+        result = google_sync.refresh(service)
+
+        self.assertEqual(google_sync.RefreshResult(True, 1, 1, 1), result)
+        self.assertNotIn('syncToken', service.calls[1][1])
+        self.assertEqual(['people/1'], list(GoogleContact.objects.values_list('resource_name', flat=True)))
+
+    def test_sync_contacts_uses_mirror_and_batches(self):
+        # the profiles are created when the users fixture is loaded
+        Profile.objects.filter(user_id__in=(1, 2)).update(monthly_contribution=0, phone_number='541-555-0000')
+        other_group = {'contactGroupMembership': {'contactGroupResourceName': 'contactGroups/other'}}
+        service = FakePeopleService([
+            {'connections': [_person('people/1', 'a', 'Someone', 'Else', 'test2@example.com',
+                                     memberships=[other_group])],
+             'nextSyncToken': 's1'},
+        ])
+        users = list(Profile.objects.select_related('user').order_by('user_id'))
+        cache.set(google_sync._SYNC_TOKEN_KEY, 's0')
+
+        with self.settings(GOOGLE_GROUP_IDS={'MEMBERS': 'contactGroups/members', 'MANAGED': 'contactGroups/managed',
+                                             'NEWSLETTER': 'contactGroups/newsletter'}):
+            result = google_sync.sync_contacts([p.user for p in users], service)
+
+        self.assertEqual('s0', service.calls[0][1]['syncToken'])
+        self.assertEqual([['createContact'], ['updateContact']], service.batches)
+        self.assertEqual(([1], [2], []), ([u.id for u in result.created], [u.id for u in result.updated],
+                                          result.failed))
+
+        update = [kwargs for method, kwargs in service.calls if method == 'updateContact'][0]
+        self.assertEqual('a', update['body']['etag'])
+        self.assertIn(other_group, update['body']['memberships'])
+
+        self.assertEqual('people/1', Profile.objects.get(user_id=2).google_person_id)
+        self.assertEqual(2, GoogleContact.objects.get(resource_name='people/1').user_id)
+        self.assertEqual('updated', GoogleContact.objects.get(resource_name='people/1').etag)
+        new_contact = GoogleContact.objects.get(user_id=1)
+        self.assertEqual(new_contact.resource_name, Profile.objects.get(user_id=1).google_person_id)
+
+    def test_sync_contacts_never_fetches_every_contact(self):
+        GoogleContact.objects.create(resource_name='people/1', etag='a', email='test2@example.com')
+        expired = HttpError(mock.Mock(status=400, reason='Bad Request'),
+                            b'{"error": {"status": "FAILED_PRECONDITION", "message": "EXPIRED_SYNC_TOKEN"}}')
+        user = get_user_model().objects.get(id=2)
+
+        with self.settings(GOOGLE_GROUP_IDS={'MEMBERS': 'contactGroups/members', 'MANAGED': 'contactGroups/managed',
+                                             'NEWSLETTER': 'contactGroups/newsletter'}):
+            # without a sync token, the mirror is used as is
+            service = FakePeopleService()
+            result = google_sync.sync_contacts([user], service)
+            self.assertEqual(['updateContact'], [method for method, kwargs in service.calls])
+            self.assertEqual([user], result.updated)
+
+            # an expired token isn't followed by a full sync
+            cache.set(google_sync._SYNC_TOKEN_KEY, 'expired')
+            service = FakePeopleService([expired])
+            google_sync.sync_contacts([user], service)
+            self.assertEqual(['list', 'updateContact'], [method for method, kwargs in service.calls])
+            self.assertIsNone(cache.get(google_sync._SYNC_TOKEN_KEY))
+
+
+class LocationCountTests(TestCase):
+    def setUp(self):
+        dropsites._location_counts = None
+        dropsites._refresh_pending.scheduled = False
+
+    def tearDown(self):
+        dropsites._location_counts = None
+        dropsites._refresh_pending.scheduled = False
+
+    def test_full_locations_are_read_from_materialized_counts(self):
+        LocationCount.objects.create(location='Farm - Friday', count=30)
+        LocationCount.objects.create(location='97448', count=2)
+
+        with self.settings(HOME_DELIVERY_ZIP_LIMITS={'97448': 2}):
+            self.assertTrue(dropsites.is_location_full('97448'))
+            self.assertTrue(dropsites.is_location_full('Farm - Friday'))
+            self.assertFalse(dropsites.is_location_full('97401'))
+
+            # counts are memoized, so anonymous zip checks don't hit the db
+            with self.assertNumQueries(0):
+                self.assertFalse(dropsites.is_location_full('97402'))
+
+    def test_group_limit(self):
+        LocationCount.objects.create(location='97401', count=60)
+        LocationCount.objects.create(location='97404', count=40)
+
+        self.assertIn('97477', dropsites.get_full_drop_locations())
+
+    def _scheduled_refreshes(self, on_commit):
+        return [c for c in on_commit.call_args_list if c == mock.call(dropsites._refresh_pending_location_counts)]
+
+    def _commit(self):
+        # TestCase never commits, so clear the pending flag the way the on_commit callback would
+        dropsites._refresh_pending.scheduled = False
+
+    @mock.patch.object(transaction, 'on_commit')
+    def test_refresh_is_only_scheduled_for_location_changes(self, on_commit):
+        user = get_user_model().objects.create_user('member', 'member@example.com', 'password')
+        self.assertEqual(1, len(self._scheduled_refreshes(on_commit)))
+        self._commit()
+        on_commit.reset_mock()
+
+        profile = Profile.objects.get(user=user)
+        profile.phone_number = '5415555555'
+        profile.save()
+        self.assertEqual([], self._scheduled_refreshes(on_commit))
+
+        # multiple changes in a transaction are coalesced into a single recount
+        profile.drop_site = 'Farm - Friday'
+        profile.save()
+        profile.drop_site = 'Farm - Tuesday'
+        profile.save()
+        self.assertEqual(1, len(self._scheduled_refreshes(on_commit)))
+
+    @mock.patch.object(transaction, 'on_commit')
+    def test_refresh_is_scheduled_for_first_order_of_the_month(self, on_commit):
+        user = get_user_model().objects.create_user('member', 'member@example.com', 'password')
+        self._commit()
+        on_commit.reset_mock()
+
+        Order.objects.create(user_id=user.id, time=now())
+        self.assertEqual(1, len(self._scheduled_refreshes(on_commit)))
+        self._commit()
+        on_commit.reset_mock()
+
+        Order.objects.create(user_id=user.id, time=now())
+        self.assertEqual([], self._scheduled_refreshes(on_commit))
+
+        Profile.objects.filter(user=user).update(stripe_subscription_id='sub_1')
+        user = get_user_model().objects.create_user('subscriber', 'subscriber@example.com', 'password')
+        Profile.objects.filter(user=user).update(stripe_subscription_id='sub_2')
+        self._commit()
+        on_commit.reset_mock()
+        Order.objects.create(user_id=user.id, time=now())
+        self.assertEqual([], self._scheduled_refreshes(on_commit))
+
+
+class SettingsCacheTests(TestCase):
+    def setUp(self):
+        settings_cache._loaded.clear()
+        settings_cache.bump_version()
+
+    def test_settings_are_loaded_once_per_version(self):
+        Setting.objects.create(name='SHOP_ORDER_EMAIL_SUBJECT', value='Receipt')
+
+        with self.assertNumQueries(1):
+            self.assertEqual('Receipt', settings.SHOP_ORDER_EMAIL_SUBJECT)
+            self.assertEqual('Receipt', settings.SHOP_ORDER_EMAIL_SUBJECT)
+
+        Setting.objects.filter(name='SHOP_ORDER_EMAIL_SUBJECT').update(value='Your Order')
+        settings_cache.bump_version()
+
+        with self.assertNumQueries(1):
+            self.assertEqual('Your Order', settings.SHOP_ORDER_EMAIL_SUBJECT)
+
+
+class RecipeAvailabilityTests(TestCase):
+    def test_availability_is_aggregated_and_cached(self):
+        recipe = Recipe.objects.create(title='Soup')
+        empty_recipe = Recipe.objects.create(title='Empty')
+        for available in (True, True, False):
+            RecipeProduct.objects.create(recipe=recipe, product=Product.objects.create(title='p', available=available))
+
+        with self.assertNumQueries(1):
+            availability = get_recipe_availability()
+        self.assertEqual((2, 3), availability[recipe.id])
+        self.assertEqual((0, 0), availability[empty_recipe.id])
+
+        with self.assertNumQueries(0):
+            get_recipe_availability()
+
+        Product.objects.filter(available=False).get().delete()
+        self.assertEqual((2, 2), get_recipe_availability()[recipe.id])
+
+
+@override_settings(REQUEST_INSTRUMENTATION_BUFFER_SIZE=3)
+class InstrumentationTests(SimpleTestCase):
+    def setUp(self):
+        instrumentation.clear()
+
+    def _record(self, view, time, queries, duplicates=()):
+        instrumentation.record({'view': view, 'method': 'GET', 'status': 200, 'time': time, 'db_time': time / 2,
+                                'queries': queries, 'duplicates': list(duplicates), 'timestamp': now().timestamp()})
+
+    def test_fingerprint(self):
+        self.assertEqual(instrumentation.fingerprint("SELECT * FROM t WHERE id IN (1, 2) AND name = 'a'"),
+                         instrumentation.fingerprint("SELECT * FROM t WHERE id IN (3) AND name = 'b'"))
+
+    def test_ring_buffer_keeps_latest_records(self):
+        for i in range(5):
+            self._record('cart', i, i)
+
+        self.assertEqual([2, 3, 4], [r['queries'] for r in instrumentation.get_records()])
+
+    def test_summarize(self):
+        self._record('cart', 10, 5)
+        self._record('cart', 30, 25, [('SELECT ?', 20)])
+        self._record('product', 5, 2)
+
+        cart, product = instrumentation.summarize(instrumentation.get_records(), percentiles=(50, 100))
+        self.assertEqual('cart', cart['view'])
+        self.assertEqual(2, cart['requests'])
+        self.assertEqual([(50, 10), (100, 30)], cart['time'])
+        self.assertEqual(25, cart['max_queries'])
+        self.assertEqual([('SELECT ?', 20)], cart['duplicates'])
+        self.assertEqual('product', product['view'])
@@ -32,12 +32,11 @@ from mezzanine.utils.views import paginate
 from mezzanine.accounts import views
 from signrequest_client.rest import ApiException
 
-from ffcsa.core.dropsites import get_full_drop_locations
+from ffcsa.core.dropsites import is_location_full
 from ffcsa.shop.actions.order_actions import DEFAULT_GROUP_KEY
 from ffcsa.shop.models import Category, Order, Product
 from ffcsa.core.forms import BasePaymentFormSet, ProfileForm, CreditOrderedProductForm
-from ffcsa.core.google import add_contact as add_google_contact
-from ffcsa.core import sendinblue, signrequest
+from ffcsa.core import instrumentation, member_sync, signrequest
 from ffcsa.core.models import Payment, Recipe
 from ffcsa.core.subscriptions import (SIGNUP_DESCRIPTION,
                                       clear_ach_payment_source,
@@ -105,7 +104,7 @@ def signup(request, template="accounts/account_signup.html", extra_context=None)
         except ApiException as e:
             # don't prevent the user from signing up. They can re-send the sign request document later
             logger.error(e)
-        add_google_contact(new_user)
+        member_sync.enqueue(new_user, google=True)
 
         subject = "New User Signup"
         if new_user.profile.join_dairy_program:
@@ -247,7 +246,8 @@ def payments_subscribe(request):
                 errors.append('Unknown Payment Type')
 
             if resubscribed:
-                sendinblue.on_user_resubscribe(user)
+                member_sync.enqueue(user, sendinblue_sync=True, lists_to_add=['MEMBERS'],
+                                    lists_to_remove=['FORMER_MEMBERS'])
 
     except stripe.error.CardError as e:
         body = e.json_body
@@ -646,7 +646,7 @@ def stripe_webhooks(request):
             payments_url = request.build_absolute_uri(reverse("payments"))
             send_subscription_canceled_email(user, date, payments_url)
 
-            sendinblue.on_user_cancel_subscription(user)
+            member_sync.enqueue(user, remove_member=True)
 
     except ValueError as e:
         logger.error('Stripe webhook value error: ', e)
@@ -720,6 +720,23 @@ def admin_member_budgets(request, template="admin/member_budgets.html"):
     return TemplateResponse(request, template, context)
 
 
+@staff_member_required
+def admin_request_stats(request, template="admin/request_stats.html"):
+    if request.method == "POST" and request.POST.get('clear'):
+        instrumentation.clear()
+        return redirect(reverse('admin_request_stats'))
+
+    records = instrumentation.get_records()
+    context = {
+        'enabled': instrumentation.is_enabled(),
+        'buffer_size': instrumentation.get_buffer_size(),
+        'num_records': len(records),
+        'summary': instrumentation.summarize(records),
+    }
+
+    return TemplateResponse(request, template, context)
+
+
 @staff_member_required
 def member_order_history(request, template="admin/member_order_history.html"):
     users = User.objects.filter(is_active=True).order_by('last_name')
@@ -955,7 +972,7 @@ class ProductAutocomplete(autocomplete.Select2QuerySetView):
 def home_delivery_check(request, zip):
     return http.JsonResponse(
         {
-            'is_full': zip in get_full_drop_locations()
+            'is_full': is_location_full(zip)
         })
 
 
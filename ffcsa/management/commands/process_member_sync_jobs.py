@@ -0,0 +1,28 @@
+import time
+
+from django.core.management import BaseCommand
+
+from ffcsa.core import member_sync
+
+
+class Command(BaseCommand):
+    """
+    Sync members to Sendinblue & Google contacts in the background.
+    This is meant to be run as a cron job, or with --loop as a long running worker
+    """
+    help = 'Process pending member sync jobs'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help='Keep polling for new jobs')
+        parser.add_argument('--interval', action='store', type=int, default=5,
+                            help='Seconds to wait between polls when using --loop')
+
+    def handle(self, *args, **options):
+        while True:
+            processed, failed = member_sync.process_jobs()
+            if processed:
+                self.stdout.write('processed: {}, failed: {}'.format(processed, failed))
+
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,13 @@
+from django.core.management import BaseCommand
+
+from ffcsa.core import dropsites
+
+
+class Command(BaseCommand):
+    help = 'Recount the active members at each drop site & home delivery zip code'
+
+    def handle(self, *args, **options):
+        counts = dropsites.refresh_location_counts()
+        full = set(dropsites.get_full_drop_locations())
+        for location, count in sorted(counts.items()):
+            self.stdout.write('{}: {}{}'.format(location, count, ' (full)' if location in full else ''))
@@ -0,0 +1,27 @@
+from django.conf import settings
+from django.core.management import BaseCommand, CommandError
+
+from ffcsa.core import sendinblue
+
+
+class Command(BaseCommand):
+    help = 'Refresh the cached Sendinblue drop site & packout day list ids (creating any missing lists) ' \
+           'and the transactional template metadata'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--templates-only', action='store_true',
+                            help='Only refresh the transactional template metadata')
+
+    def handle(self, *args, **options):
+        if not settings.SENDINBLUE_ENABLED:
+            raise CommandError('Sendinblue is not enabled')
+
+        if not options['templates_only']:
+            for kind, ids in sendinblue.refresh_list_ids().items():
+                self.stdout.write('{} lists:'.format(kind))
+                for name, id in sorted(ids.items()):
+                    self.stdout.write('\t{}: {}'.format(name, id))
+
+        self.stdout.write('transactional templates:')
+        for id, template in sorted(sendinblue.refresh_transactional_templates().items()):
+            self.stdout.write('\t{} ({}): last modified {}'.format(template['name'], id, template['modifiedAt']))
@@ -0,0 +1,35 @@
+from django.core.management import BaseCommand
+
+from ffcsa.core import instrumentation
+
+
+class Command(BaseCommand):
+    help = 'Print the query count & latency percentiles of the requests recorded by the InstrumentationMiddleware'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--view', help='Only include views containing this name')
+        parser.add_argument('--percentiles', default='50,95,99', help='Comma separated percentiles to print')
+        parser.add_argument('--clear', action='store_true', help='Clear the recorded requests after printing')
+
+    def handle(self, *args, **options):
+        percentiles = [int(p) for p in options['percentiles'].split(',')]
+
+        records = instrumentation.get_records()
+        if options['view']:
+            records = [r for r in records if options['view'] in r['view']]
+
+        if not instrumentation.is_enabled():
+            self.stderr.write('REQUEST_INSTRUMENTATION is disabled')
+        self.stdout.write('{} requests recorded'.format(len(records)))
+
+        for view in instrumentation.summarize(records, percentiles):
+            self.stdout.write('\n{} ({} requests, max {} queries)'.format(view['view'], view['requests'],
+                                                                         view['max_queries']))
+            for i, p in enumerate(percentiles):
+                self.stdout.write('  p{:<3} time: {:8.1f}ms  db time: {:8.1f}ms  queries: {}'.format(
+                    p, view['time'][i][1], view['db_time'][i][1], view['queries'][i][1]))
+            for sql, count in view['duplicates']:
+                self.stdout.write('  {}x {}'.format(count, sql[:300]))
+
+        if options['clear']:
+            instrumentation.clear()
@@ -1,7 +1,5 @@
 import datetime
 import logging
-import os
-import tempfile
 
 from django.conf import settings
 from django.core.mail import EmailMessage
@@ -10,7 +8,8 @@ from django.core.management import BaseCommand
 from ffcsa.shop.deliveries import generate_deliveries_csv, generate_deliveries_optimoroute_csv
 from ffcsa.shop.invoice import generate_invoices
 from ffcsa.shop.models import Order
-from ffcsa.shop.reports import generate_weekly_order_reports, send_order_to_vendor
+from ffcsa.shop.pdf import PdfAssembler
+from ffcsa.shop.reports import iter_weekly_order_reports, send_orders_to_vendors
 
 # TODO :: logger isn't used in this file
 logger = logging.getLogger(__name__)
@@ -37,63 +36,54 @@ class Command(BaseCommand):
         date = options['date']
 
         try:
-            vendor_orders, reports = generate_weekly_order_reports(date)
-
-            if options['send_orders']:
-                for vo in vendor_orders:
-                    send_order_to_vendor(vo.order.write_pdf(), vo.vendor, vo.vendor_title, date)
-
-            orders = Order.objects.filter(time__date=date)
-
-            invoice_pages = []
-            market_invoice_pages = []
-
-            for invoice, order in generate_invoices(orders):
-                # points to Items Ordered header
-                # Lets rename to lastname
-                bookmark = list(invoice.pages[0].bookmarks[0])
-                bookmark[1] = order.billing_detail_last_name + " Invoice"
-                invoice.pages[0].bookmarks[0] = tuple(bookmark)
-                invoice_pages.extend(invoice.pages)
-
-            # workaround for https://github.com/Kozea/WeasyPrint/issues/990
-            # for invoice, order in generate_invoices(orders):
-            #     if order.drop_site in settings.MARKET_CHECKLISTS:
-            #         # points to Items Ordered header
-            #         # Lets rename to lastname
-            #         bookmark = list(invoice.pages[0].bookmarks[0])
-            #         bookmark[1] = order.billing_detail_last_name + " Market Invoice"
-            #         invoice.pages[0].bookmarks[0] = tuple(bookmark)
-            #         market_invoice_pages.extend(invoice.pages)
-
-            # doc = reports.copy(market_invoice_pages + reports.pages + invoice_pages)  # uses the metadata from reports
-            doc = reports.copy(reports.pages + invoice_pages)  # uses the metadata from reports
-
-            # delivery_orders = orders.filter(drop_site='Home Delivery')
-            # deliveries_csv = generate_deliveries_csv(delivery_orders)
-            deliveries_csvs = generate_deliveries_optimoroute_csv(date)
-
-            # if not os.path.exists('app-messages'):
-            #     os.mkdir('app-messages')
-            # with tempfile.NamedTemporaryFile(
-            #         delete=False, dir="app-messages", suffix='.pdf') as tmp:
-            #     tmp.write(doc.write_pdf())
-
-                # # Reset file pointer
-                # tmp.seek(0)
-
-            # for name, content in deliveries_csvs:
-            #     with tempfile.NamedTemporaryFile(
-            #             delete=False, dir="app-messages", suffix='.csv', mode='w') as tmp:
-            #         tmp.write(content)
-
-            msg = EmailMessage("Weekly Order Files - {}".format(date), "Weekly Order Files are attached.",
-                               settings.EMAIL_HOST_USER, (settings.EMAIL_HOST_USER,))
-            msg.attach("ffcsa_weekly_orders_{}.pdf".format(date), doc.write_pdf(), mimetype='application/pdf')
-            for name, content in deliveries_csvs:
-                msg.attach("home_deliveries_{}_{}.csv".format(date, name), content, mimetype='text/csv')
-            msg.send()
+            with PdfAssembler() as assembler:
+                vendor_orders, reports = iter_weekly_order_reports(date)
+
+                if options['send_orders']:
+                    send_orders_to_vendors(vendor_orders, date)
+
+                # write the reports & invoices to disk as they are rendered so we don't keep the
+                # layout of the entire weeks documents in memory
+                for report in reports:
+                    assembler.add(report)
+
+                orders = Order.objects.filter(time__date=date)
+
+                for invoice, order in generate_invoices(orders):
+                    # points to Items Ordered header
+                    # Lets rename to lastname
+                    bookmark = list(invoice.pages[0].bookmarks[0])
+                    bookmark[1] = order.billing_detail_last_name + " Invoice"
+                    invoice.pages[0].bookmarks[0] = tuple(bookmark)
+                    assembler.add(invoice)
+
+                # workaround for https://github.com/Kozea/WeasyPrint/issues/990
+                # for invoice, order in generate_invoices(orders):
+                #     if order.drop_site in settings.MARKET_CHECKLISTS:
+                #         # points to Items Ordered header
+                #         # Lets rename to lastname
+                #         bookmark = list(invoice.pages[0].bookmarks[0])
+                #         bookmark[1] = order.billing_detail_last_name + " Market Invoice"
+                #         invoice.pages[0].bookmarks[0] = tuple(bookmark)
+                #         market_invoice_pages.extend(invoice.pages)
+
+                doc_path = assembler.write()
+
+                self.send_weekly_order_files(date, doc_path)
         except Exception as e:
             EmailMessage("URGENT - Failed to send_weekly_orders", "Need to investigate asap.",
                          settings.EMAIL_HOST_USER, (settings.ADMINS[0][1],))
             raise e
+
+    def send_weekly_order_files(self, date, doc_path):
+        # delivery_orders = orders.filter(drop_site='Home Delivery')
+        # deliveries_csv = generate_deliveries_csv(delivery_orders)
+        deliveries_csvs = generate_deliveries_optimoroute_csv(date)
+
+        msg = EmailMessage("Weekly Order Files - {}".format(date), "Weekly Order Files are attached.",
+                           settings.EMAIL_HOST_USER, (settings.EMAIL_HOST_USER,))
+        with open(doc_path, 'rb') as doc:
+            msg.attach("ffcsa_weekly_orders_{}.pdf".format(date), doc.read(), mimetype='application/pdf')
+        for name, content in deliveries_csvs:
+            msg.attach("home_deliveries_{}_{}.csv".format(date, name), content, mimetype='text/csv')
+        msg.send()
@@ -0,0 +1,289 @@
+import random
+import threading
+import time
+from collections import defaultdict
+from decimal import Decimal
+from unittest import mock
+
+import requests
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Sum
+from django.test import Client
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.urls import reverse
+from mezzanine.core.models import CONTENT_STATUS_PUBLISHED
+
+from ffcsa.core.instrumentation import percentile
+from ffcsa.core.models import Payment, Profile
+from ffcsa.shop import order_calendar
+from ffcsa.shop.models import Cart, Category, Product, Vendor, VendorProductVariation
+from ffcsa.shop.models.Vendor import VendorCartItem
+
+# prefix of the simulated members, products, etc.
+PREFIX = 'loadsim'
+PASSWORD = 'loadsim-password'
+ACTIONS = ('browse', 'add', 'update', 'cart')
+
+
+class _ClientSession(object):
+    """
+    A simulated member using the django test client, in process
+    """
+
+    def __init__(self, user):
+        self.client = Client()
+        self.client.force_login(user)
+
+    def request(self, method, path, data=None):
+        response = getattr(self.client, method)(path, data or {})
+        return response.status_code, _json(response.get('content-type'), response.json)
+
+
+class _HttpSession(object):
+    """
+    A simulated member making requests to a running server
+    """
+
+    def __init__(self, user, base_url):
+        self.base_url = base_url.rstrip('/')
+        self.session = requests.Session()
+        login_url = self.base_url + settings.LOGIN_URL
+        self.session.get(login_url)
+        response = self.session.post(login_url, data={
+            'username': user.username,
+            'password': PASSWORD,
+            'csrfmiddlewaretoken': self.session.cookies.get('csrftoken'),
+        }, headers={'Referer': login_url})
+        if settings.SESSION_COOKIE_NAME not in self.session.cookies:
+            raise CommandError('Failed to login {}: {}'.format(user.username, response.status_code))
+
+    def request(self, method, path, data=None):
+        headers = {'X-CSRFToken': self.session.cookies.get('csrftoken', ''), 'Referer': self.base_url + path}
+        response = self.session.request(method, self.base_url + path, data=data, headers=headers)
+        return response.status_code, _json(response.headers.get('content-type'), response.json)
+
+
+def _json(content_type, get_json):
+    return get_json() if content_type and content_type.startswith('application/json') else None
+
+
+class Command(BaseCommand):
+    help = 'Simulate members browsing & filling their carts the moment an order window opens, ' \
+           'and report throughput, latency percentiles, oversold stock & db lock waits'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--members', type=int, default=50, help='Number of concurrent simulated members')
+        parser.add_argument('--products', type=int, default=20, help='Number of simulated products')
+        parser.add_argument('--stock', type=int, default=10, help='Number in stock of each simulated product')
+        parser.add_argument('--iterations', type=int, default=5, help='Browse/add/update sequences per member')
+        parser.add_argument('--url', help='Base url of a running server. Defaults to using the test client in process')
+        parser.add_argument('--seed', type=int, help='Random seed, to replay the same sequences')
+        parser.add_argument('--keep', action='store_true', help="Don't delete the simulated data when finished")
+        parser.add_argument('--force', action='store_true',
+                            help='Run even though DEBUG is False. This creates & deletes data in the database')
+
+    def handle(self, *args, **options):
+        if not settings.DEBUG and not options['force']:
+            raise CommandError('This creates & deletes data in the database. Use --force to run without DEBUG')
+        if Product.objects.filter(title__startswith=PREFIX).exists():
+            raise CommandError('Simulated data from a previous run exists. Remove the {} products, members & '
+                               'category first'.format(PREFIX))
+
+        rng = random.Random(options['seed'])
+        drop_sites = [d['name'] for d in settings.DROPSITES if order_calendar.is_order_window(drop_site=d['name'])]
+        patcher = None
+        if not drop_sites:
+            if options['url']:
+                raise CommandError('No drop site order windows are open, so members of the server can not order')
+            # simulate the order window opening
+            drop_sites = [d['name'] for d in settings.DROPSITES]
+            patcher = mock.patch('ffcsa.shop.orders.valid_order_period_for_user', return_value=True)
+
+        self.stdout.write('Creating {} members & {} products'.format(options['members'], options['products']))
+        category, vendor, variations = self._create_products(options['products'], options['stock'])
+        members = self._create_members(options['members'], drop_sites, set_password=bool(options['url']))
+
+        try:
+            if not options['url']:
+                # allows the test client's host & keeps emails (out of stock notices, etc) in memory
+                setup_test_environment()
+            if patcher:
+                patcher.start()
+            self._simulate(members, category, variations, rng, options)
+        finally:
+            if patcher:
+                patcher.stop()
+            if not options['url']:
+                teardown_test_environment()
+            if not options['keep']:
+                self._delete(category, vendor, variations, members)
+
+    def _create_products(self, num_products, stock):
+        vendor = Vendor.objects.create(title='{} vendor'.format(PREFIX), email='{}@example.com'.format(PREFIX))
+        category = Category.objects.create(title='{} category'.format(PREFIX), status=CONTENT_STATUS_PUBLISHED)
+
+        variations = []
+        for i in range(num_products):
+            product = Product.objects.create(title='{} product {}'.format(PREFIX, i), available=True,
+                                             status=CONTENT_STATUS_PUBLISHED)
+            product.categories.add(category)
+            variation = product.variations.create(unit_price=Decimal('5'), vendor_price=Decimal('4'), default=True)
+            variation.vendorproductvariation_set.create(vendor=vendor, num_in_stock=stock)
+            variations.append(variation)
+
+        return category, vendor, variations
+
+    def _create_members(self, num_members, drop_sites, set_password):
+        User = get_user_model()
+        members = []
+        for i in range(num_members):
+            user = User.objects.create(username='{}{}'.format(PREFIX, i), email='{}{}@example.com'.format(PREFIX, i),
+                                       first_name='Load', last_name='Sim {}'.format(i))
+            if set_password:
+                user.set_password(PASSWORD)
+                user.save()
+            Profile.objects.filter(user=user).update(drop_site=drop_sites[i % len(drop_sites)],
+                                                     signed_membership_agreement=True)
+            members.append(user)
+        Payment.objects.bulk_create([Payment(user=user, amount=Decimal('1000')) for user in members])
+        return members
+
+    def _delete(self, category, vendor, variations, members):
+        Cart.objects.filter(user_id__in=[m.id for m in members]).delete()
+        for member in members:
+            member.delete()
+        Product.objects.filter(id__in=[v.product_id for v in variations]).delete()
+        category.delete()
+        vendor.delete()
+
+    def _simulate(self, members, category, variations, rng, options):
+        skus = [v.sku for v in variations]
+        category_url = category.get_absolute_url()
+        # {action: [(status, seconds)]}
+        stats = defaultdict(list)
+        lock = threading.Lock()
+        errors = []
+        # every member starts at the same moment, like the order window opening
+        barrier = threading.Barrier(len(members))
+
+        def run(member, member_rng):
+            try:
+                if options['url']:
+                    session = _HttpSession(member, options['url'])
+                else:
+                    session = _ClientSession(member)
+                barrier.wait()
+                self._run_member(session, category_url, skus, member_rng, options['iterations'], stats, lock)
+            except Exception as e:
+                errors.append((member.username, e))
+                barrier.abort()
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=run, args=(m, random.Random(rng.random()))) for m in members]
+        lock_waits = self._get_lock_waits()
+
+        start = time.time()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.time() - start
+
+        lock_waits_after = self._get_lock_waits()
+        self._report(stats, elapsed, variations, lock_waits, lock_waits_after)
+
+        for username, e in errors[:10]:
+            self.stderr.write('{}: {!r}'.format(username, e))
+
+    def _run_member(self, session, category_url, skus, rng, iterations, stats, lock):
+        def timed(action, method, path, data=None):
+            start = time.time()
+            status, data = session.request(method, path, data)
+            with lock:
+                stats[action].append((status, time.time() - start))
+            return status, data
+
+        item_ids = set()
+        for _ in range(iterations):
+            timed('browse', 'get', category_url)
+
+            for _ in range(rng.randint(1, 4)):
+                status, data = timed('add', 'post', reverse('shop_cart_api_add'),
+                                     {'variation': rng.choice(skus), 'quantity': rng.randint(1, 3)})
+                if status == 200:
+                    item_ids.update(i['id'] for i in data['items'])
+
+            if item_ids:
+                item_id = rng.choice(sorted(item_ids))
+                quantity = rng.randint(0, 3)
+                status, data = timed('update', 'post', reverse('shop_cart_api_update', args=[item_id]),
+                                     {'quantity': quantity})
+                if status == 200 and quantity == 0:
+                    item_ids.discard(item_id)
+
+            timed('cart', 'get', reverse('shop_cart_api'))
+
+    def _get_lock_waits(self):
+        """
+        :return: (row lock waits, row lock time ms), or None if not supported by the db
+        """
+        if connection.vendor != 'mysql':
+            return None
+        with connection.cursor() as cursor:
+            cursor.execute("SHOW GLOBAL STATUS WHERE Variable_name IN ('Innodb_row_lock_waits', 'Innodb_row_lock_time')")
+            status = dict(cursor.fetchall())
+        return int(status.get('Innodb_row_lock_waits', 0)), int(status.get('Innodb_row_lock_time', 0))
+
+    def _get_oversold(self, variations):
+        """
+        :return: (number of oversold products, total units oversold)
+        """
+        stock = {(vpv.variation_id, vpv.vendor_id): vpv.num_in_stock
+                 for vpv in VendorProductVariation.objects.filter(variation__in=variations)}
+        in_carts = VendorCartItem.objects \
+            .filter(item__variation__in=variations, item__cart__in=Cart.objects.current()) \
+            .order_by() \
+            .values('item__variation_id', 'vendor_id') \
+            .annotate(quantity_sum=Sum('quantity')) \
+            .values_list('item__variation_id', 'vendor_id', 'quantity_sum')
+
+        oversold = [quantity - stock[(variation_id, vendor_id)] for variation_id, vendor_id, quantity in in_carts
+                    if stock.get((variation_id, vendor_id)) is not None
+                    and quantity > stock[(variation_id, vendor_id)]]
+        return len(oversold), sum(oversold)
+
+    def _report(self, stats, elapsed, variations, lock_waits, lock_waits_after):
+        total = sum(len(s) for s in stats.values())
+        self.stdout.write('\n{} requests in {:.1f}s, {:.1f} requests/s'.format(total, elapsed, total / elapsed))
+
+        self.stdout.write('\n{:<8} {:>8} {:>8} {:>8} {:>8} {:>8} {:>8}'.format(
+            'action', 'requests', 'errors', 'p50 ms', 'p95 ms', 'p99 ms', 'max ms'))
+        for action in ACTIONS:
+            s = stats.get(action, [])
+            if not s:
+                continue
+            times = [seconds * 1000 for status, seconds in s]
+            errors = len([status for status, seconds in s if status >= 400])
+            self.stdout.write('{:<8} {:>8} {:>8} {:>8.0f} {:>8.0f} {:>8.0f} {:>8.0f}'.format(
+                action, len(s), errors, percentile(times, 50), percentile(times, 95), percentile(times, 99),
+                max(times)))
+
+        statuses = defaultdict(int)
+        for s in stats.values():
+            for status, seconds in s:
+                statuses[status] += 1
+        self.stdout.write('\nstatus codes: {}'.format(', '.join('{}: {}'.format(k, v)
+                                                              for k, v in sorted(statuses.items()))))
+
+        products, units = self._get_oversold(variations)
+        self.stdout.write('oversold: {} units of {} products'.format(units, products))
+
+        if lock_waits is None:
+            self.stdout.write('db lock waits: not supported by the {} backend'.format(connection.vendor))
+        else:
+            self.stdout.write('db lock waits: {}, lock time: {}ms'.format(lock_waits_after[0] - lock_waits[0],
+                                                                          lock_waits_after[1] - lock_waits[1]))
@@ -0,0 +1,26 @@
+from django.contrib.auth import get_user_model
+from django.core.management import BaseCommand
+
+from ffcsa.core import google_sync
+
+
+class Command(BaseCommand):
+    help = 'Refresh the local mirror of the google contacts, optionally updating the contacts of all active members'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true',
+                            help='Fetch all contacts instead of only those changed since the last sync')
+        parser.add_argument('--members', action='store_true', help='Create/Update the contacts of all active members')
+
+    def handle(self, *args, **options):
+        result = google_sync.refresh(full=options['full'])
+        self.stdout.write('full: {r.full}, updated: {r.updated}, deleted: {r.deleted}, requests: {r.requests}'
+                          .format(r=result))
+
+        if options['members']:
+            users = get_user_model().objects.filter(is_active=True).select_related('profile')
+            result = google_sync.sync_contacts(users)
+            self.stdout.write('created: {}, updated: {}, failed: {}'.format(
+                len(result.created), len(result.updated), len(result.failed)))
+            for user, error in result.failed:
+                self.stderr.write('\t{}: {}'.format(user, error))
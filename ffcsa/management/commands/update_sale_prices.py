@@ -0,0 +1,12 @@
+from django.core.management import BaseCommand
+
+from ffcsa.shop import sales
+
+
+class Command(BaseCommand):
+    help = 'Switch products & variations to or from their sale price when a sale starts or ends'
+
+    def handle(self, *args, **options):
+        updated = sales.update_effective_prices()
+        if options['verbosity'] > 1 or updated:
+            self.stdout.write('Updated the price of {} products & variations'.format(updated))
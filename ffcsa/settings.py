@@ -266,6 +266,11 @@ GOOGLE_GROUP_IDS = {
 
 SENDINBLUE_ENABLED = False
 SENDINBLUE_API_KEY = None
+SENDINBLUE_TIMEOUT = (3.05, 10)  # (connect, read) timeouts in seconds
+SENDINBLUE_MAX_RETRIES = 2
+SENDINBLUE_MAX_RETRY_AFTER = 5  # longest Retry-After (seconds) to wait for before giving up on a request
+SENDINBLUE_LIST_ID_TTL = 60 * 60 * 24  # seconds the drop site & packout day list ids are cached for
+SENDINBLUE_TEMPLATES_TTL = 60 * 60  # seconds the transactional template metadata is cached for
 
 SENDINBLUE_LISTS = {
     'WEEKLY_NEWSLETTER': 9,
@@ -297,6 +302,11 @@ SENDINBLUE_DROP_SITE_FOLDER = 'Dropsites'
 SENDINBLUE_DROP_SITE_FOLDER_ID = 39
 SENDINBLUE_PACKOUT_DAY_FOLDER_ID = 44
 
+# Request instrumentation. Records the query counts, duplicate queries & timings of every request. See
+# ffcsa.core.instrumentation
+REQUEST_INSTRUMENTATION = False
+REQUEST_INSTRUMENTATION_BUFFER_SIZE = 1000  # number of requests kept
+
 # Rollbar settings
 
 ROLLBAR = {
@@ -719,6 +729,7 @@ INSTALLED_APPS = (
 # these middleware classes will be applied in the order given, and in the
 # response phase the middleware will be applied in reverse order.
 MIDDLEWARE_CLASSES = (
+    "ffcsa.core.middleware.InstrumentationMiddleware",
     "mezzanine.core.middleware.UpdateCacheMiddleware",
 
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -742,7 +753,6 @@ MIDDLEWARE_CLASSES = (
     # "mezzanine.pages.middleware.PageMiddleware",
     "ffcsa.shop.middleware.MultiurlPageMiddleware",
     "mezzanine.core.middleware.FetchFromCacheMiddleware",
-    "ffcsa.core.middleware.DiscountMiddleware",
     "ffcsa.core.middleware.BudgetMiddleware",
 
     'rollbar.contrib.django.middleware.RollbarNotifierMiddlewareExcluding404',
@@ -789,6 +799,13 @@ if os.path.exists(f):
     sys.modules[module_name] = module
     exec(open(f, "rb").read())
 
+# Compile templates once per process in production. The weekly reports render
+# 40+ vendor documents, each probing for vendor specific templates.
+if not DEBUG:
+    TEMPLATES[0]["OPTIONS"]["loaders"] = [
+        ("django.template.loaders.cached.Loader", TEMPLATES[0]["OPTIONS"]["loaders"]),
+    ]
+
 WEBPACK_LOADER = {
     "DEFAULT": {
         "STATS_FILE": os.path.join(
@@ -3,12 +3,13 @@ import tempfile
 import zipfile
 from collections import OrderedDict
 from decimal import Decimal
+from functools import lru_cache
 from itertools import groupby
 
 import labels
 from django import forms
 from django.contrib import admin, messages
-from django.http import HttpResponse
+from django.http import HttpResponse, StreamingHttpResponse
 from django.template.response import TemplateResponse
 from mezzanine.conf import settings
 from reportlab.graphics import shapes
@@ -16,36 +17,120 @@ from reportlab.pdfbase.pdfmetrics import stringWidth
 
 from ffcsa.core.dropsites import get_color
 from ffcsa.shop.invoice import generate_invoices
-from ffcsa.shop.models import Category, Product, OrderItem
+from ffcsa.shop.models import Category, Order, Product, OrderItem
 
 TWOPLACES = Decimal(10) ** -2
 
 
-def export_as_csv(modeladmin, request, queryset):
-    response = HttpResponse(content_type='text/csv')
-    response['Content-Disposition'] = 'attachment; filename="ffcsa_order_export.csv"'
-
-    writer = csv.writer(response)
-    writer.writerow(
-        ['Order Date', 'Last Name', 'Drop Site', 'Vendor', 'Category', 'Item', 'SKU', 'Member Price',
-         'Vendor Price', 'Quantity', 'Member Total Price', 'Vendor Total Price', 'Parent Category Order On Invoice',
-         'Child Category Order On Invoice', 'In Inventory', 'Allow Substitutions'])
-
-    products = Product.objects.all()
-    product_cache = {}
-    for order in queryset:
+EXPORT_CHUNK_SIZE = 200
+
+
+class _Echo(object):
+    """
+    File-like object which returns what is written, so csv.writer can produce rows for a StreamingHttpResponse
+    """
+
+    def write(self, value):
+        return value
+
+
+class _IndexedProduct(object):
+    def __init__(self, sku, title, vendor_price, order_on_invoice):
+        self.sku = sku
+        self.title = title
+        self.vendor_price = vendor_price
+        self.order_on_invoice = order_on_invoice
+        self.category_ids = set()
+        self.variation_vendors = {}
+        self.category = None
+
+    @property
+    def vendor(self):
+        # mirrors Product.vendor
+        if len(self.variation_vendors) != 1:
+            return None
+
+        vendors = next(iter(self.variation_vendors.values()))
+        if len(vendors) != 1:
+            return None
+        return next(iter(vendors))
+
+    def get_category(self):
+        return self.category
+
+
+class _ProductIndex(object):
+    """
+    In memory index of every product & category, used to fill in missing order item details.
+
+    This is built with 2 queries, instead of querying for each order item.
+    """
+
+    def __init__(self):
+        self.categories = list(Category.objects.select_related('parent__category'))
+        categories = {c.id: c for c in self.categories}
+
+        products = OrderedDict()
+        rows = Product.objects \
+            .values('id', 'sku', 'title', 'vendor_price', 'order_on_invoice', 'categories', 'variations',
+                    'variations__vendors__title') \
+            .order_by('id')
+        for row in rows:
+            product = products.get(row['id'])
+            if product is None:
+                product = products[row['id']] = _IndexedProduct(row['sku'], row['title'], row['vendor_price'],
+                                                                row['order_on_invoice'])
+            if row['categories']:
+                product.category_ids.add(row['categories'])
+            if row['variations']:
+                vendors = product.variation_vendors.setdefault(row['variations'], set())
+                if row['variations__vendors__title']:
+                    vendors.add(row['variations__vendors__title'])
+
+        self.by_sku = {}
+        self.by_title = {}
+        for product in products.values():
+            if len(product.category_ids) == 1:
+                product.category = categories.get(next(iter(product.category_ids)))
+            self.by_sku.setdefault(product.sku, product)
+            self.by_title.setdefault(product.title, product)
+
+    def get_product(self, item):
+        product = self.by_sku.get(item.sku)
+        if not product:
+            product = self.by_title.get(item.description)
+        return product
+
+    def get_category_by_description(self, description):
+        return next((c for c in self.categories if description in (c.description or '')), None)
+
+
+def _iter_orders(queryset, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Iterate over the orders in queryset, prefetching the order items chunk_size orders at a time
+    """
+    ids = list(queryset.values_list('id', flat=True))
+    for i in range(0, len(ids), chunk_size):
+        chunk_ids = ids[i:i + chunk_size]
+        orders = {o.id: o for o in Order.objects.filter(id__in=chunk_ids).prefetch_related('items')}
+        for id in chunk_ids:
+            yield orders[id]
+
+
+def _export_rows(queryset):
+    yield ['Order Date', 'Last Name', 'Drop Site', 'Vendor', 'Category', 'Item', 'SKU', 'Member Price',
+           'Vendor Price', 'Quantity', 'Member Total Price', 'Vendor Total Price', 'Parent Category Order On Invoice',
+           'Child Category Order On Invoice', 'In Inventory', 'Allow Substitutions']
+
+    index = _ProductIndex()
+    for order in _iter_orders(queryset):
         last_name = order.billing_detail_last_name
         drop_site = order.drop_site
         row_base = [order.time.date(), last_name, drop_site]
 
         for item in order.items.all():
-            product = product_cache[item.sku] if item.sku in product_cache else products.filter(
-                sku=item.sku).first()
-            if not product:
-                product = products.filter(title=item.description).first()
+            product = index.get_product(item)
             if product:
-                if not product.sku in product_cache:
-                    product_cache[product.sku] = product
                 if not item.vendor:
                     item.vendor = product.vendor
                 if not item.category:
@@ -83,8 +168,7 @@ def export_as_csv(modeladmin, request, queryset):
                 row.append(parts[0])
                 row.append(parts[1] if len(parts) == 2 else '')
             else:
-                category = product.get_category() if product else Category.objects.filter(
-                    description__contains=item.category).first()
+                category = product.get_category() if product else index.get_category_by_description(item.category)
                 if category:
                     add_blank = True
                     if category.parent:
@@ -97,14 +181,44 @@ def export_as_csv(modeladmin, request, queryset):
 
             row.append(item.in_inventory)
             row.append('yes' if order.allow_substitutions else 'no')
-            writer.writerow(row)
+            yield row
+
 
+def export_as_csv(modeladmin, request, queryset):
+    writer = csv.writer(_Echo())
+    response = StreamingHttpResponse((writer.writerow(row) for row in _export_rows(queryset)),
+                                     content_type='text/csv')
+    response['Content-Disposition'] = 'attachment; filename="ffcsa_order_export.csv"'
     return response
 
 
 export_as_csv.short_description = "Export As CSV"
 
 FONT_NAME = "Helvetica"
+DROP_SITE_FONT_SIZE = 16
+NAME_FONT_SIZE = 20
+
+
+@lru_cache(maxsize=None)
+def _char_width(char):
+    """
+    Width of a single character at font size 1. The width of a string is linear in the font size, and
+    is the sum of its character widths, so this is all we need to measure any label text.
+    """
+    return stringWidth(char, FONT_NAME, 1)
+
+
+def _text_width(text, font_size):
+    return sum(_char_width(c) for c in text) * font_size
+
+
+@lru_cache(maxsize=None)
+def _drop_site_swatch(drop_site):
+    """
+    Returns the (color, strokeColor, text width) used to draw the drop_site on a label
+    """
+    color, strokeColor = get_color(drop_site)
+    return color, strokeColor, _text_width(drop_site, DROP_SITE_FONT_SIZE)
 
 
 def draw_label(label, width, height, order):
@@ -113,26 +227,20 @@ def draw_label(label, width, height, order):
     drop_site = order.drop_site
 
     # Write the dropsite & color.
-    font_size = 16
-    name_width = stringWidth(drop_site, FONT_NAME, font_size)
-
-    color, strokeColor = get_color(drop_site)
+    color, strokeColor, name_width = _drop_site_swatch(drop_site)
     # label.add(shapes.Circle(((height - 8) / 2) + 4, (height - 8) / 2, (height - 8) / 2, fillColor=color, strokeColor=strokeColor))
     rect_w = max(width / 2 + 4, name_width + 16)
     label.add(shapes.Rect(width - rect_w - 4, 4, rect_w, 32, rx=2,
                           ry=2, fillColor=color, strokeColor=strokeColor))
 
     label.add(shapes.String(width - 12, 12, drop_site,
-                            fontSize=16, textAnchor='end', fontName=FONT_NAME))
+                            fontSize=DROP_SITE_FONT_SIZE, textAnchor='end', fontName=FONT_NAME))
 
-    # Measure the width of the name and shrink the font size until it fits.
-    font_size = 20
+    # Shrink the font size so the name fits.
     text_width = width - 16
     name = "{}, {}".format(last_name, first_name)
-    name_width = stringWidth(name, FONT_NAME, font_size)
-    while name_width > text_width:
-        font_size *= 0.8
-        name_width = stringWidth(name, FONT_NAME, font_size)
+    name_width = _text_width(name, 1)
+    font_size = min(NAME_FONT_SIZE, text_width / name_width) if name_width else NAME_FONT_SIZE
 
     # Write out the name in the centre of the label with a random colour.
     # s = shapes.String(width / 2.0, height - 30, name, textAnchor="middle")
@@ -192,17 +300,10 @@ def create_labels(modeladmin, request, queryset):
             for order in orders:
                 sheet.add_label(order)
 
-            with tempfile.NamedTemporaryFile() as tmp:
-                sheet.save(tmp)
-
-                # Reset file pointer
-                tmp.seek(0)
-
-                # Write file data to response
-                response = HttpResponse(
-                    tmp.read(), content_type='application/pdf')
-                response['Content-Disposition'] = 'attachment; filename="ffcsa_order_labels.pdf"'
-                return response
+            response = HttpResponse(content_type='application/pdf')
+            response['Content-Disposition'] = 'attachment; filename="ffcsa_order_labels.pdf"'
+            sheet.save(response)
+            return response
     else:
         form = SkipLabelsForm(initial={
             'skip': 0,
@@ -20,6 +20,8 @@ class ShopConfig(AppConfig):
         we use multiurl to forward to the page url if the category_product view throws a 404, as it will catch 
         non-product slugs
         """
+        # connect the catalog version signal handlers
+        from ffcsa.shop import catalog  # noqa
         from ffcsa.shop import views
         urls = urlresolvers.get_resolver()
 
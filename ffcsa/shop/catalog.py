@@ -0,0 +1,211 @@
+"""
+Catalog versioning & cached category listings.
+
+The catalog only changes when staff edit it, so category listings are cached under a catalog version which is
+changed whenever a Product, ProductVariation, VendorProductVariation, ProductOption, Sale, DiscountCode, Category or
+RecipeProduct is saved or deleted. The version is stored in the shared cache, so an edit invalidates the listings of every worker.
+
+Only the parts of a listing that are the same for every member are cached. Per-user parts (stock, add to cart forms,
+dairy eligibility, etc) are layered on top in the views.
+
+The products matched by each category's filters & each discount are also cached under the version, as sorted arrays of
+product ids, so discounts can be checked against a cart without querying the products.
+"""
+import uuid
+from array import array
+from bisect import bisect_left
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Sum
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+from mezzanine.conf import settings
+from mezzanine.utils.views import paginate
+
+from ffcsa.core.models import RecipeProduct
+from ffcsa.shop.models import Cart, CartItem, Category, DiscountCode, Product, ProductOption, ProductVariation, Sale, \
+    VendorProductVariation
+
+_VERSION_KEY = 'ffcsa.shop.catalog.version'
+
+# Product.published depends on the publish & expiry dates, so cached entries also expire
+CACHE_TTL = 60 * 15
+
+
+def get_version():
+    version = cache.get(_VERSION_KEY)
+    if version is None:
+        cache.add(_VERSION_KEY, uuid.uuid4().hex, None)
+        version = cache.get(_VERSION_KEY)
+    return version
+
+
+def bump_version():
+    cache.set(_VERSION_KEY, uuid.uuid4().hex, None)
+
+
+def cache_key(*parts):
+    return 'ffcsa.shop.catalog.{}.{}'.format(get_version(), '.'.join(str(p) for p in parts))
+
+
+def get_sort_options():
+    return [option[1] for option in settings.SHOP_PRODUCT_SORT_OPTIONS]
+
+
+def get_category_product_ids(category):
+    """
+    Returns a sorted array of the ids of the products matching the category's filters
+    """
+    key = cache_key('category_product_ids', category.id)
+    ids = cache.get(key)
+    if ids is None:
+        ids = array('l', sorted(Product.objects
+                                .filter(category.filters())
+                                .distinct()
+                                .order_by()
+                                .values_list('id', flat=True)))
+        cache.set(key, ids, CACHE_TTL)
+    return ids
+
+
+def get_discount_product_ids(discount):
+    """
+    Returns a sorted array of the ids of the products the discount applies to. This is the same as
+    Discount.all_products. An empty array means the discount applies to every product
+    """
+    key = cache_key('discount_product_ids', discount._meta.model_name, discount.id)
+    ids = cache.get(key)
+    if ids is None:
+        ids = set(discount.products.values_list('id', flat=True))
+        for category in discount.categories.all():
+            ids.update(get_category_product_ids(category))
+        ids = array('l', sorted(ids))
+        cache.set(key, ids, CACHE_TTL)
+    return ids
+
+
+def contains(ids, id):
+    """
+    Returns True if id is in the sorted array of ids
+    """
+    i = bisect_left(ids, id)
+    return i < len(ids) and ids[i] == id
+
+
+def get_category_products(category, sort_by, page_num, for_user=None):
+    """
+    Returns a page of the published & available products in the category. The products have their variations,
+    vendor variations & categories prefetched.
+
+    sort_by must be one of get_sort_options()
+    """
+    # staff can see unpublished products
+    staff = bool(for_user and for_user.is_authenticated() and for_user.is_staff)
+
+    key = cache_key('category', category.id, sort_by, staff)
+    ids = cache.get(key)
+    if ids is None:
+        ids = list(Product.objects
+                   .published(for_user=for_user)
+                   .filter(id__in=get_category_product_ids(category))
+                   .filter(available=True)
+                   .distinct()
+                   .order_by(sort_by)
+                   .values_list('id', flat=True))
+        cache.set(key, ids, CACHE_TTL)
+
+    products = paginate(ids, page_num, settings.SHOP_PER_PAGE_CATEGORY, settings.MAX_PAGING_LINKS)
+
+    key = cache_key('category_page', category.id, sort_by, staff, products.number)
+    object_list = cache.get(key)
+    if object_list is None:
+        by_id = Product.objects \
+            .filter(id__in=products.object_list) \
+            .prefetch_related('variations__vendorproductvariation_set') \
+            .prefetch_related('categories__parent__category') \
+            .in_bulk()
+        object_list = [by_id[id] for id in products.object_list if id in by_id]
+        cache.set(key, object_list, CACHE_TTL)
+
+    products.object_list = object_list
+    return products
+
+
+def get_child_categories(category):
+    """
+    Returns the published child categories that have available products
+    """
+    key = cache_key('child_categories', category.id)
+    categories = cache.get(key)
+    if categories is None:
+        sub_categories = category.children.published()
+        categories = list(Category.objects.filter(id__in=sub_categories, products__available=True).distinct())
+        cache.set(key, categories, CACHE_TTL)
+    return categories
+
+
+def prefetch_live_stock(variations):
+    """
+    Calculate the live stock of each variation using a single query. This is the same as calling
+    ProductVariation.live_num_in_stock for each variation. The variations should have their vendor variations
+    prefetched
+    """
+    variations = [v for v in variations if not hasattr(v, '_cached_num_in_stock')]
+    if not variations:
+        return
+
+    in_carts = dict(CartItem.objects
+                    .filter(variation__in=variations, cart__in=Cart.objects.current())
+                    .order_by()
+                    .values('variation_id')
+                    .annotate(quantity_sum=Sum('vendors__quantity'))
+                    .values_list('variation_id', 'quantity_sum'))
+
+    for variation in variations:
+        num_in_stock = variation.number_in_stock
+        if num_in_stock is not None:
+            extra = round(num_in_stock * variation.extra / 100) if variation.extra else 0
+            num_in_stock -= extra
+
+            num_in_carts = in_carts.get(variation.id)
+            if num_in_carts is not None:
+                num_in_stock = num_in_stock - num_in_carts
+        variation._cached_num_in_stock = num_in_stock
+
+
+def _catalog_changed():
+    bump_version()
+    # listings cached by other workers before the transaction commits would be stale, so bump again after commit
+    transaction.on_commit(bump_version)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=ProductVariation)
+@receiver(post_delete, sender=ProductVariation)
+@receiver(post_save, sender=VendorProductVariation)
+@receiver(post_delete, sender=VendorProductVariation)
+@receiver(post_save, sender=Sale)
+@receiver(post_delete, sender=Sale)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=RecipeProduct)
+@receiver(post_delete, sender=RecipeProduct)
+@receiver(post_save, sender=ProductOption)
+@receiver(post_delete, sender=ProductOption)
+@receiver(post_save, sender=DiscountCode)
+@receiver(post_delete, sender=DiscountCode)
+def catalog_handler(**kwargs):
+    _catalog_changed()
+
+
+@receiver(m2m_changed, sender=Product.categories.through)
+@receiver(m2m_changed, sender=Sale.products.through)
+@receiver(m2m_changed, sender=Sale.categories.through)
+@receiver(m2m_changed, sender=Category.options.through)
+@receiver(m2m_changed, sender=DiscountCode.products.through)
+@receiver(m2m_changed, sender=DiscountCode.categories.through)
+def catalog_m2m_handler(action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        _catalog_changed()
@@ -35,7 +35,6 @@ def default_billship_handler(request, order_form):
     accessible via ``request.cart``
     """
     if not request.session.get("free_shipping"):
-        settings.clear_cache()
         set_shipping(request, _("Flat rate shipping"),
                      settings.SHOP_DEFAULT_SHIPPING_VALUE)
 
@@ -163,7 +162,6 @@ def send_order_email(request, order):
     """
     Send order receipt email on successful order.
     """
-    settings.clear_cache()
     order_context = {"order": order, "request": request,
                      "order_items": order.items.all()}
     order_context.update(order.details_as_dict())
@@ -275,8 +275,8 @@ register_setting(
     default=(
         (_("Recently added"), "-date_added"),
         (_("Highest rated"), "-rating_average"),
-        (_("Least expensive"), "unit_price"),
-        (_("Most expensive"), "-unit_price"),
+        (_("Least expensive"), "effective_price"),
+        (_("Most expensive"), "-effective_price"),
     ),
 )
 
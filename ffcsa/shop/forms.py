@@ -91,8 +91,13 @@ class AddProductForm(forms.Form):
 
         super(AddProductForm, self).__init__(*args, **kwargs)
         # for variation in self._product.variations.filter(unit_price__isnull=False):
-        choices = [(v.sku, v.title) for v in
-                   self._product.variations.filter(unit_price__isnull=False).order_by('-default')]
+        if 'variations' in getattr(self._product, '_prefetched_objects_cache', {}):
+            # avoid a query per product when listing products
+            variations = sorted((v for v in self._product.variations.all() if v.unit_price is not None),
+                                key=lambda v: not v.default)
+        else:
+            variations = self._product.variations.filter(unit_price__isnull=False).order_by('-default')
+        choices = [(v.sku, v.title) for v in variations]
 
         if choices:
             field = forms.ChoiceField(label='Options', choices=choices, widget=widget, initial=choices[0][0])
@@ -422,7 +427,6 @@ class OrderForm(FormsetForm, DiscountForm):
 
         # Hide discount code field if it shouldn't appear in checkout,
         # or if no discount codes are active.
-        settings.clear_cache()
         if not (settings.SHOP_DISCOUNT_FIELD_IN_CHECKOUT and
                 DiscountCode.objects.active().exists()):
             self.fields["discount_code"].widget = forms.HiddenInput()
@@ -1,10 +1,10 @@
 from collections import namedtuple, OrderedDict
 from itertools import groupby
 
-from django.template.loader import get_template
 from weasyprint import HTML
 
 from ffcsa.shop.models import Category
+from ffcsa.shop.utils import get_report_template
 
 OrderInvoice = namedtuple('OrderInvoice', ['invoice', 'order'])
 
@@ -42,6 +42,6 @@ def generate_invoices(orders):
              ("Alt. Phone", order.billing_detail_phone_2)],
         ]
 
-        html = get_template("shop/order_packlist_pdf.html").render(context)
+        html = get_report_template("shop/order_packlist_pdf.html").render(context)
 
         yield OrderInvoice(HTML(string=html).render(), order)
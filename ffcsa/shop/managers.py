@@ -6,7 +6,7 @@ from decimal import Decimal
 
 from django.contrib.auth import get_user_model
 from django.db import transaction
-from django.db.models import Manager, Q, Sum
+from django.db.models import F, Manager, Q, Sum
 from django.utils.timezone import now
 from future.builtins import str, zip
 from mezzanine.conf import settings
@@ -349,6 +349,23 @@ class ProductActionManager(Manager):
         """
         self._action_for_field("total_cart")
 
+    def products_added_to_cart(self, products):
+        """
+        Increase total_cart for each of the distinct products using a
+        fixed number of queries, instead of calling ``added_to_cart``
+        for each product.
+        """
+        timestamp = datetime.today().toordinal()
+        product_ids = {p.id for p in products}
+        if not product_ids:
+            return
+        actions = self.filter(product_id__in=product_ids, timestamp=timestamp)
+        existing = set(actions.values_list("product_id", flat=True))
+        if existing:
+            actions.update(total_cart=F("total_cart") + 1)
+        self.bulk_create([self.model(product_id=id, timestamp=timestamp, total_cart=1)
+                          for id in product_ids - existing])
+
     def purchased(self):
         """
         Increase total_purchased when product is purchased.
@@ -376,10 +393,13 @@ class DiscountCodeManager(Manager):
         """
         total_price_valid = (Q(min_purchase__isnull=True) |
                              Q(min_purchase__lte=cart.item_total_price()))
+        # catalog imports ffcsa.shop.models, which imports this module
+        from ffcsa.shop import catalog
         discount = self.active().get(total_price_valid, code=code)
-        products = discount.all_products()
-        if products.count() > 0:
-            if products.filter(variations__sku__in=cart.skus()).count() == 0:
+        product_ids = catalog.get_discount_product_ids(discount)
+        if product_ids:
+            if not any(catalog.contains(product_ids, item.variation.product_id)
+                       for item in cart):
                 raise self.model.DoesNotExist
         return discount
 
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+from django.db.models import F, Q
+from django.utils.timezone import now
+import ffcsa.shop.fields
+
+
+def set_effective_prices(apps, schema_editor):
+    n = now()
+    in_effect = Q(sale_price__isnull=False) & \
+        (Q(sale_from__isnull=True) | Q(sale_from__lte=n)) & \
+        (Q(sale_to__isnull=True) | Q(sale_to__gt=n))
+    for model_name in ('Product', 'ProductVariation'):
+        priced_model = apps.get_model('shop', model_name)
+        priced_model.objects.filter(in_effect).update(effective_price=F('sale_price'))
+        priced_model.objects.exclude(in_effect).update(effective_price=F('unit_price'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0047_auto_20200609_0915'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='effective_price',
+            field=ffcsa.shop.fields.MoneyField(blank=True, db_index=True, decimal_places=2, editable=False, max_digits=10, null=True, verbose_name='Effective price'),
+        ),
+        migrations.AddField(
+            model_name='productvariation',
+            name='effective_price',
+            field=ffcsa.shop.fields.MoneyField(blank=True, db_index=True, decimal_places=2, editable=False, max_digits=10, null=True, verbose_name='Effective price'),
+        ),
+        migrations.RunPython(set_effective_prices, migrations.RunPython.noop),
+    ]
@@ -1,8 +1,10 @@
+from collections import namedtuple
 from decimal import Decimal
 from itertools import takewhile
 
 from django.contrib.auth import get_user_model
-from django.db import models
+from django.db import models, transaction
+from django.db.models import prefetch_related_objects
 from django.utils.encoding import force_text
 from django.utils.translation import ugettext_lazy as _
 from future.builtins import super
@@ -13,6 +15,12 @@ from ffcsa.shop import managers
 from ffcsa.shop.models.Order import Order
 from ffcsa.core.models import Payment
 
+# The outcome of adding a single (variation, quantity) line with ``Cart.add_items``
+AddItemResult = namedtuple('AddItemResult', ['variation', 'quantity', 'status'])
+
+# The totals of a cart, calculated once by ``Cart.pricing`` until the items change
+CartPricing = namedtuple('CartPricing', ['item_total', 'discount_code', 'discount', 'delivery_fee', 'total'])
+
 
 class Cart(models.Model):
     last_updated = models.DateTimeField(_("Last updated"), null=True)
@@ -23,13 +31,19 @@ class Cart(models.Model):
 
     objects = managers.PersistentCartManager()
 
+    # AddItemResult statuses
+    ADDED = 'added'
+    UNAVAILABLE = 'unavailable'
+    OVER_BUDGET = 'over_budget'
+    OUT_OF_STOCK = 'out_of_stock'
+
     def __iter__(self):
         """
         Allow the cart to be iterated giving access to the cart's items,
         ensuring the items are only retrieved once and cached.
         """
         if not hasattr(self, "_cached_items"):
-            self._cached_items = self.items.all()
+            self._cached_items = self.items.select_related('variation').prefetch_related('vendors')
         return iter(self._cached_items)
 
     def add_item(self, variation, quantity, record_action=True):
@@ -47,10 +61,188 @@ class Cart(models.Model):
 
         item.update_quantity(quantity)
         item.save()
+        self._clear_cached()
+
+    def add_items(self, lines, record_action=True):
+        """
+        Add a bundle of (variation, quantity) lines to the cart. Like ``add_item``, the quantity of an item already in
+        the cart is set to the line quantity.
+
+        The budget & stock of the whole bundle are checked against a single stock snapshot, and the vendors for every
+        line are allocated in one transaction. Lines are added in order. Once a line is over the remaining budget,
+        none of the following lines are added.
+
+        :return: an AddItemResult for each line
+        """
+        from ffcsa.shop.models import ProductAction
+        from ffcsa.shop.models.Vendor import VendorCartItem
+
+        # TODO: remove this for one-time orders
+        if not self.user_id:
+            raise Exception("You must be logged in to add products to your cart")
+
+        lines = list(lines)
+        variations = [variation for variation, quantity in lines]
+        prefetch_related_objects(variations, 'product', 'vendorproductvariation_set')
+
+        # the items are also used to calculate the remaining budget
+        self._cached_items = list(self.items.select_related('variation').prefetch_related('vendors')) \
+            if self.pk else []
+        items = {item.variation_id: item for item in self._cached_items}
+        vendor_items = {item.variation_id: {vi.vendor_id: vi for vi in item.vendors.all()} for item in items.values()}
+        saved_quantities = {vi.pk: vi.quantity for vis in vendor_items.values() for vi in vis.values()}
+        remaining_budget = self.remaining_budget()
+        self._snapshot_stock(variations)
+
+        results = []
+        added = []
+        over_budget = False
+        with transaction.atomic():
+            if not self.pk:
+                self.save()
+
+            for variation, quantity in lines:
+                item = items.get(variation.id)
+                diff = quantity - (item.quantity if item else 0)
+
+                if over_budget:
+                    status = self.OVER_BUDGET
+                elif not variation.product.available:
+                    status = self.UNAVAILABLE
+                elif diff > 0 and remaining_budget < variation.price() * diff:
+                    over_budget = True
+                    status = self.OVER_BUDGET
+                elif diff > 0 and not variation.has_stock(diff):
+                    status = self.OUT_OF_STOCK
+                else:
+                    if item is None:
+                        item = CartItem.objects.create(cart=self, variation=variation)
+                        item._cached_quantity = 0
+                        items[variation.id] = item
+                        vendor_items[variation.id] = {}
+                        added.append(variation.product)
+                    self._allocate(item, variation, diff, vendor_items[variation.id])
+                    remaining_budget -= variation.price() * diff
+                    status = self.ADDED
+
+                results.append(AddItemResult(variation, quantity, status))
+
+            new_vendor_items = []
+            for vis in vendor_items.values():
+                for vi in vis.values():
+                    if vi.pk is None:
+                        if vi.quantity > 0:
+                            new_vendor_items.append(vi)
+                    elif vi.quantity == 0:
+                        vi.delete()
+                    elif vi.quantity != saved_quantities[vi.pk]:
+                        vi.save()
+            VendorCartItem.objects.bulk_create(new_vendor_items)
+
+            if added and record_action:
+                ProductAction.objects.products_added_to_cart(added)
+
+        # the items have changed
+        self._clear_cached()
+
+        out_of_stock = {r.variation.id: r.variation for r in results
+                        if r.status == self.ADDED and r.variation.live_num_in_stock() is not None and
+                        r.variation.live_num_in_stock() <= 0}
+        for variation in out_of_stock.values():
+            # notify admin that a product is out of stock
+            send_mail_template(
+                "Member Store - Item Out Of Stock",
+                "shop/admin_out_of_stock_email",
+                settings.DEFAULT_FROM_EMAIL,
+                settings.DEFAULT_FROM_EMAIL,
+                context={'variation': variation},
+                fail_silently=True,
+            )
+
+        return results
+
+    def _snapshot_stock(self, variations):
+        """
+        Calculate the live stock of each variation & each of its vendor variations using a single query. The
+        variations need their vendor variations prefetched
+        """
+        from ffcsa.shop.models.Vendor import VendorCartItem
+
+        in_carts = VendorCartItem.objects \
+            .filter(item__variation__in=variations, item__cart__in=Cart.objects.current()) \
+            .order_by() \
+            .values('item__variation_id', 'vendor_id') \
+            .annotate(quantity_sum=models.Sum('quantity')) \
+            .values_list('item__variation_id', 'vendor_id', 'quantity_sum')
+
+        by_vendor = {}
+        by_variation = {}
+        for variation_id, vendor_id, quantity in in_carts:
+            by_vendor[(variation_id, vendor_id)] = quantity
+            by_variation[variation_id] = by_variation.get(variation_id, 0) + quantity
+
+        for variation in variations:
+            for vpv in variation.vendorproductvariation_set.all():
+                if vpv.num_in_stock is not None:
+                    vpv._cached_num_in_stock = vpv.num_in_stock - by_vendor.get((variation.id, vpv.vendor_id), 0)
+
+            num_in_stock = variation.number_in_stock
+            if num_in_stock is not None:
+                extra = round(num_in_stock * variation.extra / 100) if variation.extra else 0
+                num_in_stock -= extra + by_variation.get(variation.id, 0)
+            variation._cached_num_in_stock = num_in_stock
+
+    def _allocate(self, item, variation, diff, vendor_items):
+        """
+        Allocate the change in quantity of the item to the vendors in memory, using the stock snapshot. This is
+        the same allocation as ``CartItem.update_quantity``. vendor_items is {vendor_id: VendorCartItem} of the item
+        """
+        from ffcsa.shop.models.Vendor import VendorCartItem
+
+        if diff > 0:
+            remaining = diff
+            for vpv in takewhile(lambda x: remaining > 0, variation.vendorproductvariation_set.all()):
+                stock = vpv.live_num_in_stock()
+                # If stock is None then there is no limit.
+                qty = min(stock, remaining) if stock is not None else remaining
+                if qty <= 0:
+                    continue
+                vi = vendor_items.get(vpv.vendor_id)
+                if vi is None:
+                    vi = VendorCartItem(item=item, vendor_id=vpv.vendor_id, quantity=0)
+                    vendor_items[vpv.vendor_id] = vi
+                vi._order = vpv._order
+                vi.quantity = vi.quantity + qty
+                if stock is not None:
+                    vpv._cached_num_in_stock = stock - qty
+                remaining = remaining - qty
+        else:
+            remaining = abs(diff)
+            # Product vendors are listed by preference using the _order field
+            # So we want to decrease quantity starting from least preferred vendors
+            for vi in sorted(vendor_items.values(), key=lambda vi: -vi._order):
+                if remaining <= 0:
+                    break
+                qty = min(remaining, vi.quantity)
+                vi.quantity = vi.quantity - qty
+                remaining = remaining - qty
+
+        allocated = diff - remaining if diff > 0 else diff + remaining
+        item._cached_quantity = item.quantity + allocated
+        if variation._cached_num_in_stock is not None:
+            variation._cached_num_in_stock -= allocated
 
     def clear(self):
         self.attending_dinner = 0
         self.items.all().delete()
+        self._clear_cached()
+
+    def _clear_cached(self):
+        """
+        Forget the cached items & pricing after the items change
+        """
+        self.__dict__.pop('_cached_items', None)
+        self.__dict__.pop('_cached_pricing', None)
 
     def over_budget(self, additional_total=0):
         # User is not logged in
@@ -94,50 +286,55 @@ class Cart(models.Model):
 
         return ytd_payment_total - (ytd_order_total + self.total_price())
 
-    def delivery_fee(self):
-        if not self.user_id or not settings.HOME_DELIVERY_ENABLED:
-            return 0
-
-        User = get_user_model()
-        user = User.objects.get(pk=self.user_id)
-
-        if not user or not user.profile.home_delivery:
-            return 0
-
-        order_total = self.total_price_after_discount()
-        if order_total >= settings.FREE_HOME_DELIVERY_ORDER_AMOUNT:
-            return 0
-
-        zip_code = user.profile.delivery_address.zip
-        if zip_code in settings.HOME_DELIVERY_FEE_BY_ZIP:
-            return settings.HOME_DELIVERY_FEE_BY_ZIP[zip_code]
+    def pricing(self):
+        """
+        Returns a ``CartPricing`` snapshot of the cart totals. The user's discount code & delivery details are looked
+        up once, and the snapshot is kept until the items change.
+        """
+        if not hasattr(self, '_cached_pricing'):
+            self._cached_pricing = self._calculate_pricing()
+        return self._cached_pricing
+
+    def _calculate_pricing(self):
+        item_total = self.item_total_price()
+        discount_code = None
+        discount = 0
+        delivery_fee = 0
+
+        if self.user_id is not None:
+            User = get_user_model()
+            user = User.objects.select_related('profile__discount_code').get(pk=self.user_id)
+            profile = user.profile
+
+            # TODO :: This will have to be changed to allow for public discount codes
+            # TODO: for one-time orders, also apply the member discount to members without a discount code?
+            if profile.discount_code:
+                discount_code = profile.discount_code.code
+                discount = self.calculate_discount(profile.discount_code, has_member_discount=profile.is_member)
+
+            if settings.HOME_DELIVERY_ENABLED and profile.home_delivery \
+                    and item_total - discount < settings.FREE_HOME_DELIVERY_ORDER_AMOUNT:
+                zip_code = profile.delivery_address.zip
+                delivery_fee = settings.HOME_DELIVERY_FEE_BY_ZIP.get(zip_code, settings.DEFAULT_HOME_DELIVERY_CHARGE)
+
+        total = item_total - discount + Decimal(delivery_fee)
+        return CartPricing(item_total, discount_code, discount, delivery_fee, total)
 
-        return settings.DEFAULT_HOME_DELIVERY_CHARGE
+    def delivery_fee(self):
+        return self.pricing().delivery_fee
 
     def discount(self):
-        # TODO :: This will have to be changed to allow for public discount codes
-        if self.user_id is None:
-            return 0
-
-        User = get_user_model()
-        user = User.objects.get(pk=self.user_id)
-
-        # Not logged in, or is a non-member without a discount code
-        if not user or not user.profile.discount_code:
-            # TODO: use the following for one-time orders?
-            # if not user or (not user.profile.is_member and not user.profile.discount_code):
-            return 0
-
-        return self.calculate_discount(user.profile.discount_code, has_member_discount=user.profile.is_member)
+        return self.pricing().discount
 
     def total_price_after_discount(self):
-        return self.item_total_price() - self.discount()
+        pricing = self.pricing()
+        return pricing.item_total - pricing.discount
 
     def total_price(self):
         """
         Cart total including discount & delivery fees
         """
-        return self.item_total_price() - self.discount() + Decimal(self.delivery_fee())
+        return self.pricing().total
 
     def has_items(self):
         """
@@ -160,7 +357,7 @@ class Cart(models.Model):
     def skus(self):
         """
         Returns a list of skus for items in the cart. Used by
-        ``upsell_products`` and ``calculate_discount``.
+        ``upsell_products``.
         """
         return [item.sku for item in self]
 
@@ -183,7 +380,8 @@ class Cart(models.Model):
         might have the discount, others might not.
         """
 
-        from ffcsa.shop.models import ProductVariation
+        # catalog imports ffcsa.shop.models, so it can't be imported at module level
+        from ffcsa.shop import catalog
 
         total = Decimal("0")
 
@@ -198,18 +396,13 @@ class Cart(models.Model):
             return total
 
         # Discount applies to cart total if not product specific.
-        products = discount.all_products()
-        if products.count() == 0:
+        product_ids = catalog.get_discount_product_ids(discount)
+        if not product_ids:
             return discount.calculate(self.item_total_price() - total)  # - total to account for discount
 
-        # Create a list of skus in the cart that are applicable to
-        # the discount, and total the discount for appllicable items.
-        lookup = {"product__in": products, "sku__in": self.skus()}
-        discount_variations = ProductVariation.objects.filter(**lookup)
-        discount_skus = discount_variations.values_list("sku", flat=True)
-
+        # Total the discount for the items the discount applies to.
         for item in self:
-            if item.sku in discount_skus:
+            if catalog.contains(product_ids, item.variation.product_id):
                 relevant_discount = item.member_unit_price if has_member_discount else item.unit_price
                 total += discount.calculate(relevant_discount) * item.quantity
 
@@ -2,8 +2,7 @@ from functools import reduce
 from operator import iand, ior
 
 from django.db import models
-from django.db.models import Q
-from django.utils.timezone import now
+from django.db.models import F, Q
 from django.utils.translation import ugettext_lazy as _
 from mezzanine.core.fields import FileField
 from mezzanine.core.models import RichText
@@ -55,26 +54,19 @@ class Category(Page, RichText):
         if options:
             lookup = dict([("%s__in" % k, v) for k, v in options.items()])
             filters.append(Q(**lookup))
-        # Q objects used against variations to ensure sale date is
-        # valid when filtering by sale, or sale price.
-        n = now()
-        valid_sale_from = Q(sale_from__isnull=True) | Q(sale_from__lte=n)
-        valid_sale_to = Q(sale_to__isnull=True) | Q(sale_to__gte=n)
-        valid_sale_date = valid_sale_from & valid_sale_to
-        # Filter by variations with the selected sale if the sale date
-        # is valid.
+        # Filter by variations with the selected sale if the sale is in
+        # effect, ie. the sale price is the effective price.
         if self.sale_id:
-            filters.append(Q(sale_id=self.sale_id) & valid_sale_date)
-        # If a price range is specified, use either the unit price or
-        # a sale price if the sale date is valid.
+            filters.append(Q(sale_id=self.sale_id) &
+                           Q(effective_price=F("sale_price")))
+        # If a price range is specified, use the effective price, which is
+        # the sale price while a sale is in effect.
         if self.price_min or self.price_max:
             prices = []
             if self.price_min:
-                sale = Q(sale_price__gte=self.price_min) & valid_sale_date
-                prices.append(Q(unit_price__gte=self.price_min) | sale)
+                prices.append(Q(effective_price__gte=self.price_min))
             if self.price_max:
-                sale = Q(sale_price__lte=self.price_max) & valid_sale_date
-                prices.append(Q(unit_price__lte=self.price_max) | sale)
+                prices.append(Q(effective_price__lte=self.price_max))
             filters.append(reduce(iand, prices))
         # Turn the variation filters into a product filter.
         operator = iand if self.combined else ior
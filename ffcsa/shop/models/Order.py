@@ -94,6 +94,12 @@ class Order(SiteRelated):
         for field in self.session_fields:
             if field in request.session:
                 setattr(self, field, request.session[field])
+        if request.user.is_authenticated():
+            # Members' discounts come from their profile discount code, so
+            # ignore any code stored in the session.
+            pricing = request.cart.pricing()
+            self.discount_code = pricing.discount_code or ""
+            self.discount_total = pricing.discount if pricing.discount_code else None
         self.total = self.item_total = request.cart.item_total_price()
         if self.shipping_total is not None:
             self.shipping_total = Decimal(str(self.shipping_total))
@@ -114,7 +120,7 @@ class Order(SiteRelated):
         delete the cart.
         """
         self.save()  # Save the transaction ID.
-        discount_code = request.session.get('discount_code')
+        discount_code = self.discount_code
         clear_session(request, "order", *self.session_fields)
         for item in request.cart:
             try:
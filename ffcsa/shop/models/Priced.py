@@ -21,6 +21,10 @@ class Priced(models.Model):
     sale_price = fields.MoneyField(_("Sale price"))
     sale_from = models.DateTimeField(_("Sale start"), blank=True, null=True)
     sale_to = models.DateTimeField(_("Sale end"), blank=True, null=True)
+    # the sale price while a sale is in effect, otherwise the unit price.
+    # Set on save & flipped at the sale boundaries by update_sale_prices
+    effective_price = fields.MoneyField(_("Effective price"), editable=False,
+                                        db_index=True)
     sku = fields.SKUField(blank=True, null=True)
     num_in_stock = models.IntegerField(_("Number in stock"), blank=True,
                                        null=True)
@@ -36,29 +40,49 @@ class Priced(models.Model):
     class Meta:
         abstract = True
 
+    def save(self, *args, **kwargs):
+        self.effective_price = self.get_effective_price()
+        super(Priced, self).save(*args, **kwargs)
+
+    def sale_in_effect(self, at=None):
+        """
+        Returns True if the sale price applies at the given time,
+        defaulting to now. Only used to calculate the effective price,
+        use ``on_sale`` when displaying prices.
+        """
+        if self.sale_price is None:
+            return False
+        at = at or now()
+        valid_from = self.sale_from is None or self.sale_from <= at
+        valid_to = self.sale_to is None or self.sale_to > at
+        return valid_from and valid_to
+
+    def get_effective_price(self, at=None):
+        if self.sale_in_effect(at):
+            return self.sale_price
+        return self.unit_price
+
     def on_sale(self):
         """
         Returns True if the sale price is applicable.
         """
-        n = now()
-        valid_from = self.sale_from is None or self.sale_from < n
-        valid_to = self.sale_to is None or self.sale_to > n
-        return self.sale_price is not None and valid_from and valid_to
+        return self.sale_price is not None and \
+            self.effective_price == self.sale_price
 
     def has_price(self):
         """
         Returns True if there is a valid price.
         """
-        return self.on_sale() or self.unit_price is not None
+        return self.effective_price is not None or self.unit_price is not None
 
     def price(self):
         """
         Returns the actual price - sale price if applicable otherwise
         the unit price.
         """
-        if self.on_sale():
-            return self.sale_price
-        elif self.has_price():
+        if self.effective_price is not None:
+            return self.effective_price
+        elif self.unit_price is not None:
             return self.unit_price
 
         return Decimal("0")
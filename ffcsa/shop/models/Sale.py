@@ -2,9 +2,9 @@ from django.db import connection, models
 from django.db.models import F
 from django.db.models.signals import m2m_changed
 from django.dispatch import receiver
+from django.utils.timezone import now
 from django.utils.translation import ugettext_lazy as _
 from future.builtins import super
-from mezzanine.conf import settings
 
 from ffcsa.shop.models import Product, ProductVariation
 from ffcsa.shop.models.Discount import Discount
@@ -21,9 +21,15 @@ class Sale(Discount):
         verbose_name = _("Sale")
         verbose_name_plural = _("Sales")
 
+    # max number of ids in each UPDATE ... WHERE id IN (...) statement
+    UPDATE_CHUNK_SIZE = 500
+
     def save(self, *args, **kwargs):
+        from ffcsa.shop import catalog
         super(Sale, self).save(*args, **kwargs)
         self.update_products()
+        # the sale prices are updated in bulk, which doesn't send any signals
+        catalog.bump_version()
 
     def update_products(self):
         """
@@ -48,35 +54,25 @@ class Sale(Discount):
                 sale_price = self.discount_exact
             else:
                 return
+            n = now()
+            in_effect = ((self.valid_from is None or self.valid_from <= n) and
+                         (self.valid_to is None or self.valid_to > n))
+            update = {"sale_id": self.id,
+                      "sale_price": sale_price,
+                      "sale_to": self.valid_to,
+                      "sale_from": self.valid_from,
+                      # update_sale_prices flips this at the sale boundaries
+                      "effective_price": (sale_price if in_effect
+                                          else F("unit_price"))}
             products = self.all_products()
             variations = ProductVariation.objects.filter(product__in=products)
             for priced_objects in (products, variations):
-                update = {"sale_id": self.id,
-                          "sale_price": sale_price,
-                          "sale_to": self.valid_to,
-                          "sale_from": self.valid_from}
-                using = priced_objects.db
-                if "mysql" not in settings.DATABASES[using]["ENGINE"]:
-                    priced_objects.filter(**extra_filter).update(**update)
-                else:
-                    # Work around for MySQL which does not allow update
-                    # to operate on subquery where the FROM clause would
-                    # have it operate on the same table, so we update
-                    # each instance individually: http://bit.ly/1xMOGpU
-                    #
-                    # Also MySQL may raise a 'Data truncated' warning here
-                    # when doing a calculation that exceeds the precision
-                    # of the price column. In this case it's safe to ignore
-                    # it and the calculation will still be applied, but
-                    # we need to massage transaction management in order
-                    # to continue successfully: http://bit.ly/1xMOJCd
-                    for priced in priced_objects.filter(**extra_filter):
-                        for field, value in list(update.items()):
-                            setattr(priced, field, value)
-                        try:
-                            priced.save()
-                        except Warning:
-                            connection.set_rollback(False)
+                # Materialize the ids first. MySQL does not allow an update
+                # to operate on a subquery of the same table, and updating
+                # by id keeps each statement small: http://bit.ly/1xMOGpU
+                ids = list(priced_objects.filter(**extra_filter)
+                           .order_by().values_list("id", flat=True))
+                self._update_priced(priced_objects.model, ids, update)
 
     def delete(self, *args, **kwargs):
         """
@@ -91,9 +87,31 @@ class Sale(Discount):
         to updating the sale, when deactivating it or deleting it.
         """
         update = {"sale_id": None, "sale_price": None,
-                  "sale_from": None, "sale_to": None}
+                  "sale_from": None, "sale_to": None,
+                  "effective_price": F("unit_price")}
         for priced_model in (Product, ProductVariation):
-            priced_model.objects.filter(sale_id=self.id).update(**update)
+            ids = list(priced_model.objects.filter(sale_id=self.id)
+                       .values_list("id", flat=True))
+            self._update_priced(priced_model, ids, update)
+
+    def _update_priced(self, priced_model, ids, update):
+        """
+        Apply the update to the priced objects with the given ids, in
+        chunks of UPDATE_CHUNK_SIZE. This is a bulk update, so no model
+        save signals are sent.
+        """
+        for i in range(0, len(ids), self.UPDATE_CHUNK_SIZE):
+            chunk = ids[i:i + self.UPDATE_CHUNK_SIZE]
+            try:
+                priced_model.objects.filter(id__in=chunk).update(**update)
+            except Warning:
+                # MySQL may raise a 'Data truncated' warning here when
+                # doing a calculation that exceeds the precision of the
+                # price column. In this case it's safe to ignore it and
+                # the calculation will still be applied, but we need to
+                # massage transaction management in order to continue
+                # successfully: http://bit.ly/1xMOJCd
+                connection.set_rollback(False)
 
 
 @receiver(m2m_changed, sender=Sale.products.through)
@@ -0,0 +1,116 @@
+"""
+Precompiled index of the order windows, drop site pickup days & home delivery days.
+
+settings.ORDER_WINDOWS, settings.DROPSITES & settings.HOME_DELIVERY_DAY are compiled once into dicts keyed by drop
+site & zip code. The boundaries of each order window only change when the date changes, so they are computed once
+and memoized until midnight.
+"""
+import datetime
+
+from ffcsa import settings
+from ffcsa.core.utils import get_next_day
+
+
+class _Window(object):
+    def __init__(self, id, window):
+        self.id = id
+        self.window = window
+        self.start_day = window['startDay']
+        self.end_day = window['endDay']
+        self.start_time = tuple(int(t) for t in window['startTime'].split(':'))
+        self.end_time = tuple(int(t) for t in window['endTime'].split(':'))
+
+    def get_period(self, now):
+        hour, minute = self.end_time
+        end = get_next_day(self.end_day, now).replace(hour=hour, minute=minute, second=59, microsecond=0)
+
+        week_start = get_next_day(self.start_day, now)
+        if week_start >= end:
+            week_start = week_start - datetime.timedelta(7)
+
+        hour, minute = self.start_time
+        start = week_start.replace(hour=hour, minute=minute, second=0, microsecond=0)
+        return start, end
+
+
+_WINDOWS = [_Window(i, w) for i, w in enumerate(settings.ORDER_WINDOWS)]
+
+# the first window a drop site or zip is in wins
+_WINDOW_BY_DROPSITE = {}
+_WINDOW_BY_ZIP = {}
+for _w in reversed(_WINDOWS):
+    _WINDOW_BY_DROPSITE.update({d: _w for d in _w.window['dropsites']})
+    _WINDOW_BY_ZIP.update({z: _w for z in _w.window['homeDeliveryZips']})
+
+_PICKUP_DAY_BY_DROPSITE = {d['name']: d['pickupDay'] for d in settings.DROPSITES}
+_HOME_DELIVERY_DAY = settings.HOME_DELIVERY_DAY
+
+# (date, {window id: (start, end)})
+_periods = None
+
+
+def _get_window(drop_site=None, zip=None):
+    if drop_site is None and zip is None:
+        raise Exception('Either drop_site or zip is required')
+
+    window = _WINDOW_BY_ZIP.get(zip) if zip else _WINDOW_BY_DROPSITE.get(drop_site)
+    if window is None and _WINDOWS:
+        # a location that isn't in any window has always been given the last window
+        window = _WINDOWS[-1]
+    return window
+
+
+def _get_period(window, now):
+    global _periods
+
+    if now is not None:
+        return window.get_period(now)
+
+    today = datetime.date.today()
+    periods = _periods
+    if periods is None or periods[0] != today:
+        now = datetime.datetime.now()
+        periods = (now.date(), {w.id: w.get_period(now) for w in _WINDOWS})
+        _periods = periods
+
+    return periods[1][window.id]
+
+
+def get_order_window(drop_site=None, zip=None):
+    """
+    :return: the settings.ORDER_WINDOWS entry for the drop site or home delivery zip
+    """
+    window = _get_window(drop_site, zip)
+    return window.window if window else None
+
+
+def get_order_period(drop_site=None, zip=None, now=None):
+    """
+    :return: (start, end) datetimes of the current order window for the drop site or home delivery zip
+    """
+    window = _get_window(drop_site, zip)
+    if window is None:
+        return None, None
+    return _get_period(window, now)
+
+
+def is_order_window(drop_site=None, zip=None, now=None):
+    """
+    :return: True if the order window for the drop site or home delivery zip is currently open
+    """
+    window = _WINDOW_BY_ZIP.get(zip) if zip else _WINDOW_BY_DROPSITE.get(drop_site)
+    if window is None:
+        return False
+
+    start, end = _get_period(window, now)
+    return start <= (now or datetime.datetime.now()) <= end
+
+
+def get_pickup_day(drop_site=None, zip=None):
+    """
+    :return: the day of the week (1 (Monday) - 7 (Sunday)) orders are picked up from the drop site, or delivered to
+             the zip
+    """
+    if zip:
+        return _HOME_DELIVERY_DAY.get(zip, _HOME_DELIVERY_DAY['default'])
+    return _PICKUP_DAY_BY_DROPSITE[drop_site]
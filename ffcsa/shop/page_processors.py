@@ -2,14 +2,12 @@ from __future__ import unicode_literals
 
 from django import forms
 from django.contrib.messages import info, error
-from django.template.defaultfilters import slugify
 
-from mezzanine.conf import settings
 from mezzanine.pages.page_processors import processor_for
-from mezzanine.utils.views import paginate
 
+from ffcsa.shop import catalog
 from ffcsa.shop.forms import AddProductForm
-from ffcsa.shop.models import Category, Product, ProductVariation
+from ffcsa.shop.models import Category, ProductVariation
 from ffcsa.shop.orders import user_can_order
 from ffcsa.shop.utils import recalculate_cart
 
@@ -19,24 +17,13 @@ def category_processor(request, page):
     """
     Add paging/sorting to the products for the category.
     """
-    settings.clear_cache()
-    products = Product.objects \
-        .published(for_user=request.user) \
-        .filter(page.category.filters()) \
-        .filter(available=True) \
-        .prefetch_related('variations__vendorproductvariation_set') \
-        .prefetch_related('categories__parent__category') \
-        .distinct()
-
-    sort_options = [(slugify(option[0]), option[1])
-                    for option in settings.SHOP_PRODUCT_SORT_OPTIONS]
-    sort_by = request.GET.get(
-        "sort", sort_options[0][1] if sort_options else '-date_added')
-    products = paginate(products.order_by(sort_by),
-                        request.GET.get("page", 1),
-                        settings.SHOP_PER_PAGE_CATEGORY,
-                        settings.MAX_PAGING_LINKS)
+    sort_options = catalog.get_sort_options()
+    sort_by = request.GET.get("sort")
+    if sort_by not in sort_options:
+        sort_by = sort_options[0] if sort_options else '-date_added'
+    products = catalog.get_category_products(page.category, sort_by, request.GET.get("page", 1), request.user)
 
+    # the cached listing is the same for everyone, so add the forms & live stock for this user
     for product in products.object_list:
         initial_data = {'quantity': 1}
         product.add_form = AddProductForm(None, product=product, initial=initial_data, cart=request.cart,
@@ -75,13 +62,15 @@ def category_processor(request, page):
         elif not sku:
             error(request, "Please select a product")
 
+    catalog.prefetch_live_stock(v for product in products.object_list for v in product.variations.all())
     products.sort_by = sort_by
-    sub_categories = page.category.children.published()
-    child_categories = Category.objects.filter(id__in=sub_categories, products__available=True).distinct()
+    child_categories = catalog.get_child_categories(page.category)
 
     can_order_dairy = request.user.is_authenticated() and request.user.profile.can_order_dairy
     return {
         "products": products,
         "child_categories": child_categories,
-        "can_order_dairy": can_order_dairy
+        "can_order_dairy": can_order_dairy,
+        "catalog_version": catalog.get_version(),
+        "catalog_cache_ttl": catalog.CACHE_TTL,
     }
@@ -0,0 +1,78 @@
+import os
+import shutil
+import tempfile
+
+from PyPDF2 import PdfFileMerger
+
+
+class PdfAssembler(object):
+    """
+    Incrementally assembles a single pdf from rendered weasyprint documents.
+
+    Documents are written to temporary files in small batches as they are added, so only a handful of document
+    layouts need to be kept in memory at once. The parts, including their bookmarks, are concatenated when the final
+    pdf is written.
+
+    usage:
+        with PdfAssembler() as assembler:
+            for doc in docs:
+                assembler.add(doc)
+            path = assembler.write()
+    """
+
+    # number of documents to combine into a single part. PdfFileMerger keeps every part open
+    # until the merged pdf is written, so this keeps the number of open files down
+    docs_per_part = 20
+
+    def __init__(self):
+        self.dir = tempfile.mkdtemp(prefix='ffcsa_pdf_')
+        self.parts = []
+        self._pending = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.cleanup()
+
+    def _new_path(self):
+        return os.path.join(self.dir, '{:06d}.pdf'.format(len(self.parts)))
+
+    def add(self, document):
+        self._pending.append(document)
+        if len(self._pending) >= self.docs_per_part:
+            self.flush()
+
+    def flush(self):
+        """
+        Write any pending documents to disk
+        """
+        if not self._pending:
+            return
+
+        doc = self._pending[0]
+        doc = doc.copy([p for d in self._pending for p in d.pages])  # uses the metadata from doc
+        path = self._new_path()
+        doc.write_pdf(path)
+        self.parts.append(path)
+        self._pending = []
+
+    def write(self, path=None):
+        """
+        Concatenate all parts into a single pdf, returning the path it was written to
+        """
+        self.flush()
+        if path is None:
+            path = os.path.join(self.dir, 'assembled.pdf')
+
+        merger = PdfFileMerger(strict=False)
+        try:
+            for part in self.parts:
+                merger.append(part, import_bookmarks=True)
+            merger.write(path)
+        finally:
+            merger.close()
+        return path
+
+    def cleanup(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
@@ -1,99 +1,116 @@
 import logging
+import threading
+import time
 from collections import namedtuple, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from itertools import groupby
 
 from ffcsa.shop.fields import MoneyField
 from django.conf import settings
-from django.core.mail import EmailMessage
+from django.core.mail import EmailMessage, get_connection
 from django.db.models import Sum, Q, Case, When, IntegerField, Value, Subquery, OuterRef, F, ExpressionWrapper
-from django.template.loader import select_template, get_template
 from weasyprint import HTML
 
 from ffcsa.shop.models import OrderItem, Vendor, Product, Order
+from ffcsa.shop.utils import get_report_template
 from ffcsa.core.views import product_keySort
 
 logger = logging.getLogger(__name__)
 
 
 def generate_weekly_order_reports(date):
+    vendor_orders, reports = iter_weekly_order_reports(date)
+    docs = list(reports)
+
+    doc = docs[0]
+    doc = doc.copy([p for d in docs for p in d.pages])  # uses the metadata from doc
+
+    return vendor_orders, doc
+
+
+def iter_weekly_order_reports(date):
+    """
+    Returns the vendor orders and a generator which renders each weekly report document in order.
+
+    This allows callers to write each report as it is generated instead of keeping
+    every report's layout in memory at once.
+    """
     qs = OrderItem.objects \
         .filter(order__time__date=date) \
         .values('description', 'category', 'vendor', 'vendor_price', 'in_inventory') \
         .annotate(total_price=Sum(ExpressionWrapper(F('vendor_price') * F('quantity'), output_field=MoneyField()))) \
         .annotate(quantity=Sum('quantity'))
 
-    # zip_files = []
-    docs = []
-
     # generate orders & pickup sheets
     vendor_orders = list(get_vendor_orders(date, qs))
 
+    return vendor_orders, _generate_reports(date, qs, vendor_orders)
+
+
+def _generate_reports(date, qs, vendor_orders):
+    # zip_files = []
+
     for vo in vendor_orders:
         # send_order_to_vendor(order.write_pdf(), vendor, vendor_title, date)
-        docs.append(vo.pickuplist)
+        yield vo.pickuplist
         # zip_files.append(("{}_pickup_list_{}.pdf".format(vendor_title, date), pickuplist))
         # we need 2 of these
         if vo.vendor_title.lower() == 'deck family farm':
             # for some reason this doesn't render the title???
-            docs.append(vo.pickuplist.copy())
+            yield vo.pickuplist.copy()
             # zip_files.append(("{}_pickup_list_karina_{}.pdf".format(vendor_title, date), pickuplist))
 
     # generate packing lists
 
     # Woven Roots pack sheet
     # zip_files.append(("woven_roots_dairy_packlist_{}.pdf".format(date), generate_woven_roots_dairy_packlist(date)))
-    docs.append(generate_woven_roots_dairy_packlist(date))
+    yield generate_woven_roots_dairy_packlist(date)
 
     # frozen items bulk list
     # zip_files.append(("frozen_bulk_{}_packlist.pdf".format(date), generate_frozen_items_report(date, qs)))
-    # docs.append(generate_frozen_items_report(date, qs))
+    # yield generate_frozen_items_report(date, qs)
 
     # FFCSA Inventory Products
     # zip_files.append(("ffcsa_inventory_{}.pdf".format(date), generate_ffcsa_inventory_packlist(date, qs)))
-    docs.append(generate_ffcsa_inventory_packlist(date, qs))
+    yield generate_ffcsa_inventory_packlist(date, qs)
 
     # DFF Dairy totals sheet
     # zip_files.append(("dff_dairy_packlist_{}.pdf".format(date), generate_dff_dairy_packlist(date)))
-    docs.append(generate_dff_dairy_packlist(date))
+    yield generate_dff_dairy_packlist(date)
 
     # Dairy pack sheet
     # zip_files.append(("dairy_packlist_{}.pdf".format(date), generate_dairy_packlist(date)))
-    docs.append(generate_dairy_packlist(date))
+    yield generate_dairy_packlist(date)
 
     # Frozen items pack sheet
-    # docs.append(generate_frozen_items_packlist(date, qs))
-    docs.extend(generate_frozen_items_packlist(date, qs))
+    # yield generate_frozen_items_packlist(date, qs)
+    yield from generate_frozen_items_packlist(date, qs)
 
     # Grain & Bean Sheet
     # zip_files.append(("grain_and_bean_packlist_{}.pdf".format(date), generate_grain_and_bean_packlist(date)))
-    # docs.append(generate_grain_and_bean_packlist(date, qs))
+    # yield generate_grain_and_bean_packlist(date, qs)
 
     # Market Checklists
     checklist = generate_market_checklists(date)
     # zip_files.append(("market_checklists_{}.pdf".format(date), checklist))
     if checklist:
-        docs.append(checklist)
+        yield checklist
 
     # checklist = generate_home_delivery_checklists(date)
     # if checklist:
-    #     docs.append(checklist)
+    #     yield checklist
 
     # notes = generate_home_delivery_notes(date)
     # if notes:
-    #     docs.append(notes)
+    #     yield notes
 
     checklist = generate_master_checklist(date)
     if checklist:
-        docs.append(checklist)
+        yield checklist
 
     # Packing Order Sheet
     # zip_files.append(("product_order_{}.pdf".format(date), generate_product_order(date)))
-    docs.append(generate_product_order(date))
-
-    doc = docs[0]
-    doc = doc.copy([p for d in docs for p in d.pages])  # uses the metadata from doc
-
-    return vendor_orders, doc
+    yield generate_product_order(date)
 
     # for file, contents in zip_files:
     #     with tempfile.NamedTemporaryFile(
@@ -141,17 +158,17 @@ def get_vendor_orders(date, qs):
 
         # send order to vendor
 
-        html = select_template([
+        html = get_report_template(
             "shop/reports/{}_vendor_order_pdf.html".format(vendor_title.lower()),
             "shop/reports/vendor_order_pdf.html"
-        ]).render(context)
+        ).render(context)
         order = HTML(string=html).render()
 
         # generate a pickup list
-        html = select_template([
+        html = get_report_template(
             "shop/reports/{}_vendor_pickup_list_pdf.html".format(vendor_title.replace(' ', '_').lower()),
             "shop/reports/vendor_pickup_list_pdf.html"
-        ]).render(context)
+        ).render(context)
         pickuplist = HTML(string=html).render()
 
         yield VendorOrder(order, pickuplist, vendor_title, vendor)
@@ -172,7 +189,7 @@ def generate_ffcsa_inventory_packlist(date, qs):
         "items": items,
         "date": date,
     }
-    html = get_template("shop/reports/ffcsa_inventory_packlist_pdf.html").render(context)
+    html = get_report_template("shop/reports/ffcsa_inventory_packlist_pdf.html").render(context)
     return HTML(string=html).render()
 
 
@@ -195,7 +212,7 @@ def generate_dairy_packlist(date):
         'date': date
     }
 
-    html = get_template("shop/reports/dairy_packlist_pdf.html").render(context)
+    html = get_report_template("shop/reports/dairy_packlist_pdf.html").render(context)
     return HTML(string=html).render()
 
 
@@ -205,7 +222,7 @@ def generate_frozen_items_report(date, qs):
         "items": items,
         "date": date,
     }
-    html = get_template("shop/reports/dff_order_ticket_pdf.html").render(context)
+    html = get_report_template("shop/reports/dff_order_ticket_pdf.html").render(context)
     return HTML(string=html).render()
 
 
@@ -259,7 +276,7 @@ def generate_frozen_items_packlist(date, qs):
             'items': items,
             'num_of_orders': len(items)
         })
-        html = get_template("shop/reports/frozen_item_packlist_pdf.html").render(context)
+        html = get_report_template("shop/reports/frozen_item_packlist_pdf.html").render(context)
         yield HTML(string=html).render()
 
 
@@ -279,7 +296,7 @@ def generate_dff_dairy_packlist(date):
         'items': order_items,
         'date': date
     }
-    html = get_template("shop/reports/dff_dairy_packlist_pdf.html").render(context)
+    html = get_report_template("shop/reports/dff_dairy_packlist_pdf.html").render(context)
     return HTML(string=html).render()
 
 
@@ -298,7 +315,7 @@ def generate_woven_roots_dairy_packlist(date):
         'items': order_items,
         'date': date
     }
-    html = get_template("shop/reports/woven_roots_dairy_packlist_pdf.html").render(context)
+    html = get_report_template("shop/reports/woven_roots_dairy_packlist_pdf.html").render(context)
     return HTML(string=html).render()
 
 
@@ -321,7 +338,7 @@ def generate_grain_and_bean_packlist(date):
         'items': order_items,
         'date': date
     }
-    html = get_template("shop/reports/grain_and_bean_packlist_pdf.html").render(context)
+    html = get_report_template("shop/reports/grain_and_bean_packlist_pdf.html").render(context)
     return HTML(string=html).render()
 
 
@@ -339,7 +356,7 @@ def generate_product_order(date):
         'date': date,
     }
 
-    html = get_template("shop/reports/product_order_list_pdf.html").render(context)
+    html = get_report_template("shop/reports/product_order_list_pdf.html").render(context)
     return HTML(string=html).render()
 
 
@@ -355,7 +372,7 @@ def generate_home_delivery_notes(date):
     if len(orders) == 0:
         return
 
-    html = get_template("shop/reports/home_delivery_instructions_pdf.html").render(
+    html = get_report_template("shop/reports/home_delivery_instructions_pdf.html").render(
         {'orders': orders, 'drop_site': drop_site})
     return HTML(string=html).render()
 
@@ -385,7 +402,7 @@ def generate_home_delivery_checklists(date):
         'date': date,
     }
 
-    html = get_template("shop/reports/home_delivery_checklist_pdf.html").render(context)
+    html = get_report_template("shop/reports/home_delivery_checklist_pdf.html").render(context)
     return HTML(string=html).render()
 
 
@@ -417,7 +434,7 @@ def generate_market_checklists(date):
             'date': date,
         }
 
-        html = get_template("shop/reports/market_checklist_pdf.html").render(context)
+        html = get_report_template("shop/reports/market_checklist_pdf.html").render(context)
         checklists.append(HTML(string=html).render())
 
     if len(checklists) > 0:
@@ -525,44 +542,141 @@ def generate_master_checklist(date):
         'date': date,
     }
 
-    html = get_template("shop/reports/master_checklist_pdf.html").render(context)
+    html = get_report_template("shop/reports/master_checklist_pdf.html").render(context)
     return HTML(string=html).render()
 
 
-def send_order_to_vendor(order, vendor, vendor_title, date):
+VendorDelivery = namedtuple('VendorDelivery', ['vendor_title', 'status', 'attempts', 'error'])
+
+# vendor order delivery statuses
+SENT = 'sent'
+SKIPPED = 'skipped'
+SENT_TO_FFCSA = 'sent to ffcsa'
+FAILED = 'failed'
+
+VENDOR_ORDER_WORKERS = 4
+VENDOR_ORDER_RETRIES = 2
+VENDOR_ORDER_BACKOFF = 5  # seconds
+
+
+def send_orders_to_vendors(vendor_orders, date, max_workers=VENDOR_ORDER_WORKERS):
+    """
+    Concurrently email each vendor order, so a slow or failing vendor mailbox does not hold up the other vendors.
+
+    Each worker thread re-uses a single smtp connection. Once all orders have been sent, a delivery report
+    is emailed to us. Returns a list of VendorDelivery
+    """
+    local = threading.local()
+    connections = []
+    lock = threading.Lock()
+
+    def get_thread_connection():
+        if not hasattr(local, 'connection'):
+            local.connection = get_connection()
+            with lock:
+                connections.append(local.connection)
+        return local.connection
+
+    def send(vo, order):
+        try:
+            return send_order_to_vendor(order, vo.vendor, vo.vendor_title, date, connection=get_thread_connection(),
+                                        retries=VENDOR_ORDER_RETRIES)
+        except Exception as e:
+            logger.exception(e)
+            return VendorDelivery(vo.vendor_title, FAILED, 0, e)
+
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            # the pdfs are written here so the sending overlaps with rendering the next order
+            futures = [executor.submit(send, vo, vo.order.write_pdf()) for vo in vendor_orders]
+            deliveries = [f.result() for f in futures]
+    finally:
+        for connection in connections:
+            connection.close()
+
+    send_vendor_delivery_report(deliveries, date)
+    return deliveries
+
+
+def send_vendor_delivery_report(deliveries, date):
+    lines = ["{}: {}{}".format(d.vendor_title, d.status, " ({})".format(d.error) if d.error else "")
+             for d in sorted(deliveries, key=lambda d: (d.status, d.vendor_title))]
+
+    subject = "Vendor Order Delivery Report - {}".format(date)
+    if any(d.status in (SENT_TO_FFCSA, FAILED) for d in deliveries):
+        subject = "URGENT: " + subject
+
+    EmailMessage(subject, "\n".join(lines), settings.DEFAULT_FROM_EMAIL, (settings.DEFAULT_FROM_EMAIL,)).send()
+
+
+def _send_with_retries(msg, retries):
     """
-    Attempt to email the order to the vendor if appropriate
+    Attempt to send the msg, retrying with exponential backoff. Returns the number of
+    attempts made and the last error, or None if the msg was sent
+    """
+    error = None
+    for attempt in range(retries + 1):
+        if attempt > 0:
+            time.sleep(VENDOR_ORDER_BACKOFF * 2 ** (attempt - 1))
+        try:
+            if msg.connection:
+                # re-open the connection if a previous send failed
+                msg.connection.open()
+            msg.send()
+            return attempt + 1, None
+        except Exception as e:
+            logger.warning("Failed to send '{}' (attempt {}): {}".format(msg.subject, attempt + 1, e))
+            error = e
+            if msg.connection:
+                msg.connection.close()
+
+    return retries + 1, error
+
+
+def send_order_to_vendor(order, vendor, vendor_title, date, connection=None, retries=0):
+    """
+    Attempt to email the order to the vendor if appropriate. Returns a VendorDelivery
     """
 
     to = (settings.DEFAULT_FROM_EMAIL,)
     bcc = (settings.DEFAULT_FROM_EMAIL,)
     subject = "FFCSA Order for {}".format(date)
+    status = SENT
 
     if vendor:
         if not vendor.auto_send_order:
-            return
+            return VendorDelivery(vendor_title, SKIPPED, 0, None)
         to = (vendor.email,)
     else:
         subject = "URGENT FAILED TO SEND TO VENDOR: " + subject
+        status = SENT_TO_FFCSA
 
     msg = EmailMessage(subject,
                        "Our order for {} is attached.\n\nThanks,\nThe FFCSA team".format(date),
-                       settings.DEFAULT_FROM_EMAIL, to, bcc=bcc)
+                       settings.DEFAULT_FROM_EMAIL, to, bcc=bcc, connection=connection)
     msg.attach("{}_ffcsa_order_{}.pdf".format(vendor_title, date), order, mimetype='application/pdf')
+
+    attempts, error = _send_with_retries(msg, retries)
+    if error is None:
+        return VendorDelivery(vendor_title, status, attempts, None)
+
+    # Try to send attachment to ourselves
+    logger.error(error)
+    msg.subject = "URGENT FAILED TO SEND TO VENDOR: " + msg.subject
+    msg.to = (settings.DEFAULT_FROM_EMAIL,)
+    msg.cc = (settings.ADMINS[0][1],)
+
+    _, e = _send_with_retries(msg, 0)
+    if e is None:
+        return VendorDelivery(vendor_title, SENT_TO_FFCSA, attempts, error)
+
+    # Try to send a notification to ourselves
+    logger.error(e)
     try:
-        msg.send()
+        EmailMessage("URGENT: FAILED TO SEND ORDER FOR {}".format(vendor_title),
+                     "Was not able to send order attachment. You will need to manually send this",
+                     settings.DEFAULT_FROM_EMAIL, msg.to, msg.cc, connection=connection).send()
     except Exception as e:
-        # Try to send attachment to ourselves
         logger.error(e)
-        msg.subject = "URGENT FAILED TO SEND TO VENDOR: " + msg.subject
-        msg.to = (settings.DEFAULT_FROM_EMAIL,)
-        msg.cc = (settings.ADMINS[0][1],)
 
-        try:
-            msg.send()
-        except Exception as e:
-            # Try to send a notification to ourselves
-            logger.error(e)
-            EmailMessage("URGENT: FAILED TO SEND ORDER FOR {}".format(vendor_title),
-                         "Was not able to send order attachment. You will need to manually send this",
-                         settings.DEFAULT_FROM_EMAIL, msg.to, msg.cc).send()
+    return VendorDelivery(vendor_title, FAILED, attempts, error)
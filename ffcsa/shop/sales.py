@@ -0,0 +1,49 @@
+"""
+Sale scheduling.
+
+Products & variations store the price members pay in the indexed effective_price column, so prices can be read,
+filtered & sorted without checking the sale dates. The effective price is set when a product, variation or Sale is
+saved, and update_effective_prices flips it to the sale price or back to the unit price when a sale starts or ends.
+It is run every minute by the update_sale_prices command.
+"""
+from django.db.models import F, Q
+from django.utils.timezone import now
+
+from ffcsa.shop import catalog
+from ffcsa.shop.models import Product, ProductVariation
+
+
+def sale_in_effect(at):
+    """
+    Returns a Q object matching the priced objects whose sale price applies at the given time. This is the same as
+    Priced.sale_in_effect
+    """
+    valid_from = Q(sale_from__isnull=True) | Q(sale_from__lte=at)
+    valid_to = Q(sale_to__isnull=True) | Q(sale_to__gt=at)
+    return Q(sale_price__isnull=False) & valid_from & valid_to
+
+
+def update_effective_prices(at=None):
+    """
+    Set the effective price of the products & variations whose sale started or ended since the last update.
+
+    :return: the number of products & variations updated
+    """
+    in_effect = sale_in_effect(at or now())
+    updated = 0
+    for priced_model in (Product, ProductVariation):
+        # plain UPDATE ... WHERE statements without subqueries, so these also work on MySQL
+        updated += priced_model.objects \
+            .filter(in_effect) \
+            .exclude(effective_price=F('sale_price')) \
+            .update(effective_price=F('sale_price'))
+        updated += priced_model.objects \
+            .exclude(in_effect) \
+            .filter(unit_price__isnull=False) \
+            .exclude(effective_price=F('unit_price')) \
+            .update(effective_price=F('unit_price'))
+
+    if updated:
+        # the prices are updated in bulk, which doesn't send any signals
+        catalog.bump_version()
+    return updated
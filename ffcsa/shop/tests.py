@@ -1,16 +1,25 @@
 from __future__ import division, unicode_literals
 from future.builtins import range, zip
 
-from datetime import timedelta
+import json
+import os
+import time
+from collections import deque
+from datetime import datetime, timedelta
 from decimal import Decimal
 from operator import mul
 from functools import reduce
 from unittest import skipUnless
+from unittest.mock import patch
 
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
 from django.core.urlresolvers import reverse
-from django.test import TestCase
+from django.db import connection
+from django.test import TestCase, tag
 from django.test.client import RequestFactory
-from django.utils.timezone import now
+from django.test.utils import CaptureQueriesContext
+from django.utils.timezone import localtime, now
 from django.utils.translation import ugettext_lazy as _
 from mezzanine.conf import settings
 from mezzanine.core.models import CONTENT_STATUS_PUBLISHED
@@ -21,10 +30,15 @@ from mezzanine.utils.tests import run_pep8_for_package
 from ffcsa.shop.models import Product, ProductOption, ProductVariation
 from ffcsa.shop.models import ProductImage
 from ffcsa.shop.models import Category, Cart, Order, DiscountCode
-from ffcsa.shop.models import Sale
+from ffcsa.shop.models import CartItem, Sale, Vendor
+from ffcsa.shop.models.Vendor import VendorCartItem
+from ffcsa.core.models import Payment, Profile
 from ffcsa.shop.forms import OrderForm
+from ffcsa.shop import catalog, order_calendar, sales
 from ffcsa.shop.checkout import CHECKOUT_STEPS
 from ffcsa.shop.utils import set_tax
+from ffcsa.shop.views import HAS_PDF
+from ffcsa.templatetags.shop_tags import _order_totals
 
 
 TEST_STOCK = 5
@@ -143,15 +157,20 @@ class ShopTests(TestCase):
         self._category.combined = True
         self._category.price_min = TEST_PRICE
         self.assertCategoryFilteredProducts(0)
+        # The bulk updates don't set the effective price, so run the sale
+        # scheduler after each.
         self._product.variations.all().update(unit_price=TEST_PRICE)
+        sales.update_effective_prices()
         self.assertCategoryFilteredProducts(1)
         n, d = now(), timedelta(days=1)
         tomorrow, yesterday = n + d, n - d
         self._product.variations.all().update(unit_price=0,
                                               sale_price=TEST_PRICE,
                                               sale_from=tomorrow)
+        sales.update_effective_prices()
         self.assertCategoryFilteredProducts(0)
         self._product.variations.all().update(sale_from=yesterday)
+        sales.update_effective_prices()
         self.assertCategoryFilteredProducts(1)
 
         # Clean up previously added filters and check that explicitly
@@ -402,14 +421,15 @@ class SaleTests(TestCase):
         product1 = Product(unit_price="1.27")
         product1.save()
 
-        ProductVariation(unit_price="1.27", product_id=product1.id).save()
-        ProductVariation(unit_price="1.27", product_id=product1.id).save()
+        # variation titles are unique per product
+        ProductVariation(unit_price="1.27", product_id=product1.id, _title="a").save()
+        ProductVariation(unit_price="1.27", product_id=product1.id, _title="b").save()
 
         product2 = Product(unit_price="1.27")
         product2.save()
 
-        ProductVariation(unit_price="1.27", product_id=product2.id).save()
-        ProductVariation(unit_price="1.27", product_id=product2.id).save()
+        ProductVariation(unit_price="1.27", product_id=product2.id, _title="a").save()
+        ProductVariation(unit_price="1.27", product_id=product2.id, _title="b").save()
 
         sale = Sale(
             title="30% OFF - Ken Bruce has gone mad!",
@@ -447,6 +467,436 @@ class SaleTests(TestCase):
         for variation in ProductVariation.objects.all():
             self.assertTrue(variation.sale_price)
 
+    def test_sale_update_in_chunks(self):
+        """
+        The sale is applied & cleared by id in chunks, skipping prices
+        that would be negative after the deduction.
+        """
+        cheap = Product.objects.create(unit_price="0.50")
+        ProductVariation.objects.create(unit_price="0.50", product=cheap)
+
+        sale = Sale.objects.all()[0]
+        sale.products.add(cheap)
+        sale.discount_percent = None
+        sale.discount_deduct = "1.00"
+        sale.active = True
+        with patch.object(Sale, "UPDATE_CHUNK_SIZE", 2):
+            sale.save()
+
+        for priced in list(Product.objects.all()) + list(ProductVariation.objects.all()):
+            if priced.unit_price == Decimal("0.50"):
+                self.assertIsNone(priced.sale_id)
+            else:
+                self.assertEqual(priced.sale_id, sale.id)
+                self.assertEqual(priced.sale_price, Decimal("0.27"))
+
+        sale.active = False
+        with patch.object(Sale, "UPDATE_CHUNK_SIZE", 2):
+            sale.save()
+
+        self.assertFalse(Product.objects.filter(sale_id=sale.id).exists())
+        self.assertFalse(ProductVariation.objects.filter(sale_id=sale.id).exists())
+        self.assertFalse(ProductVariation.objects.filter(sale_price__isnull=False).exists())
+
+    def test_sale_scheduled(self):
+        """
+        The sale price becomes the effective price when the sale starts,
+        and the unit price again when it ends.
+        """
+        n, d = now(), timedelta(days=1)
+        sale = Sale.objects.all()[0]
+        sale.active = True
+        sale.valid_from = n + d
+        sale.valid_to = n + d * 2
+        sale.save()
+
+        def assertPrice(price, on_sale):
+            for priced in list(Product.objects.all()) + list(ProductVariation.objects.all()):
+                self.assertEqual(priced.price(), Decimal(price))
+                self.assertEqual(priced.on_sale(), on_sale)
+
+        assertPrice("1.27", False)
+        self.assertEqual(sales.update_effective_prices(), 0)
+
+        self.assertEqual(sales.update_effective_prices(at=n + d), 6)
+        assertPrice("0.89", True)
+        self.assertEqual(sales.update_effective_prices(at=n + d), 0)
+
+        self.assertEqual(sales.update_effective_prices(at=n + d * 2), 6)
+        assertPrice("1.27", False)
+
+
+class CartAddItemsTests(TestCase):
+
+    def setUp(self):
+        user = get_user_model().objects.create_user("member", "member@example.com", "password")
+        Payment.objects.create(user=user, amount=Decimal("50"))
+        vendor = Vendor.objects.create(title="vendor", email="vendor@example.com")
+
+        self._variations = []
+        for i in range(3):
+            product = Product.objects.create(title="product %s" % i, available=True,
+                                             status=CONTENT_STATUS_PUBLISHED)
+            variation = product.variations.create(unit_price=Decimal("10"), default=True)
+            variation.vendorproductvariation_set.create(vendor=vendor, num_in_stock=2)
+            self._variations.append(variation)
+
+        self._cart = Cart.objects.create(last_updated=now(), user_id=user.id)
+
+    def test_add_items(self):
+        unavailable, out_of_stock, added = self._variations
+        unavailable.product.available = False
+        unavailable.product.save()
+
+        results = self._cart.add_items([(unavailable, 1), (out_of_stock, 3), (added, 2)])
+
+        self.assertEqual([Cart.UNAVAILABLE, Cart.OUT_OF_STOCK, Cart.ADDED], [r.status for r in results])
+        cart = Cart.objects.get(id=self._cart.id)
+        self.assertEqual(2, cart.total_quantity())
+        self.assertEqual(0, ProductVariation.objects.get(id=added.id).live_num_in_stock())
+
+    def test_over_budget_stops_adding(self):
+        results = self._cart.add_items([(v, 2) for v in self._variations])
+
+        self.assertEqual([Cart.ADDED, Cart.ADDED, Cart.OVER_BUDGET], [r.status for r in results])
+        cart = Cart.objects.get(id=self._cart.id)
+        self.assertEqual(4, cart.total_quantity())
+
+    def test_quantity_is_set_like_add_item(self):
+        variation = self._variations[0]
+        self._cart.add_item(variation, 2)
+
+        results = self._cart.add_items([(variation, 1)])
+
+        self.assertEqual([Cart.ADDED], [r.status for r in results])
+        cart = Cart.objects.get(id=self._cart.id)
+        self.assertEqual(1, cart.total_quantity())
+        self.assertEqual(1, ProductVariation.objects.get(id=variation.id).live_num_in_stock())
+
+    def test_pricing_is_calculated_once(self):
+        discount = DiscountCode.objects.create(title="test", code="test", active=True, discount_percent=10)
+        Profile.objects.filter(user_id=self._cart.user_id).update(discount_code=discount)
+        self._cart.add_items([(self._variations[0], 2)])
+
+        pricing = self._cart.pricing()
+        self.assertEqual("test", pricing.discount_code)
+        self.assertEqual(Decimal("2"), pricing.discount)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(Decimal("2"), self._cart.discount())
+            self.assertEqual(pricing.total, self._cart.total_price())
+            self.assertEqual(Decimal("18"), self._cart.total_price_after_discount())
+
+        # changing the items recalculates the pricing
+        self._cart.add_items([(self._variations[1], 1)])
+        self.assertEqual(Decimal("3"), self._cart.discount())
+
+
+class CartApiTests(TestCase):
+
+    def setUp(self):
+        user = get_user_model().objects.create_user("member", "member@example.com", "password")
+        Payment.objects.create(user=user, amount=Decimal("50"))
+        vendor = Vendor.objects.create(title="vendor", email="vendor@example.com")
+        product = Product.objects.create(title="product", available=True, status=CONTENT_STATUS_PUBLISHED)
+        variation = product.variations.create(sku="CART-API", unit_price=Decimal("10"), default=True)
+        variation.vendorproductvariation_set.create(vendor=vendor, num_in_stock=None)
+
+        self.client.login(username="member", password="password")
+        patcher = patch("ffcsa.shop.views.user_can_order", return_value=(True, ""))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_add_update_remove(self):
+        response = self.client.post(reverse("shop_cart_api_add"), {"variation": "CART-API", "quantity": 2})
+        self.assertEqual(200, response.status_code)
+        data = response.json()
+        self.assertEqual([2], [i["quantity"] for i in data["items"]])
+        self.assertEqual(2, data["totals"]["quantity"])
+        self.assertEqual(30, data["remaining_budget"])
+        item_id = data["items"][0]["id"]
+
+        # over budget
+        response = self.client.post(reverse("shop_cart_api_update", args=[item_id]), {"quantity": 6})
+        self.assertEqual(400, response.status_code)
+        self.assertTrue(response.json()["errors"])
+
+        response = self.client.post(reverse("shop_cart_api_update", args=[item_id]), {"quantity": 3})
+        data = response.json()
+        self.assertEqual([3], [i["quantity"] for i in data["items"]])
+        self.assertEqual(20, data["remaining_budget"])
+
+        response = self.client.get(reverse("shop_cart_api"))
+        self.assertEqual([item_id], [i["id"] for i in response.json()["items"]])
+
+        response = self.client.post(reverse("shop_cart_api_remove", args=[item_id]))
+        data = response.json()
+        self.assertEqual([], data["items"])
+        self.assertEqual([item_id], data["removed"])
+        self.assertEqual(0, data["totals"]["quantity"])
+
+    def test_stale_session_discount_code_is_dropped(self):
+        discount = DiscountCode.objects.create(title="stale", code="stale", active=True, discount_percent=50)
+        session = self.client.session
+        session["discount_code"] = discount.code
+        session["discount_total"] = "5.00"
+        session.save()
+
+        # a code posted to the cart doesn't stick either
+        self.client.post(reverse("shop_cart_api_add"), {"variation": "CART-API", "quantity": 1})
+        self.client.post(reverse("shop_cart"), {"discount_code": discount.code})
+        self.assertNotIn("discount_code", self.client.session)
+        self.assertNotIn("discount_total", self.client.session)
+
+        cart = Cart.objects.get(user_id=get_user_model().objects.get(username="member").id)
+        self.assertEqual(0, cart.discount())
+        # the cart page shows the member's pickup date
+        Profile.objects.filter(user__username="member").update(drop_site="Farm - Friday")
+        response = self.client.get(reverse("shop_cart"))
+        totals = _order_totals({"request": response.wsgi_request})
+        self.assertIsNone(totals["discount_total"])
+        self.assertEqual(Decimal("10"), totals["order_total"])
+
+        # the member's profile code is the discount
+        Profile.objects.filter(user__username="member").update(discount_code=discount)
+        self.client.post(reverse("shop_cart_api_add"), {"variation": "CART-API", "quantity": 2})
+        self.assertEqual("stale", self.client.session["discount_code"])
+        self.assertEqual(Decimal("10"), Decimal(self.client.session["discount_total"]))
+
+
+class CatalogTests(TestCase):
+
+    def setUp(self):
+        self._published = {"title": "test", "status": CONTENT_STATUS_PUBLISHED}
+        self._category = Category.objects.create(**self._published)
+        self._product = Product.objects.create(available=True, **self._published)
+        self._product.variations.create(unit_price="1.00", default=True)
+
+    def test_version_changes_with_catalog(self):
+        version = catalog.get_version()
+        self._product.save()
+        self.assertNotEqual(version, catalog.get_version())
+
+        version = catalog.get_version()
+        self._product.variations.create(unit_price="2.00", _title="Large")
+        self.assertNotEqual(version, catalog.get_version())
+
+        version = catalog.get_version()
+        self._product.categories.add(self._category)
+        self.assertNotEqual(version, catalog.get_version())
+
+    def test_category_listing_is_cached(self):
+        self._product.categories.add(self._category)
+
+        products = catalog.get_category_products(self._category, 'title', 1)
+        self.assertEqual([self._product.id], [p.id for p in products.object_list])
+
+        with self.assertNumQueries(0):
+            products = catalog.get_category_products(self._category, 'title', 1)
+            self.assertEqual(1, len(products.object_list[0].variations.all()))
+
+        self._product.available = False
+        self._product.save()
+        products = catalog.get_category_products(self._category, 'title', 1)
+        self.assertEqual([], products.object_list)
+
+    def test_discount_product_ids_are_cached(self):
+        other = Product.objects.create(available=True, **self._published)
+        discount = DiscountCode.objects.create(title="test", code="test", active=True, discount_percent=10)
+        discount.categories.add(self._category)
+        discount.products.add(other)
+        self.assertEqual([other.id], list(catalog.get_discount_product_ids(discount)))
+
+        with self.assertNumQueries(0):
+            ids = catalog.get_discount_product_ids(discount)
+        self.assertTrue(catalog.contains(ids, other.id))
+        self.assertFalse(catalog.contains(ids, self._product.id))
+
+        self._product.categories.add(self._category)
+        ids = catalog.get_discount_product_ids(discount)
+        self.assertEqual(sorted([self._product.id, other.id]), list(ids))
+        self.assertTrue(catalog.contains(ids, self._product.id))
+
+
+class OrderCalendarTests(TestCase):
+
+    def test_order_period(self):
+        # Tuesday
+        now = datetime(2020, 6, 2, 12)
+        start, end = order_calendar.get_order_period('Farm - Friday', now=now)
+        self.assertEqual(datetime(2020, 6, 2, 10), start)
+        self.assertEqual(datetime(2020, 6, 3, 23, 59, 59), end)
+        self.assertTrue(order_calendar.is_order_window('Farm - Friday', now=now))
+        self.assertFalse(order_calendar.is_order_window('W 11th', now=now))
+
+        # Thursday, the next window has not started yet
+        now = datetime(2020, 6, 4, 12)
+        start, end = order_calendar.get_order_period('Farm - Friday', now=now)
+        self.assertEqual(datetime(2020, 6, 9, 10), start)
+        self.assertEqual(datetime(2020, 6, 10, 23, 59, 59), end)
+        self.assertFalse(order_calendar.is_order_window('Farm - Friday', now=now))
+
+    def test_locations_are_indexed(self):
+        self.assertEqual(settings.ORDER_WINDOWS[1], order_calendar.get_order_window(zip='97401'))
+        self.assertEqual(settings.ORDER_WINDOWS[0], order_calendar.get_order_window(drop_site='LCFM'))
+        self.assertFalse(order_calendar.is_order_window(drop_site='Unknown'))
+
+        self.assertEqual(6, order_calendar.get_pickup_day(drop_site='LCFM'))
+        self.assertEqual(4, order_calendar.get_pickup_day(zip='97401'))
+        self.assertEqual(settings.HOME_DELIVERY_DAY['default'], order_calendar.get_pickup_day(zip='00000'))
+
+
+# Scale of the performance fixtures, roughly a busy order week
+PERF_MEMBERS = 300
+PERF_PRODUCTS = 500
+PERF_VENDORS = 10
+PERF_CATEGORIES = 10
+PERF_CART_LINES = 15
+
+# Upper bound on the number of queries of each flow, as (fixed queries, {unit: queries per unit}). These catch
+# changes that add queries per cart line, member, etc. Lower them as flows are optimized.
+#
+# The per unit budgets are the measured costs & the fixed budgets have a small margin. The baseline was measured
+# on sqlite by running the suite at several scales, and is noted as fixed + per unit = total at the scale above
+PERF_QUERY_BUDGETS = {
+    'add_to_cart': (65, {}),  # 58
+    'cart_view': (55, {'cart_line': 6}),  # 47 + 6 * 15 = 137
+    'category_page': (70, {'page_product': 1, 'cart_line': 3}),  # 61 + 1 * 20 + 3 * 15 = 126
+    'close_orders': (10, {'member': 23, 'line': 9}),  # 2 + 23 * 300 + 9 * 4500 = 47402
+    'generate_invoices': (10, {'member': 1, 'line': 6}),  # 3 + 1 * 300 + 6 * 4500 = 27303
+    'generate_weekly_order_reports': (25, {'vendor': 1}),  # 21 + 1 * 10 = 31
+}
+
+
+@tag('perf')
+class PerformanceTests(TestCase):
+    """
+    Query budgets & wall times of the member facing flows at a realistic scale.
+
+    Set FFCSA_PERF_REPORT to a file path to write the results as json, so they can be compared across commits.
+    """
+    results = {}
+
+    @classmethod
+    def setUpTestData(cls):
+        vendors = [Vendor.objects.create(title="Vendor %s" % i, email="vendor%s@example.com" % i)
+                   for i in range(PERF_VENDORS)]
+        cls.categories = [Category.objects.create(title="Category %s" % i, status=CONTENT_STATUS_PUBLISHED)
+                          for i in range(PERF_CATEGORIES)]
+
+        cls.variations = []
+        for i in range(PERF_PRODUCTS):
+            product = Product.objects.create(title="Product %s" % i, available=True,
+                                             status=CONTENT_STATUS_PUBLISHED)
+            product.categories.add(cls.categories[i % PERF_CATEGORIES])
+            variation = product.variations.create(unit_price=Decimal("5"), vendor_price=Decimal("4"), default=True)
+            variation.vendorproductvariation_set.create(vendor=vendors[i % PERF_VENDORS], num_in_stock=100000)
+            cls.variations.append(variation)
+
+        drop_sites = [d['name'] for d in settings.DROPSITES]
+        cls.members = []
+        for i in range(PERF_MEMBERS):
+            user = get_user_model().objects.create(username="member%s" % i, email="member%s@example.com" % i,
+                                                   first_name="Member", last_name="%s" % i)
+            Profile.objects.filter(user=user).update(drop_site=drop_sites[i % len(drop_sites)],
+                                                     signed_membership_agreement=True)
+            cls.members.append(user)
+        Payment.objects.bulk_create([Payment(user=user, amount=Decimal("1000")) for user in cls.members])
+
+        # full carts
+        carts = [Cart.objects.create(user_id=user.id, last_updated=now()) for user in cls.members]
+        CartItem.objects.bulk_create([
+            CartItem(cart=cart, variation=cls.variations[(i * PERF_CART_LINES + j) % PERF_PRODUCTS])
+            for i, cart in enumerate(carts) for j in range(PERF_CART_LINES)])
+        VendorCartItem.objects.bulk_create([
+            VendorCartItem(item_id=item_id, vendor_id=vendor_id, quantity=1, _order=0)
+            for item_id, vendor_id in CartItem.objects.values_list(
+                'id', 'variation__vendorproductvariation__vendor_id')])
+
+        cls.units = {
+            'member': PERF_MEMBERS,
+            'line': PERF_MEMBERS * PERF_CART_LINES,
+            'vendor': PERF_VENDORS,
+            'cart_line': PERF_CART_LINES,
+            'page_product': min(settings.SHOP_PER_PAGE_CATEGORY, PERF_PRODUCTS // PERF_CATEGORIES),
+        }
+
+    @classmethod
+    def tearDownClass(cls):
+        super(PerformanceTests, cls).tearDownClass()
+        path = os.environ.get('FFCSA_PERF_REPORT')
+        if path and cls.results:
+            scale = {'members': PERF_MEMBERS, 'products': PERF_PRODUCTS, 'vendors': PERF_VENDORS,
+                     'categories': PERF_CATEGORIES, 'cart_lines': PERF_CART_LINES}
+            with open(path, 'w') as f:
+                json.dump({'scale': scale, 'flows': cls.results}, f, indent=2, sort_keys=True)
+
+    def setUp(self):
+        catalog.bump_version()
+        patcher = patch("ffcsa.shop.orders.valid_order_period_for_user", return_value=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def assertWithinBudget(self, flow, func):
+        fixed, per_unit = PERF_QUERY_BUDGETS[flow]
+        budget = fixed + sum(queries * self.units[unit] for unit, queries in per_unit.items())
+
+        # the connection only logs the last 9000 queries, which the larger flows exceed
+        queries = deque()
+        with patch.object(connection, 'queries_log', queries), CaptureQueriesContext(connection):
+            start = time.time()
+            result = func()
+            seconds = time.time() - start
+
+        self.results[flow] = {'queries': len(queries), 'budget': budget, 'seconds': round(seconds, 3)}
+        self.assertLessEqual(len(queries), budget, "{} ran {} queries, the budget is {}".format(
+            flow, len(queries), budget))
+        return result
+
+    def test_add_to_cart(self):
+        self.client.force_login(self.members[0])
+        # the first member's cart holds the first PERF_CART_LINES variations
+        variation = self.variations[-1]
+
+        response = self.assertWithinBudget('add_to_cart', lambda: self.client.post(
+            reverse("shop_cart_api_add"), {"variation": variation.sku, "quantity": 1}))
+        self.assertEqual(200, response.status_code)
+
+    def test_cart_view(self):
+        self.client.force_login(self.members[0])
+
+        response = self.assertWithinBudget('cart_view', lambda: self.client.get(reverse("shop_cart")))
+        self.assertEqual(200, response.status_code)
+
+    def test_category_page(self):
+        self.client.force_login(self.members[0])
+
+        response = self.assertWithinBudget('category_page', lambda: self.client.get(
+            self.categories[0].get_absolute_url()))
+        self.assertEqual(200, response.status_code)
+
+    def test_close_orders(self):
+        self.assertWithinBudget('close_orders', lambda: call_command('cart'))
+        self.assertEqual(PERF_MEMBERS, Order.objects.count())
+
+    @skipUnless(HAS_PDF, "weasyprint is required")
+    def test_generate_invoices(self):
+        from ffcsa.shop.invoice import generate_invoices
+        call_command('cart')
+
+        invoices = self.assertWithinBudget('generate_invoices', lambda: list(generate_invoices(Order.objects.all())))
+        self.assertEqual(PERF_MEMBERS, len(invoices))
+
+    @skipUnless(HAS_PDF, "weasyprint is required")
+    def test_generate_weekly_order_reports(self):
+        from ffcsa.shop.reports import generate_weekly_order_reports
+        call_command('cart')
+        date = localtime(Order.objects.first().time).date()
+
+        vendor_orders, doc = self.assertWithinBudget('generate_weekly_order_reports',
+                                                     lambda: generate_weekly_order_reports(date))
+        self.assertEqual(PERF_VENDORS, len(vendor_orders))
+
 
 try:
     __import__("stripe")
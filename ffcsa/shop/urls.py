@@ -11,6 +11,12 @@ urlpatterns = [
     url("^product/(?P<slug>.*)%s$" % _slash, views.product,
         name="shop_product"),
     url("^cart%s$" % _slash, views.cart, name="shop_cart"),
+    url("^cart/api%s$" % _slash, views.cart_api, name="shop_cart_api"),
+    url("^cart/api/add%s$" % _slash, views.cart_api_add, name="shop_cart_api_add"),
+    url("^cart/api/items/(?P<item_id>\d+)%s$" % _slash, views.cart_api_update,
+        name="shop_cart_api_update"),
+    url("^cart/api/items/(?P<item_id>\d+)/remove%s$" % _slash, views.cart_api_remove,
+        name="shop_cart_api_remove"),
     url("^checkout%s$" % _slash, views.checkout_steps, name="shop_checkout"),
     url("^checkout/complete%s$" % _slash, views.complete,
         name="shop_complete"),
@@ -11,12 +11,34 @@ except ImportError:
     from md5 import new as digest
 
 from django.core.exceptions import ImproperlyConfigured
+from django.template.loader import select_template
 from django.utils.translation import ugettext as _
 
 from mezzanine.conf import settings
 from mezzanine.utils.importing import import_dotted_path
 
 
+_report_templates = {}
+
+
+def get_report_template(*names):
+    """
+    Returns the compiled template for the first of ``names`` that exists.
+
+    Report & pdf templates are resolved once per process. Results are memoized
+    under the full list of candidate names, so vendor specific templates that
+    don't exist are only looked for the first time they are requested.
+    """
+    if settings.DEBUG:
+        return select_template(names)
+
+    try:
+        return _report_templates[names]
+    except KeyError:
+        template = _report_templates[names] = select_template(names)
+        return template
+
+
 def make_choices(choices):
     """
     Zips a list with itself for field choices.
@@ -76,10 +98,18 @@ def recalculate_cart(request):
     request.cart = Cart.objects.from_request(request)
 
     discount_code = request.session.get("discount_code", "")
-    if discount_code:
+    names = ("free_shipping", "discount_code", "discount_total")
+    if request.user.is_authenticated():
+        # Members' discounts come from their profile discount code (see
+        # Cart.pricing), so replace any code entered or left in the session.
+        clear_session(request, *names)
+        pricing = request.cart.pricing()
+        if pricing.discount_code:
+            request.session["discount_code"] = pricing.discount_code
+            request.session["discount_total"] = str(pricing.discount)
+    elif discount_code:
         # Clear out any previously defined discount code
         # session vars.
-        names = ("free_shipping", "discount_code", "discount_total")
         clear_session(request, *names)
         discount_form = DiscountForm(request, {"discount_code": discount_code})
         if discount_form.is_valid():
@@ -7,25 +7,26 @@ from django.contrib.auth.decorators import login_required
 from django.contrib.messages import info, error
 from django.core.urlresolvers import reverse
 from django.db.models import Sum
-from django.http import Http404, HttpResponse, HttpResponseForbidden
+from django.http import Http404, HttpResponse, HttpResponseForbidden, JsonResponse
 from django.shortcuts import get_object_or_404, redirect
 from django.template.defaultfilters import slugify
 from django.template.loader import get_template
 from django.template.response import TemplateResponse
 from django.utils.translation import ugettext as _
 from django.views.decorators.cache import never_cache
+from django.views.decorators.http import require_GET, require_POST
 from mezzanine.conf import settings
 from mezzanine.utils.importing import import_dotted_path
 from mezzanine.utils.views import set_cookie, paginate
 from mezzanine.utils.urls import next_url
 
 from ffcsa.shop import checkout
-from ffcsa.shop.forms import (AddProductForm, CartItemFormSet,
-                              DiscountForm, OrderForm)
+from ffcsa.shop.forms import (ADD_PRODUCT_ERRORS, AddProductForm, CartItemForm,
+                              CartItemFormSet, DiscountForm, OrderForm)
 from ffcsa.shop.models import Product, ProductVariation, Order, Vendor
 from ffcsa.shop.models import DiscountCode
 from ffcsa.shop.orders import user_can_order
-from ffcsa.shop.utils import recalculate_cart, sign
+from ffcsa.shop.utils import recalculate_cart, recalculate_remaining_budget, sign
 
 from ffcsa.core.models import Payment
 from ffcsa.core.forms import CartDinnerForm
@@ -211,7 +212,6 @@ def cart(request, template="shop/cart.html",
         # 'dinner_week': get_friday_pickup_date().day <= 7
     }
     context.update(extra_context or {})
-    settings.clear_cache()
     if (settings.SHOP_DISCOUNT_FIELD_IN_CART and
             DiscountCode.objects.active().exists()):
         context["discount_form"] = discount_form
@@ -219,6 +219,148 @@ def cart(request, template="shop/cart.html",
     return TemplateResponse(request, template, context)
 
 
+def _cart_api_response(request, items=(), removed=()):
+    """
+    Only the changed cart lines are returned, along with the new cart totals & remaining budget
+    """
+    cart = request.cart
+    if request.session.get("remaining_budget") is None:
+        recalculate_remaining_budget(request)
+
+    return JsonResponse({
+        "items": [{
+            "id": item.id,
+            "sku": item.sku,
+            "description": item.description,
+            "quantity": item.quantity,
+            "unit_price": item.unit_price,
+            "total_price": item.total_price,
+        } for item in items],
+        "removed": list(removed),
+        "totals": {
+            "quantity": cart.total_quantity(),
+            "item_total": cart.item_total_price(),
+            "discount": cart.discount(),
+            "delivery_fee": cart.delivery_fee(),
+            "total": cart.total_price(),
+        },
+        "remaining_budget": request.session["remaining_budget"],
+    })
+
+
+def _cart_api_error(errors, status=400):
+    return JsonResponse({"errors": [str(e) for e in errors]}, status=status)
+
+
+def _cart_api_form_error(form):
+    return _cart_api_error([e for error_list in form.errors.values() for e in error_list])
+
+
+def _cart_api_check(request):
+    """
+    :return: an error response if the user can't modify their cart
+    """
+    can_order, err = user_can_order(request.user)
+    if not can_order:
+        return _cart_api_error([err], status=403)
+
+    if not request.cart.user_id:
+        request.cart.user_id = request.user.id
+    elif request.cart.user_id != request.user.id:
+        return _cart_api_error([_("Server Error")], status=403)
+
+
+def _get_cart_item(request, item_id):
+    if not request.cart.pk:
+        raise Http404
+    return get_object_or_404(request.cart.items.select_related('variation').prefetch_related('vendors'), id=item_id)
+
+
+@never_cache
+@require_GET
+def cart_api(request):
+    """
+    The cart lines, totals & remaining budget
+    """
+    if not request.user.is_authenticated():
+        return _cart_api_error([_("You must be logged in")], status=403)
+    return _cart_api_response(request, request.cart)
+
+
+@never_cache
+@require_POST
+def cart_api_add(request):
+    """
+    Add a variation to the cart. Expects the ``variation`` sku & ``quantity``
+    """
+    err = _cart_api_check(request)
+    if err:
+        return err
+
+    published_products = Product.objects.published(for_user=request.user)
+    try:
+        variation = ProductVariation.objects.select_related('product').get(
+            sku=request.POST.get("variation"), product__in=published_products)
+    except ProductVariation.DoesNotExist:
+        return _cart_api_error([_("No product found")], status=404)
+
+    form = AddProductForm(request.POST, product=variation.product, cart=request.cart)
+    if not form.is_valid():
+        return _cart_api_form_error(form)
+
+    request.cart.add_item(form.variation, form.cleaned_data["quantity"])
+    recalculate_cart(request)
+    item = request.cart.items.select_related('variation').prefetch_related('vendors').get(variation=form.variation)
+    return _cart_api_response(request, [item])
+
+
+@never_cache
+@require_POST
+def cart_api_update(request, item_id):
+    """
+    Set the ``quantity`` of a cart item. A quantity of 0 removes the item
+    """
+    err = _cart_api_check(request)
+    if err:
+        return err
+
+    item = _get_cart_item(request, item_id)
+    form = CartItemForm(request.POST, instance=item)
+    if not form.is_valid():
+        return _cart_api_form_error(form)
+
+    additional_total = item.unit_price * (form.cleaned_data["quantity"] - item.quantity)
+    if additional_total > 0 and request.cart.over_budget(additional_total):
+        return _cart_api_error([ADD_PRODUCT_ERRORS["over_budget"]])
+
+    form.save()
+    recalculate_cart(request)
+    if form.cleaned_data["quantity"] == 0:
+        # the deleted item no longer has an id
+        return _cart_api_response(request, removed=[int(item_id)])
+    return _cart_api_response(request, [item])
+
+
+@never_cache
+@require_POST
+def cart_api_remove(request, item_id):
+    """
+    Remove an item from the cart
+    """
+    err = _cart_api_check(request)
+    if err:
+        return err
+
+    item = _get_cart_item(request, item_id)
+    form = CartItemForm({"quantity": 0}, instance=item)
+    if not form.is_valid():
+        return _cart_api_form_error(form)
+
+    form.save()
+    recalculate_cart(request)
+    return _cart_api_response(request, removed=[int(item_id)])
+
+
 @never_cache
 def checkout_steps(request, form_class=OrderForm, extra_context=None):
     """
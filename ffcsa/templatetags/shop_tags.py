@@ -89,6 +89,11 @@ def _order_totals(context):
             for field in fields:
                 template_vars[field] = context["request"].session.get(
                     field, None)
+            # Members' discounts come from their profile discount code,
+            # not from a code stored in the session.
+            if context["request"].user.is_authenticated():
+                template_vars["discount_total"] = \
+                    context["request"].cart.discount() or None
     template_vars["order_total"] = template_vars.get("item_total", None)
     if template_vars.get("shipping_total", None) is not None:
         template_vars["order_total"] += Decimal(